@@ -1,9 +1,11 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import sqlite3
 import json
 import random
 import os
+import sys
 import urllib.request
 import base64
 import bcrypt
@@ -14,6 +16,19 @@ from contextlib import contextmanager
 from io import BytesIO
 from datetime import datetime
 import difflib
+import bisect
+import hashlib
+import unicodedata
+import zlib
+import threading
+import multiprocessing
+import csv
+import pickle
+import tempfile
+import copy
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 # --- AI Kütüphaneleri için Hata Yönetimi ---
 import google.generativeai as genai
@@ -23,6 +38,8 @@ from google.api_core import exceptions as api_exceptions # API Hata Yönetimi
 # --- Kütüphane Kontrolleri ve Importlar ---
 try:
     from fpdf import FPDF
+    import fpdf.fpdf as fpdf_module
+    from fpdf.ttfonts import TTFontFile
 except ImportError:
     st.error("❌ FPDF kütüphanesi yüklü değil! Konsola: pip install fpdf")
     st.stop()
@@ -42,6 +59,7 @@ try:
     from docx import Document
     from docx.shared import Pt, Inches, RGBColor
     from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.oxml.ns import qn
 except ImportError:
     st.warning("⚠️ Word çıktısı için 'python-docx' gerekli: pip install python-docx")
 
@@ -72,16 +90,42 @@ except ImportError:
 # ==============================================================================
 # 1. AYARLAR VE TASARIM
 # ==============================================================================
-st.set_page_config(
-    page_title="SSOP Pro v5.2: Enterprise",
-    page_icon="🎓",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# Süreç havuzu ve arka plan işçileri (forkserver/spawn) bu dosyayı '__mp_main__' olarak yükler; sayfa ayarı ve
+# veritabanı kurulumu gibi uygulama adımları yalnızca Streamlit'in çalıştırdığı ana betikte ('__main__') yapılır.
+if __name__ == "__main__":
+    st.set_page_config(
+        page_title="SSOP Pro v5.2: Enterprise",
+        page_icon="🎓",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
 DB_FILE = "ssop_v5.sqlite"
 FONT_FILENAME = "DejaVuSans.ttf"
-FONT_URL = "https://github.com/dejavu-fonts/dejavu-fonts/raw/master/ttf/DejaVuSans.ttf"
+FONT_BOLD_FILENAME = "DejaVuSans-Bold.ttf"
+# Fontlar sabit bir sürümün (2.37) yayın arşivinden alınır; master dalındaki dosya değişse bile metrikler aynı kalır
+FONT_RELEASE_URL = "https://github.com/dejavu-fonts/dejavu-fonts/releases/download/version_2_37/dejavu-fonts-ttf-2.37.zip"
+FONT_RELEASE_MEMBERS = {FONT_FILENAME: "dejavu-fonts-ttf-2.37/ttf/DejaVuSans.ttf",
+                        FONT_BOLD_FILENAME: "dejavu-fonts-ttf-2.37/ttf/DejaVuSans-Bold.ttf"}
 OPTION_KEY_REGEX = r'^[A-Za-z]$' 
+REVISION_SNAPSHOT_INTERVAL = 10  # Her 10 revizyonda bir tam kopya, arada sadece fark (delta) saklanır
+REVISION_FIELDS = ('CourseCode', 'TopicArea', 'Complexity', 'QuestionType', 'Score', 'QuestionText', 'Options', 'CorrectAnswer')
+CONTENT_HASH_VERSION = "v2"  # ContentHash tanımı değişince sürüm artırılır; init_db eski özetleri yeniden hesaplar
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "ssop_exports")  # Diske akıtılan kitapçık/ZIP çıktıları
+STANDARD_OPTION_KEYS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+BUNDLE_CACHE_DIR = os.path.join(EXPORT_DIR, "bundles")
+BUNDLE_CACHE_MAX_BYTES = 500 * 1024 * 1024  # Aşıldığında en uzun süredir kullanılmayan setler silinir
+BUNDLE_BUILD_MEMORY_BUDGET_MB = 512  # Eşzamanlı set/kitapçık üretimlerinin toplam bellek bütçesi
+BUNDLE_BUILD_ESTIMATED_MB = 128      # Tek bir üretimin tahmini en yüksek bellek kullanımı
+EMPIRICAL_EASY_P = 0.70   # Madde analizi: bu p-değerinin üstü "Kolay"
+EMPIRICAL_HARD_P = 0.40   # bu p-değerinin altı "Zor" sayılır
+EXAM_LAYOUT_SETTINGS = ('classical_lines',)  # Kitapçık çıktısını etkileyen sınav ayarları (ExamSettings / booklet_runs.Settings)
+ITEM_ANALYSIS_MIN_RESPONSES = 30  # Ampirik zorluğun seçimde kullanılması için gereken en az cevap sayısı
+AI_CHUNK_TOKENS = 2000        # Uzun kaynak metinlerde tek bir AI isteğine giren en fazla (tahmini) token
+AI_CHARS_PER_TOKEN = 4        # Token tahmini için ortalama karakter sayısı
+AI_CANDIDATE_FACTOR = 1.5     # Map adımında bölüm kotasının kaç katı aday soru istenir
+AI_CACHE_DIR = os.path.join(EXPORT_DIR, "ai_cache")
+AI_CACHE_TTL_SECONDS = 7 * 24 * 3600      # Bu süreden eski AI cevapları yeniden üretilir
+AI_CACHE_MAX_BYTES = 50 * 1024 * 1024     # Aşıldığında en uzun süredir kullanılmayan cevaplar silinir
 
 MENU_ROLES = {
     "Gösterge Paneli": ["Admin", "Öğretim Üyesi"],
@@ -90,6 +134,7 @@ MENU_ROLES = {
     "Soru Bankası": ["Admin", "Öğretim Üyesi"],
     "Sınav Oluştur": ["Admin", "Öğretim Üyesi"],
     "Arşiv": ["Admin", "Öğretim Üyesi"],
+    "Değerlendirme": ["Admin", "Öğretim Üyesi"],
     "Yönetim": ["Admin"],
 }
 
@@ -187,12 +232,274 @@ def local_css():
 # ==============================================================================
 @st.cache_resource
 def check_and_download_font():
-    """Font dosyasını sadece yoksa indirir ve cache mekanizmasını kullanır."""
-    if not os.path.exists(FONT_FILENAME):
+    """
+    Eksik font dosyalarını (normal ve kalın) sabit sürümlü yayın arşivinden indirir ve cache mekanizmasını kullanır.
+    Dönüş: indirilemeyen font dosyalarının listesi (boşsa hepsi hazır).
+    """
+    missing = [f for f in FONT_RELEASE_MEMBERS if not os.path.exists(f)]
+    if not missing or multiprocessing.parent_process() is not None:
+        # Havuz işçileri indirme yapmaz: fontları ana süreç işleri göndermeden önce hazırlar
+        return missing
+    try:
+        with urllib.request.urlopen(FONT_RELEASE_URL, timeout=30) as resp:
+            archive = zipfile.ZipFile(BytesIO(resp.read()))
+        for filename in missing:
+            tmp_path = filename + '.part'
+            with open(tmp_path, 'wb') as f:
+                f.write(archive.read(FONT_RELEASE_MEMBERS[filename]))
+            os.replace(tmp_path, filename)
+    except Exception as e:
+        print(f"Font indirilemedi ({FONT_RELEASE_URL}): {e}", file=sys.stderr)
+    return [f for f in missing if not os.path.exists(f)]
+
+class FontRegistry:
+    """
+    Süreç genelinde TTF fontlarını bir kez ayrıştırıp metriklerini ve karakter genişliklerini paylaşır.
+    Metrikler FPDF'nin kendi önbellek biçiminde (.pkl) diske yazılır; alt küme (subset) font akışları ve glif genişlik
+    tabloları da aynı glif kümesi için bellekte tekrar kullanılır (örn. aynı soruları farklı sırada içeren grup kitapçıkları).
+    """
+    SUBSET_CACHE_SIZE = 64
+
+    def __init__(self):
+        self.fonts = {}
+        self.subsets = {}
+        self.widths = {}
+        self.lock = threading.Lock()
+
+    def _remember(self, cache, key, value):
+        with self.lock:
+            if len(cache) >= self.SUBSET_CACHE_SIZE:
+                cache.pop(next(iter(cache)))
+            cache[key] = value
+        return value
+
+    @staticmethod
+    def signature(ttf_path):
+        """TTF dosyasının boyut ve değişiklik zamanından türetilen kısa imza; font değişince önbellekler geçersizleşir."""
+        st_ = os.stat(ttf_path)
+        return hashlib.sha1(f"{st_.st_size}:{st_.st_mtime_ns}".encode()).hexdigest()[:12]
+
+    @staticmethod
+    def _drop_stale_pickles(ttf_path, signature):
+        base = os.path.splitext(ttf_path)[0]
+        stale = re.compile(re.escape(os.path.basename(base)) + r'\.([0-9a-f]{12})(\.cw127)?\.pkl$')
+        for name in os.listdir(os.path.dirname(os.path.abspath(ttf_path))):
+            m = stale.match(name)
+            if m and m.group(1) != signature:
+                try:
+                    os.remove(os.path.join(os.path.dirname(base), name))
+                except OSError:
+                    pass
+
+    def font_dict(self, ttf_path):
+        signature = self.signature(ttf_path)
+        with self.lock:
+            if (ttf_path, signature) not in self.fonts:
+                # FPDF'nin .cw127.pkl dosyası da bu addan türetildiği için iki önbellek de imzayla anahtarlanır
+                pkl_path = f"{os.path.splitext(ttf_path)[0]}.{signature}.pkl"
+                self._drop_stale_pickles(ttf_path, signature)
+                font = None
+                if os.path.exists(pkl_path):
+                    try:
+                        with open(pkl_path, 'rb') as f:
+                            font = pickle.load(f)
+                    except Exception:
+                        font = None
+                if font is None:
+                    ttf = TTFontFile()
+                    ttf.getMetrics(ttf_path)
+                    font = {
+                        'name': re.sub('[ ()]', '', ttf.fullName), 'type': 'TTF',
+                        'desc': {
+                            'Ascent': int(round(ttf.ascent)), 'Descent': int(round(ttf.descent)),
+                            'CapHeight': int(round(ttf.capHeight)), 'Flags': ttf.flags,
+                            'FontBBox': "[%s %s %s %s]" % tuple(int(round(b)) for b in ttf.bbox),
+                            'ItalicAngle': int(ttf.italicAngle), 'StemV': int(round(ttf.stemV)),
+                            'MissingWidth': int(round(ttf.defaultWidth)),
+                        },
+                        'up': round(ttf.underlinePosition), 'ut': round(ttf.underlineThickness),
+                        'ttffile': ttf_path, 'originalsize': os.stat(ttf_path).st_size, 'cw': ttf.charWidths,
+                    }
+                    try:
+                        with open(pkl_path, 'wb') as f:
+                            pickle.dump(font, f)
+                    except OSError:
+                        pass
+                self.fonts[(ttf_path, signature)] = (font, pkl_path)
+            return self.fonts[(ttf_path, signature)]
+
+    def register(self, pdf, family, style, ttf_path):
+        """FPDF.add_font ile aynı yapıyı, dosya okumadan ve paylaşılan genişlik tablosuyla engine'e ekler."""
+        font, pkl_path = self.font_dict(ttf_path)
+        fontkey = family.lower() + style
+        if fontkey in pdf.fonts: return
+        pdf.fonts[fontkey] = {
+            'i': len(pdf.fonts) + 1, 'type': 'TTF', 'name': font['name'], 'desc': font['desc'],
+            'up': font['up'], 'ut': font['ut'], 'cw': font['cw'], 'ttffile': ttf_path, 'fontkey': fontkey,
+            'subset': list(range(0, 57 if hasattr(pdf, 'str_alias_nb_pages') else 32)), 'unifilename': pkl_path,
+        }
+        pdf.font_files[fontkey] = {'length1': font['originalsize'], 'type': 'TTF', 'ttffile': ttf_path}
+        pdf.font_files[ttf_path] = {'type': 'TTF'}
+
+    def make_subset(self, ttf_path, subset):
+        key = (ttf_path, self.signature(ttf_path), tuple(sorted(set(subset))))
+        with self.lock:
+            hit = self.subsets.get(key)
+        if hit is None:
+            ttf = TTFontFile()
+            stream = ttf.makeSubset(ttf_path, list(key[2]))
+            hit = self._remember(self.subsets, key, (stream, ttf.codeToGlyph, ttf.maxUni))
+        return hit
+
+    def width_table(self, font, max_uni, build):
+        """PDF /W (glif genişlikleri) satırını (font, glif kümesi) başına bir kez üretir."""
+        key = (font['ttffile'], font.get('unifilename'), frozenset(font['subset']), max_uni)
+        line = self.widths.get(key)
+        if line is None:
+            line = self._remember(self.widths, key, build({**font, 'subset': key[2]}))
+        return line
+
+@st.cache_resource(show_spinner=False)
+def get_font_registry():
+    """Süreç başına tek FontRegistry (ExamPDFEngine'in font metrikleri, alt kümeleri ve genişlik tabloları)."""
+    return FontRegistry()
+
+class RegistryTTFontFile(TTFontFile):
+    """Alt küme üretimini FontRegistry önbelleğinden veren TTFontFile; yalnızca ExamPDFEngine._putfonts içinde kullanılır."""
+    def makeSubset(self, file, subset):
+        stream, self.codeToGlyph, self.maxUni = get_font_registry().make_subset(file, subset)
+        return stream
+
+class FragmentCache:
+    """
+    Süreç genelinde soru başına bir kez hazırlanan çıktı parçaları (fragment).
+    PDF için: metnin satır kırılımları ve kelime aralıkları (multi_cell ile birebir aynı yerleşim), DOCX için: doldurulmuş
+    soru satırı XML'i. Gruplar yalnızca soru/şık sırası ile ayrıştığından belgeler hazır parçaların sıralanmasıyla oluşur.
+    """
+    MAX_ENTRIES = 20000
+
+    def __init__(self):
+        self.layouts = {}
+        self.char_widths = {}
+        self.docx_rows = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, cache, key):
+        with self.lock:
+            value = cache.get(key)
+            if value is None: self.misses += 1
+            else: self.hits += 1
+        return value
+
+    def put(self, cache, key, value):
+        with self.lock:
+            if len(cache) >= self.MAX_ENTRIES:
+                cache.pop(next(iter(cache)))
+            cache[key] = value
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.layouts.clear()
+            self.char_widths.clear()
+            self.docx_rows.clear()
+            self.hits = self.misses = 0
+
+@st.cache_resource(show_spinner=False)
+def get_fragment_cache():
+    return FragmentCache()
+
+class AIResponseCache:
+    """
+    AI sağlayıcı cevaplarının disk önbelleği. Anahtar (istem, sağlayıcı:model, cevap şeması, sıcaklık) özetidir;
+    kayıtlar AI_CACHE_TTL_SECONDS sonra geçersiz olur, toplam boyut AI_CACHE_MAX_BYTES'ı aşınca en eski erişilenler silinir.
+    Eşzamanlı parça üretimi için sayaçlar kilitle güncellenir.
+    """
+
+    def __init__(self, directory=AI_CACHE_DIR, ttl=AI_CACHE_TTL_SECONDS, max_bytes=AI_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(prompt, model_name, response_schema=None, temperature=None):
+        payload = json.dumps([prompt, model_name, response_schema, temperature], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
         try:
-            urllib.request.urlretrieve(FONT_URL, FONT_FILENAME)
-        except Exception:
-            pass
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            if time.time() - entry['created'] > self.ttl:
+                os.remove(path)
+                entry = None
+            else:
+                os.utime(path)
+        except (OSError, ValueError, KeyError):
+            entry = None
+        with self.lock:
+            if entry is None: self.misses += 1
+            else: self.hits += 1
+        return entry['text'] if entry else None
+
+    def put(self, key, text):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.time(), 'text': text}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.evict()
+        return text
+
+    def skip(self):
+        with self.lock:
+            self.bypassed += 1
+
+    def evict(self):
+        """Süresi dolan kayıtları ve boyut sınırını aşan en eski erişilen kayıtları siler."""
+        entries, now = [], time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'): continue
+            path = os.path.join(self.directory, name)
+            try: st_info = os.stat(path)
+            except OSError: continue
+            entries.append((st_info.st_mtime, st_info.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes and now - mtime <= self.ttl: continue
+            try: os.remove(path)
+            except OSError: continue
+            total -= size
+
+    def stats(self):
+        entries = [os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith('.json')]
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed,
+                'hit_rate': self.hits / lookups if lookups else 0.0, 'entries': len(entries),
+                'bytes': sum(os.path.getsize(p) for p in entries if os.path.exists(p))}
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try: os.remove(os.path.join(self.directory, name))
+                except OSError: pass
+        with self.lock:
+            self.hits = self.misses = self.bypassed = 0
+
+@st.cache_resource(show_spinner=False)
+def get_ai_response_cache():
+    return AIResponseCache()
 
 def hash_password(password):
     return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
@@ -213,6 +520,8 @@ class AIGenerator:
     @staticmethod
     def get_api_key(provider):
         try:
+            if provider == "stub":
+                return "local"
             if provider == "google": 
                 if f"user_provided_{provider}_key" in st.session_state and st.session_state[f"user_provided_{provider}_key"]:
                     return st.session_state[f"user_provided_{provider}_key"]
@@ -238,93 +547,332 @@ class AIGenerator:
             st.error(f"Dosya okuma hatası: {e}")
         return text
 
-    @staticmethod
-    def generate_from_text(text, num_questions=3, provider="google", model_name='gemini-2.5-flash',target_course='AI-GEN'):
-        api_key = AIGenerator.get_api_key(provider)
-        
-        if not api_key:
-            st.warning(f"⚠️ {provider.title()} servisi için API anahtarı tanımlanmamış.", icon="🤖")
-            return [] 
-        
-        response_schema = {
-            "type": "ARRAY",
-            "items": {
-                "type": "OBJECT",
-                "properties": {
-                    "QuestionText": {"type": "STRING", "description": "Soru metni"},
-                    "Options": {
-                        "type": "OBJECT",
-                        "description": "Çoktan seçmeli şıklar",
-                        "properties": {
-                            "A": {"type": "STRING"},
-                            "B": {"type": "STRING"},
-                            "C": {"type": "STRING"},
-                            "D": {"type": "STRING"},
-                            "E": {"type": "STRING"}
-                        }
-                    },
-                    "CorrectAnswer": {"type": "STRING", "description": "Doğru cevap anahtarı (örn: A)"},
-                    "Complexity": {"type": "INTEGER", "description": "Zorluk seviyesi (1, 2 veya 3)"},
-                    "Score": {"type": "NUMBER", "description": "Soruya atanacak puan"}
+    QUESTION_SCHEMA = {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {
+                "QuestionText": {"type": "STRING", "description": "Soru metni"},
+                "Options": {
+                    "type": "OBJECT",
+                    "description": "Çoktan seçmeli şıklar",
+                    "properties": {
+                        "A": {"type": "STRING"},
+                        "B": {"type": "STRING"},
+                        "C": {"type": "STRING"},
+                        "D": {"type": "STRING"},
+                        "E": {"type": "STRING"}
+                    }
                 },
-                "required": ["QuestionText", "Options", "CorrectAnswer", "Complexity", "Score"]
-            }
+                "CorrectAnswer": {"type": "STRING", "description": "Doğru cevap anahtarı (örn: A)"},
+                "Complexity": {"type": "INTEGER", "description": "Zorluk seviyesi (1, 2 veya 3)"},
+                "Score": {"type": "NUMBER", "description": "Soruya atanacak puan"}
+            },
+            "required": ["QuestionText", "Options", "CorrectAnswer", "Complexity", "Score"]
         }
-        
-        generation_config = genai.GenerationConfig(
-            response_mime_type="application/json",
-            response_schema=response_schema
-        )
+    }
+    CHUNK_SIZE = 10
+    MAX_WORKERS = 4
 
+    @staticmethod
+    def build_generation_prompt(text, num_questions, focus=None, part=None):
         prompt = f"""
         Aşağıdaki metni analiz et ve {num_questions} adet akademik sınav sorusu oluştur.
         
-        Metin: "{text[:8000]}"
+        Metin: "{text}"
         
         Kural: Soruların tipi Çoktan Seçmeli (MC) olsun. Çıktıyı tam olarak tanımlanan JSON şemasına göre oluştur.
         """
-        
-        try:
+        if focus:
+            prompt += f"""
+        Odak: Soruları özellikle şu konulardan üret ve konuları soru arasında dağıt: {"; ".join(focus)}
+        """
+        if part and part[1] > 1:
+            # Parça numarası aynı odaklı parçaların istemlerini (ve önbellek anahtarlarını) ayırır
+            prompt += f"""
+        Bu istek {part[1]} parçalık bir üretimin {part[0]}. parçasıdır; diğer parçalardan farklı sorular üret.
+        """
+        return prompt
+
+    @staticmethod
+    def call_provider(provider, model_name, prompt, api_key, response_schema=None, temperature=None, use_cache=True):
+        """
+        Sağlayıcıya tek istek gönderir ve ham metin cevabı döndürür (st.* çağırmaz; iş parçacıklarından güvenle çağrılabilir).
+        Aynı (istem, model, şema, sıcaklık) için disk önbelleğindeki cevap kullanılır; use_cache=False önbelleği atlayıp
+        yeni cevabı önbelleğe yazar. Yalnızca JSON olarak ayrıştırılabilen cevaplar saklanır.
+        """
+        cache = get_ai_response_cache()
+        key = AIResponseCache.key(prompt, f"{provider}:{model_name}", response_schema, temperature)
+        if use_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        else:
+            cache.skip()
+
+        if provider == "stub":
+            text = AIGenerator._call_stub(prompt, response_schema)
+        else:
+            config = {k: v for k, v in (("temperature", temperature),) if v is not None}
+            if response_schema is not None:
+                config.update(response_mime_type="application/json", response_schema=response_schema)
             genai.configure(api_key=api_key)
             model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt, generation_config=generation_config)
-            response_text = response.text
-            response_text = response.text.replace("```json", "").replace("```", "").strip()
-            questions_data = json.loads(response_text)
-            
-            final_questions = []
-            for q in questions_data:
-                final_questions.append({
-                    'CourseCode': target_course, 
-                    'TopicArea': 'AI Üretimi',
-                    'Complexity': int(q.get('Complexity', 2)), 
-                    'QuestionType': 'MC',
-                    'Score': float(q.get('Score', 10)), 
-                    'QuestionText': q.get('QuestionText', 'Soru metni alınamadı'),
-                    'Options': q.get('Options', {}), 
-                    'CorrectAnswer': q.get('CorrectAnswer', 'A'),
-                    'CreatedBy': st.session_state['user']['Username']
-                })
-            return final_questions
+            response = model.generate_content(prompt, generation_config=genai.GenerationConfig(**config)) if config else model.generate_content(prompt)
+            text = response.text
+
+        try:
+            json.loads(text.replace("```json", "").replace("```", "").strip())
+        except ValueError:
+            return text
+        return cache.put(key, text)
+
+    @staticmethod
+    def _call_stub(prompt, response_schema=None):
+        """
+        Çevrimdışı test sağlayıcısı: istemdeki metinden deterministik (istem özetiyle tohumlanan) soru taslakları üretir.
+        Ağ ve API anahtarı gerektirmez; eşzamanlı üretim ve tekilleştirme akışını yerelde denemek içindir.
+        """
+        rng = random.Random(hashlib.sha1(prompt.encode('utf-8')).hexdigest())
+        time.sleep(rng.uniform(0.05, 0.2))
+        if response_schema is None:
+            return json.dumps({"bloom_level": "Kavrama", "reason": "Yerel test cevabı", "improvement_suggestion": "-"}, ensure_ascii=False)
+        count = re.search(r"(\d+) adet", prompt)
+        focus = re.search(r"Odak: .*?: (.*)", prompt)
+        terms = [t.strip() for t in focus.group(1).split(";")] if focus else []
+        terms = terms or re.findall(r"\w{6,}", prompt.split('Metin: "', 1)[-1])[:50] or ["konu"]
+        questions = []
+        for i in range(int(count.group(1)) if count else 3):
+            term = terms[i % len(terms)]
+            correct = rng.choice("ABCD")
+            questions.append({
+                "QuestionText": f"{term} ile ilgili aşağıdakilerden hangisi doğrudur? (#{rng.randint(1, 10 ** 6)})",
+                "Options": {k: f"{term} - seçenek {k}" for k in "ABCD"},
+                "CorrectAnswer": correct, "Complexity": rng.randint(1, 3), "Score": 10
+            })
+        return json.dumps(questions, ensure_ascii=False)
+
+    @staticmethod
+    def parse_questions(response_text, target_course, username):
+        """Model cevabını (JSON dizi) soru bankası sözlüklerine çevirir; JSON hatasında json.JSONDecodeError yükseltir."""
+        questions_data = json.loads(response_text.replace("```json", "").replace("```", "").strip())
+        return [{
+            'CourseCode': target_course, 
+            'TopicArea': 'AI Üretimi',
+            'Complexity': int(q.get('Complexity', 2)), 
+            'QuestionType': 'MC',
+            'Score': float(q.get('Score', 10)), 
+            'QuestionText': q.get('QuestionText', 'Soru metni alınamadı'),
+            'Options': q.get('Options', {}), 
+            'CorrectAnswer': q.get('CorrectAnswer', 'A'),
+            'CreatedBy': username
+        } for q in questions_data]
+
+    @staticmethod
+    def describe_error(e):
+        """Sağlayıcı hatasını kullanıcıya gösterilecek Türkçe mesaja çevirir."""
+        if isinstance(e, json.JSONDecodeError):
+            return f"JSON format hatası. Model düzgün JSON döndüremedi. Hata: {str(e)}"
+        if isinstance(e, api_exceptions.GoogleAPICallError):
+            error_message = e.message if hasattr(e, 'message') else str(e)
+            if "API key not valid" in error_message:
+                return "API Anahtarı Geçersiz veya Yetkisiz. Lütfen kontrol edin."
+            if "quota" in error_message.lower():
+                return "Kota Aşıldı. Lütfen kullanım limitlerinizi kontrol edin."
+            return f"API Hatası (Gemini): {error_message}"
+        return str(e)
+
+    @staticmethod
+    def topic_hints(text):
+        """Bağlamdaki haftalık konu satırlarını ('N. Hafta: ...') döndürür; yoksa paragraf başlıklarını kullanır."""
+        topics = re.findall(r"^\s*\d+\. Hafta: (.+)$", text, flags=re.MULTILINE)
+        if not topics:
+            topics = [line.strip()[:120] for line in text.splitlines() if 3 <= len(line.strip()) <= 120 and not line.strip().startswith('---')]
+        return list(dict.fromkeys(t.strip() for t in topics if t.strip()))
+
+    SECTION_HEADING_REGEX = re.compile(
+        r"^\s*(?:---.*---|#{1,6}\s+\S.*|\d+(?:\.\d+)*[.)]?\s+\S.{0,100}|(?:BÖLÜM|Bölüm|ÜNİTE|Ünite|CHAPTER|Chapter)\b.{0,100}|[A-ZÇĞİÖŞÜ0-9 ,:;()/-]{4,80})\s*$"
+    )
+
+    @staticmethod
+    def estimate_tokens(text):
+        """Token sayısının sağlayıcıdan bağımsız, çevrimdışı tahmini (ortalama AI_CHARS_PER_TOKEN karakter/token)."""
+        return -(-len(text) // AI_CHARS_PER_TOKEN)
+
+    @staticmethod
+    def split_sections(text, token_budget=AI_CHUNK_TOKENS):
+        """
+        Metni başlık satırlarından (---, #, 1.2 Başlık, BÖLÜM, büyük harfli satırlar) bölümlere ayırır ve komşu bölümleri
+        token bütçesini aşmayacak şekilde parçalarda birleştirir. Bütçeyi tek başına aşan bölümler paragraf, cümle ve
+        gerekirse karakter sınırından bölünür; hiçbir içerik atılmaz.
+        Dönüş: [{'label', 'text', 'start', 'end', 'tokens'}] (start/end orijinal metindeki karakter konumları)
+        """
+        max_chars = token_budget * AI_CHARS_PER_TOKEN
+        sections, pos, label = [], 0, None
+        for line in text.splitlines(keepends=True):
+            stripped = line.strip()
+            if stripped and AIGenerator.SECTION_HEADING_REGEX.match(stripped) and (not sections or sections[-1]['text'].strip()):
+                label = stripped.strip('-# :')[:80] or label
+                sections.append({'label': label, 'text': '', 'start': pos})
+            elif not sections:
+                sections.append({'label': label, 'text': '', 'start': pos})
+            sections[-1]['text'] += line
+            pos += len(line)
+
+        pieces = []
+        for sec in sections:
+            if len(sec['text']) <= max_chars:
+                pieces.append(sec)
+                continue
+            offset, buffer = sec['start'], ''
+            for part in re.split(r"(?<=\n\n)|(?<=[.!?] )", sec['text']):
+                for i in range(0, len(part), max_chars):
+                    fragment = part[i:i + max_chars]
+                    if buffer and len(buffer) + len(fragment) > max_chars:
+                        pieces.append({'label': sec['label'] if offset == sec['start'] else f"{sec['label']} (devam)", 'text': buffer, 'start': offset})
+                        offset, buffer = offset + len(buffer), ''
+                    buffer += fragment
+            if buffer:
+                pieces.append({'label': sec['label'] if offset == sec['start'] else f"{sec['label']} (devam)", 'text': buffer, 'start': offset})
+
+        chunks = []
+        for piece in pieces:
+            if chunks and len(chunks[-1]['text']) + len(piece['text']) <= max_chars:
+                chunks[-1]['text'] += piece['text']
+                if piece['label'] and piece['label'] not in chunks[-1]['labels']:
+                    chunks[-1]['labels'].append(piece['label'])
+            else:
+                chunks.append({'labels': [piece['label']] if piece['label'] else [], 'text': piece['text'], 'start': piece['start']})
+        return [{
+            'label': (c['labels'][0] if len(c['labels']) <= 1 else f"{c['labels'][0]} … {c['labels'][-1]}") if c['labels'] else f"Bölüm {i}",
+            'text': c['text'], 'start': c['start'], 'end': c['start'] + len(c['text']),
+            'tokens': AIGenerator.estimate_tokens(c['text']),
+        } for i, c in enumerate(chunks, 1) if c['text'].strip()]
+
+    @staticmethod
+    def allocate_quotas(weights, total):
+        """Toplamı `total` olan tam sayı kotaları ağırlıklara orantılı dağıtır (en büyük kalan yöntemi)."""
+        if not weights or total <= 0: return [0] * len(weights)
+        raw = [w * total / (sum(weights) or 1) for w in weights]
+        quotas = [int(r) for r in raw]
+        for i in sorted(range(len(raw)), key=lambda i: raw[i] - quotas[i], reverse=True)[:total - sum(quotas)]:
+            quotas[i] += 1
+        return quotas
+
+    @staticmethod
+    def reduce_candidates(candidates, quotas, total):
+        """
+        Reduce adımı: bölüm başına adaylardan kotası kadar soruyu zorluk seviyeleri arasında sırayla seçer;
+        kotasını dolduramayan bölümlerin açığı, artan adayı en çok olan bölümlerden sırayla kapatılır.
+        Dönüş: bölüm başına seçilen soru listeleri
+        """
+        def by_complexity(qs):
+            levels = {}
+            for q in qs:
+                levels.setdefault(q.get('Complexity', 2), []).append(q)
+            ordered, queues = [], [levels[k] for k in sorted(levels)]
+            while any(queues):
+                for queue in queues:
+                    if queue: ordered.append(queue.pop(0))
+            return ordered
+
+        ordered = [by_complexity(qs) for qs in candidates]
+        picked = [qs[:q] for qs, q in zip(ordered, quotas)]
+        surplus = [qs[q:] for qs, q in zip(ordered, quotas)]
+        missing = total - sum(len(p) for p in picked)
+        while missing > 0 and any(surplus):
+            i = max(range(len(surplus)), key=lambda i: len(surplus[i]))
+            picked[i].append(surplus[i].pop(0))
+            missing -= 1
+        return picked
+
+    @staticmethod
+    def generate_map_reduce(text, num_questions, provider="google", model_name='gemini-2.5-flash', target_course='AI-GEN',
+                            token_budget=AI_CHUNK_TOKENS, max_workers=None, on_chunk=None, use_cache=True):
+        """
+        Uzun kaynaklar için map-reduce üretim: metin bölüm sınırlarından token bütçesine göre parçalanır (split_sections),
+        her parçaya token payına orantılı kota verilir ve kotanın AI_CANDIDATE_FACTOR katı aday paralel üretilir (map).
+        Adaylar tekilleştirilip reduce_candidates ile bölümler ve zorluklar arasında dengeli bir son sete indirgenir.
+        Dönüş: (sorular, hatalar, kapsam satırları)
+        """
+        api_key = AIGenerator.get_api_key(provider)
+        if not api_key:
+            return [], [f"{provider.title()} servisi için API anahtarı tanımlanmamış."], []
+        username = st.session_state['user']['Username']
+        chunks = AIGenerator.split_sections(text, token_budget)
+        quotas = AIGenerator.allocate_quotas([c['tokens'] for c in chunks], num_questions)
+
+        tasks = []
+        for idx, (chunk, quota) in enumerate(zip(chunks, quotas)):
+            wanted = min(int(np.ceil(quota * AI_CANDIDATE_FACTOR)), quota + AIGenerator.CHUNK_SIZE) if quota else 0
+            sizes = [AIGenerator.CHUNK_SIZE] * (wanted // AIGenerator.CHUNK_SIZE) + ([wanted % AIGenerator.CHUNK_SIZE] if wanted % AIGenerator.CHUNK_SIZE else [])
+            for p, n in enumerate(sizes, 1):
+                tasks.append((idx, AIGenerator.build_generation_prompt(chunk['text'], n, [chunk['label']], (p, len(sizes)))))
+
+        def run_task(prompt):
+            return AIGenerator.parse_questions(
+                AIGenerator.call_provider(provider, model_name, prompt, api_key, AIGenerator.QUESTION_SCHEMA, use_cache=use_cache),
+                target_course, username)
+
+        candidates, errors, seen = [[] for _ in chunks], [], set()
+        if tasks:
+            with ThreadPoolExecutor(max_workers=min(max_workers or AIGenerator.MAX_WORKERS, len(tasks))) as pool:
+                futures = {pool.submit(run_task, prompt): idx for idx, prompt in tasks}
+                for done, future in enumerate(as_completed(futures), 1):
+                    idx, fresh = futures[future], []
+                    try:
+                        for q in future.result():
+                            content_hash = question_content_hash(q)
+                            if content_hash not in seen:
+                                seen.add(content_hash)
+                                fresh.append({**q, 'SourceSection': chunks[idx]['label']})
+                    except Exception as e:
+                        errors.append(f"{chunks[idx]['label']}: {AIGenerator.describe_error(e)}")
+                    candidates[idx].extend(fresh)
+                    if on_chunk: on_chunk(fresh, done, len(tasks))
+
+        picked = AIGenerator.reduce_candidates(candidates, quotas, num_questions)
+        coverage = [{
+            "Bölüm": chunk['label'], "Karakter Aralığı": f"{chunk['start']:,}-{chunk['end']:,}", "Tahmini Token": chunk['tokens'],
+            "Kota": quota, "Aday": len(cands), "Seçilen": len(sel),
+        } for chunk, quota, cands, sel in zip(chunks, quotas, candidates, picked)]
+        return [q for sel in picked for q in sel], errors, coverage
+
+    @staticmethod
+    def chunk_focus(topics, index, n_chunks):
+        """
+        `index`. parçanın odak konuları: konular parçalara ardışık pencereler halinde döngüsel olarak paylaştırılır.
+        Konu sayısı parça sayısından azsa pencere her turda bir konu uzar; böylece her parça boş olmayan ve
+        (konu sayısının karesine kadar) diğerlerinden farklı bir odak alır.
+        """
+        if not topics: return None
+        width = -(-len(topics) // n_chunks)
+        size = min(len(topics), width + index // len(topics))
+        return [topics[(index * width + k) % len(topics)] for k in range(size)]
+
+    @staticmethod
+    def generate_from_text(text, num_questions=3, provider="google", model_name='gemini-2.5-flash',target_course='AI-GEN', use_cache=True):
+        api_key = AIGenerator.get_api_key(provider)
+        
+        if not api_key:
+            st.warning(f"⚠️ {provider.title()} servisi için API anahtarı tanımlanmamış.", icon="🤖")
+            return [] 
+        
+        response_text = ""
+        try:
+            response_text = AIGenerator.call_provider(provider, model_name, AIGenerator.build_generation_prompt(text, num_questions),
+                                                      api_key, AIGenerator.QUESTION_SCHEMA, use_cache=use_cache)
+            return AIGenerator.parse_questions(response_text, target_course, st.session_state['user']['Username'])
 
         except json.JSONDecodeError as e:
-            error_details = f"JSON format hatası. Model düzgün JSON döndüremedi. Hata: {str(e)}"
+            error_details = AIGenerator.describe_error(e)
             if response_text:
                  error_details += f"\n\nModelin Ham Çıktısı (ilk 500 karakter): {response_text[:500]}..."
             st.error(f"AI İşlem Hatası: {error_details}")
             return []
         
         except api_exceptions.GoogleAPICallError as e: 
-            error_message = e.message if hasattr(e, 'message') else str(e)
-            
-            error_msg = f"API Hatası (Gemini): {error_message}"
-            
-            if "API key not valid" in error_message:
-                error_msg = "API Anahtarı Geçersiz veya Yetkisiz. Lütfen kontrol edin."
-            elif "quota" in error_message.lower():
-                error_msg = "Kota Aşıldı. Lütfen kullanım limitlerinizi kontrol edin."
-            
-            st.error(f"AI Genel Hata: {error_msg}")
+            st.error(f"AI Genel Hata: {AIGenerator.describe_error(e)}")
             return []
 
         except Exception as e:
@@ -333,7 +881,50 @@ class AIGenerator:
             return []
 
     @staticmethod
-    def analyze_question_bloom(question_text, provider="google", model_name='gemini-2.5-flash'):
+    def generate_concurrent(text, num_questions, provider="google", model_name='gemini-2.5-flash', target_course='AI-GEN',
+                            chunk_size=None, max_workers=None, on_chunk=None, use_cache=True):
+        """
+        Büyük istekleri en fazla `chunk_size` soruluk parçalara böler ve sınırlı bir iş parçacığı havuzuyla eşzamanlı üretir.
+        Her parçaya bağlamdaki konulardan farklı bir dilim odak olarak verilir; sonuçlar normalize metin özetine göre
+        tekilleştirilir. `on_chunk(yeni_sorular, biten, toplam)` her parça döndüğünde ana iş parçacığında çağrılır.
+        Dönüş: (sorular, hatalar)
+        """
+        api_key = AIGenerator.get_api_key(provider)
+        if not api_key:
+            return [], [f"{provider.title()} servisi için API anahtarı tanımlanmamış."]
+        chunk_size = chunk_size or AIGenerator.CHUNK_SIZE
+        username = st.session_state['user']['Username']
+
+        sizes = [chunk_size] * (num_questions // chunk_size) + ([num_questions % chunk_size] if num_questions % chunk_size else [])
+        topics = AIGenerator.topic_hints(text)
+        prompts = [AIGenerator.build_generation_prompt(text, n, AIGenerator.chunk_focus(topics, i, len(sizes)) if len(sizes) > 1 else None,
+                                                       (i + 1, len(sizes)))
+                   for i, n in enumerate(sizes)]
+
+        def run_chunk(prompt):
+            return AIGenerator.parse_questions(
+                AIGenerator.call_provider(provider, model_name, prompt, api_key, AIGenerator.QUESTION_SCHEMA, use_cache=use_cache),
+                target_course, username)
+
+        questions, errors, seen = [], [], set()
+        with ThreadPoolExecutor(max_workers=min(max_workers or AIGenerator.MAX_WORKERS, len(sizes))) as pool:
+            futures = {pool.submit(run_chunk, prompt): i for i, prompt in enumerate(prompts)}
+            for done, future in enumerate(as_completed(futures), 1):
+                fresh = []
+                try:
+                    for q in future.result():
+                        content_hash = question_content_hash(q)
+                        if content_hash not in seen:
+                            seen.add(content_hash)
+                            fresh.append(q)
+                except Exception as e:
+                    errors.append(f"Parça {futures[future] + 1}: {AIGenerator.describe_error(e)}")
+                questions.extend(fresh)
+                if on_chunk: on_chunk(fresh, done, len(prompts))
+        return questions[:num_questions], errors
+
+    @staticmethod
+    def analyze_question_bloom(question_text, provider="google", model_name='gemini-2.5-flash', use_cache=True):
         """Sorunun Bloom Taksonomisi seviyesini ve önerileri analiz eder."""
         api_key = AIGenerator.get_api_key(provider)
         if not api_key: return "API Key Eksik"
@@ -351,30 +942,111 @@ class AIGenerator:
         }}
         """
         try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt)
-            return json.loads(response.text.replace("```json", "").replace("```", "").strip())
+            response_text = AIGenerator.call_provider(provider, model_name, prompt, api_key, use_cache=use_cache)
+            return json.loads(response_text.replace("```json", "").replace("```", "").strip())
         except Exception as e:
             return {"error": str(e)}
 
+class QuestionRecord:
+    """
+    Sınav hattında (sihirbaz -> kitapçık/anahtar çıktıları) kullanılan değişmez soru kaydı.
+    Şıklar DB satırından bir kez ayrıştırılır ve anahtara göre sıralı (anahtar, metin) demetleri olarak tutulur.
+    Eski kodla uyum için q['Alan'], q.get() ve 'Alan' in q erişimleri de desteklenir.
+    """
+    __slots__ = ('QuestionID', 'RevisionID', 'CourseCode', 'TopicArea', 'Complexity', 'QuestionType',
+                 'Score', 'QuestionText', 'Options', 'CorrectAnswer')
+
+    def __init__(self, QuestionID, RevisionID, CourseCode, TopicArea, Complexity, QuestionType, Score, QuestionText, Options, CorrectAnswer):
+        for name, value in zip(self.__slots__, (QuestionID, RevisionID, CourseCode, TopicArea, Complexity, QuestionType,
+                                                Score, QuestionText, Options, CorrectAnswer)):
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_row(cls, row, score=None):
+        """DB satırı veya ExamData sözlüğünden kayıt oluşturur (zaten kayıtsa aynen döner)."""
+        if isinstance(row, cls):
+            return row if score is None else row.with_score(score)
+        if hasattr(row, 'to_dict'):
+            # Önceki bir yeniden çalıştırmada (rerun) oluşturulup session_state'te kalan kayıtlar eski sınıfa aittir
+            row = row.to_dict()
+        raw = row.get('Options')
+        try:
+            opts = raw if isinstance(raw, dict) else (json.loads(raw) if isinstance(raw, str) and raw else {})
+        except ValueError:
+            opts = {}
+        return cls(row.get('QuestionID'), row.get('RevisionID'), row.get('CourseCode'), row.get('TopicArea'),
+                   row.get('Complexity'), row.get('QuestionType'), float(row.get('Score') or 0) if score is None else score,
+                   row.get('QuestionText') or '', tuple(sorted((str(k), v) for k, v in (opts or {}).items())), row.get('CorrectAnswer'))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("QuestionRecord değiştirilemez; with_score() veya with_options() kullanın.")
+
+    def __reduce__(self):
+        return (self.__class__, tuple(getattr(self, f) for f in self.__slots__))
+
+    def __getitem__(self, key):
+        if key not in self.__slots__: raise KeyError(key)
+        return dict(self.Options) if key == 'Options' else getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __repr__(self):
+        return f"QuestionRecord(QuestionID={self.QuestionID}, QuestionType={self.QuestionType!r}, Score={self.Score})"
+
+    def with_score(self, score):
+        return QuestionRecord(*(score if f == 'Score' else getattr(self, f) for f in self.__slots__))
+
+    def with_options(self, options, correct_answer):
+        return QuestionRecord(*(options if f == 'Options' else correct_answer if f == 'CorrectAnswer' else getattr(self, f)
+                                for f in self.__slots__))
+
+    def filled_option_keys(self):
+        """Boş olmayan şıkların anahtarları (alfabetik)."""
+        return [k for k, v in self.Options if v and str(v).strip()]
+
+    def to_dict(self):
+        """ExamData/JSON için sözlük karşılığı (Options tekrar sözlüğe çevrilir)."""
+        data = {f: getattr(self, f) for f in self.__slots__ if f not in ('QuestionID', 'RevisionID') or getattr(self, f) is not None}
+        data['Options'] = dict(self.Options)
+        return data
+
 class ExamPDFEngine(FPDF):
-    def __init__(self, meta, is_answer_key=False, group_name="A", classical_lines=5):
+    def __init__(self, meta, is_answer_key=False, group_name="A", classical_lines=5, compress=True):
         super().__init__()
         self.meta = meta
         self.is_answer_key = is_answer_key
         self.group_name = group_name
+        self.page_group = group_name
+        self.body_top = 0
+        self.section_first_page = 1
+        self.new_section = False
+        self.outlines = []
+        self.pending_bookmarks = []
+        self.outline_root = None
         self.classical_lines = classical_lines 
         check_and_download_font()
         self.set_auto_page_break(auto=True, margin=20)
+        # Sayfa içerik akışları Flate ile sıkıştırılır; TTF fontlar yalnızca kullanılan glif alt kümesiyle gömülür
+        self.set_compression(compress)
         if os.path.exists(FONT_FILENAME):
-            self.add_font('DejaVu', '', FONT_FILENAME, uni=True)
-            self.add_font('DejaVu', 'B', FONT_FILENAME, uni=True)
+            registry = get_font_registry()
+            registry.register(self, 'DejaVu', '', FONT_FILENAME)
+            registry.register(self, 'DejaVu', 'B', FONT_BOLD_FILENAME if os.path.exists(FONT_BOLD_FILENAME) else FONT_FILENAME)
             self.font_family = 'DejaVu'
         else:
             self.font_family = 'Arial' 
 
     def header(self):
+        self.page_group = self.group_name
+        if self.new_section:
+            self.section_first_page, self.new_section = self.page, False
+        for title, level in self.pending_bookmarks:
+            self.outlines.append({'t': title, 'l': level, 'p': self.page, 'y': 0})
+        self.pending_bookmarks = []
         self.set_font(self.font_family, 'B', 14)
         title_suffix = " - CEVAP ANAHTARI" if self.is_answer_key else ""
         self.cell(0, 10, f"{self.meta['title']}{title_suffix}", 0, 1, 'C')
@@ -410,47 +1082,58 @@ class ExamPDFEngine(FPDF):
             self.ln(5) 
         self.line(10, self.get_y(), 200, self.get_y())
         self.ln(8)
+        self.body_top = self.get_y()
 
     def footer(self):
         self.set_y(-15)
         self.set_font(self.font_family, '', 8)
-        self.cell(0, 10, f'SSOP Pro v5.2 - Grup {self.group_name} - Sayfa {self.page_no()}', 0, 0, 'C')
+        self.cell(0, 10, f'SSOP Pro v5.2 - Grup {self.page_group} - Sayfa {self.page_no() - self.section_first_page + 1}', 0, 0, 'C')
 
     def generate_content(self, questions):
+        self.new_section = True
         self.add_page()
         self.set_font(self.font_family, '', 11)
+        text_w = self.w - self.l_margin - self.r_margin - 10
         
         for idx, q in enumerate(questions, 1):
-            q_text = q['QuestionText']
-            score_txt = f"({q['Score']} Puan)" if 'Score' in q else ""
+            score_txt = f"({q.Score} Puan)" if q.Score is not None else ""
             
+            self.set_font(self.font_family, 'B', 11)
             if self.is_answer_key:
-                 header = f"{idx}. {q_text}\n   >>> DOĞRU CEVAP: {q.get('CorrectAnswer', '-')}"
-                 self.set_text_color(200, 0, 0) 
+                 header = [self.text_layout(text_w, q.QuestionText),
+                           self.text_layout(text_w, f">>> DOĞRU CEVAP: {q.CorrectAnswer or '-'}")]
             else:
-                 header = f"{idx}. {q_text} {score_txt}"
-                 self.set_text_color(0, 0, 0)
+                 header = [self.text_layout(text_w, f"{q.QuestionText} {score_txt}")]
+            self.set_font(self.font_family, '', 11)
+            options = [(k, self.text_layout(text_w, str(v))) for k, v in q.Options] if not self.is_answer_key and q.QuestionType == 'MC' else []
 
-            if self.get_y() > 250: self.add_page()
-            
+            # Önceden ölçülen blok yüksekliği: soru sayfaya sığmıyorsa (ve sayfanın başında değilsek) yeni sayfadan başlar
+            block_h = 6 * sum(n for _, n in header) + 2 + 6 * sum(n for _, (_, n) in options)
+            if not self.is_answer_key:
+                block_h += {'TF': 8, 'CL': 5 + 5 * self.classical_lines}.get(q.QuestionType, 0)
+            if self.get_y() + block_h > self.page_break_trigger and self.get_y() > self.body_top:
+                self.add_page()
+
+            self.set_text_color(200, 0, 0) if self.is_answer_key else self.set_text_color(0, 0, 0)
             self.set_font(self.font_family, 'B', 11)
-            self.multi_cell(0, 6, header)
+            self.cell(10, 6, f"{idx}.", 0, 0)
+            for layout in header:
+                self.x = self.l_margin + 10
+                self.draw_layout(text_w, 6, layout)
             self.set_font(self.font_family, '', 11)
             self.set_text_color(0, 0, 0)
             self.ln(2)
 
             if not self.is_answer_key:
-                if q['QuestionType'] == 'MC':
-                    opts = q['Options'] if isinstance(q['Options'], dict) else (json.loads(q['Options']) if isinstance(q['Options'], str) else {})
-                    if opts:
-                        for k, v in sorted(opts.items()):
-                            self.cell(10, 6, f"{k})", 0, 0)
-                            self.multi_cell(0, 6, str(v))
-                elif q['QuestionType'] == 'TF':
+                if q.QuestionType == 'MC':
+                    for k, layout in options:
+                        self.cell(10, 6, f"{k})", 0, 0)
+                        self.draw_layout(text_w, 6, layout)
+                elif q.QuestionType == 'TF':
                     self.cell(5)
                     self.cell(30, 8, "◯ Doğru", 0, 0)
                     self.cell(30, 8, "◯ Yanlış", 0, 1)
-                elif q['QuestionType'] == 'CL': 
+                elif q.QuestionType == 'CL': 
                     self.ln(2)
                     for _ in range(self.classical_lines):
                         self.cell(0, 5, "_"*80, 0, 1) 
@@ -462,7 +1145,152 @@ class ExamPDFEngine(FPDF):
                 self.line(10, self.get_y(), 200, self.get_y())
                 self.set_draw_color(0,0,0)
                 self.ln(4)
+
+    def text_layout(self, w, txt):
+        """
+        multi_cell(w, h, txt) ile aynı satır kırılımını ve kelime aralığı (Tw) komutlarını üretir; sonuç (işlemler, satır sayısı)
+        geçerli font ve genişlik için FragmentCache'te tutulur. Karakter genişlikleri de font başına bir kez hesaplanır.
+        """
+        cache = get_fragment_cache()
+        txt = self.normalize_text(txt)
+        key = (self.current_font['name'], self.font_size_pt, w, txt)
+        layout = cache.get(cache.layouts, key)
+        if layout is not None:
+            return layout
+
+        widths = cache.char_widths.get(key[:2])
+        if widths is None:
+            widths = cache.put(cache.char_widths, key[:2], {})
+        cw = self.current_font['cw']
+        wmax = (w - 2 * self.c_margin) * 1000.0 / self.font_size
+        s = txt.replace("\r", '')
+        nb = len(s)
+        if nb > 0 and s[nb - 1] == "\n":
+            nb -= 1
+        ops, ws = [], 0
+        sep, i, j, l, ns, ls = -1, 0, 0, 0, 0, 0
+        while i < nb:
+            c = s[i]
+            if c == "\n":
+                if ws > 0:
+                    ws = 0
+                    ops.append(('tw', 0))
+                ops.append(('cell', s[j:i]))
+                i += 1
+                sep, j, l, ns = -1, i, 0, 0
+                continue
+            if c == ' ':
+                sep, ls = i, l
+                ns += 1
+            if self.unifontsubset:
+                cw_c = widths.get(c)
+                if cw_c is None:
+                    cw_c = widths[c] = self.get_string_width(c) / self.font_size * 1000.0
+                l += cw_c
+            else:
+                l += cw.get(c, 0)
+            if l > wmax:
+                if sep == -1:
+                    if i == j:
+                        i += 1
+                    if ws > 0:
+                        ws = 0
+                        ops.append(('tw', 0))
+                    ops.append(('cell', s[j:i]))
+                else:
+                    ws = (wmax - ls) / 1000.0 * self.font_size / (ns - 1) if ns > 1 else 0
+                    ops.append(('ws', ws))
+                    ops.append(('cell', s[j:sep]))
+                    i = sep + 1
+                sep, j, l, ns = -1, i, 0, 0
+            else:
+                i += 1
+        if ws > 0:
+            ops.append(('tw', 0))
+        ops.append(('cell', s[j:i]))
+        layout = (tuple(ops), sum(1 for op in ops if op[0] == 'cell'))
+        return cache.put(cache.layouts, key, layout)
+
+    def draw_layout(self, w, h, layout):
+        """text_layout ile hazırlanmış parçayı geçerli konuma yazar (multi_cell çıktısıyla aynı PDF komutları)."""
+        for op, value in layout[0]:
+            if op == 'cell':
+                self.cell(w, h, value, 0, 2, 'J', 0)
+            else:
+                self.ws = value
+                self._out('%.3f Tw' % (value * self.k) if op == 'ws' else '0 Tw')
+        self.x = self.l_margin
             
+    def _putTTfontwidths(self, font, maxUni):
+        # FPDF her glif için listede 'in' araması yapar (65k x alt küme); set ile ve kayıttaki önbellekle üretilir
+        def build(fast_font):
+            captured = []
+            self._out = captured.append
+            try:
+                super(ExamPDFEngine, self)._putTTfontwidths(fast_font, maxUni)
+            finally:
+                del self._out
+            return captured[0]
+        self._out(get_font_registry().width_table(font, maxUni, build))
+
+    # FPDF._putfonts, TTFontFile'ı modül genelinden okur; modülü değiştirmek yerine aynı kod yalnızca bu sınıf için
+    # RegistryTTFontFile görecek şekilde bağlanır (diğer FPDF kullanımları etkilenmez)
+    _putfonts = type(FPDF._putfonts)(FPDF._putfonts.__code__, {**vars(fpdf_module), 'TTFontFile': RegistryTTFontFile},
+                                     '_putfonts', FPDF._putfonts.__defaults__, FPDF._putfonts.__closure__)
+
+    def add_bookmark(self, title, level=0):
+        """Bir sonraki sayfanın başına PDF yer imi (outline) ekler; seviye 0 ana başlık, 1 alt başlıktır."""
+        self.pending_bookmarks.append((title, level))
+
+    def _putbookmarks(self):
+        nb = len(self.outlines)
+        lru, level = {}, 0
+        for i, o in enumerate(self.outlines):
+            if o['l'] > 0:
+                parent = lru[o['l'] - 1]
+                o['parent'] = parent
+                self.outlines[parent]['last'] = i
+                if o['l'] > level:
+                    self.outlines[parent]['first'] = i
+            else:
+                o['parent'] = nb
+            if o['l'] <= level and i > 0:
+                prev = lru[o['l']]
+                self.outlines[prev]['next'] = i
+                o['prev'] = prev
+            lru[o['l']] = i
+            level = o['l']
+
+        n = self.n + 1
+        for o in self.outlines:
+            self._newobj()
+            title = '\xfe\xff' + o['t'].encode('utf-16-be').decode('latin-1')
+            self._out('<</Title ' + self._textstring(title))
+            self._out('/Parent %d 0 R' % (n + o['parent']))
+            for ref in ('prev', 'next', 'first', 'last'):
+                if ref in o:
+                    self._out('/%s %d 0 R' % (ref.capitalize(), n + o[ref]))
+            # FPDF'de n. sayfa nesnesi 1 + 2n numaralıdır (her sayfa + içerik akışı)
+            self._out('/Dest [%d 0 R /XYZ 0 %.2f null]' % (1 + 2 * o['p'], (self.h - o['y']) * self.k))
+            self._out('/Count 0>>')
+            self._out('endobj')
+        self._newobj()
+        self.outline_root = self.n
+        self._out('<</Type /Outlines /First %d 0 R' % n)
+        self._out('/Last %d 0 R>>' % (n + lru[0]))
+        self._out('endobj')
+
+    def _putresources(self):
+        super()._putresources()
+        if self.outlines:
+            self._putbookmarks()
+
+    def _putcatalog(self):
+        super()._putcatalog()
+        if self.outline_root:
+            self._out('/Outlines %d 0 R' % self.outline_root)
+            self._out('/PageMode /UseOutlines')
+
     def get_pdf_bytes(self):
         return self.output(dest='S').encode('latin-1')
 
@@ -480,6 +1308,12 @@ class ExamDocxEngine:
         section.right_margin = Inches(0.8)
         
     def generate(self, questions):
+        table = self._add_header()
+        for idx, q in enumerate(questions, 1):
+            self._add_question_row(table, idx, q)
+
+    def _add_header(self):
+        """Başlık, öğrenci bilgi tablosu ve boş soru tablosunu ekler; soru tablosunu döndürür."""
         h1 = self.doc.add_heading(self.meta['title'], 0)
         h1.alignment = WD_ALIGN_PARAGRAPH.CENTER
         
@@ -510,53 +1344,129 @@ class ExamDocxEngine:
         table.autofit = False 
         table.columns[0].width = Inches(0.4) 
         table.columns[1].width = Inches(6.5)
+        return table
+
+    def _add_question_row(self, table, idx, q):
+        row = table.add_row()
+        cell_num = row.cells[0]
+        cell_content = row.cells[1]
         
-        for idx, q in enumerate(questions, 1):
-            row = table.add_row()
-            cell_num = row.cells[0]
-            cell_content = row.cells[1]
-            
-            cell_num.text = f"{idx}."
-            cell_num.paragraphs[0].runs[0].bold = True
-            
-            q_text = q['QuestionText']
-            score_txt = f"({q['Score']} Puan)"
-            
-            p = cell_content.paragraphs[0]
-            runner = p.add_run(f"{q_text} ")
-            runner.bold = True
-            runner_score = p.add_run(score_txt)
-            runner_score.font.size = Pt(9)
+        cell_num.text = f"{idx}."
+        cell_num.paragraphs[0].runs[0].bold = True
+        
+        q_text = q.QuestionText
+        score_txt = f"({q.Score} Puan)"
+        
+        p = cell_content.paragraphs[0]
+        runner = p.add_run(f"{q_text} ")
+        runner.bold = True
+        runner_score = p.add_run(score_txt)
+        runner_score.font.size = Pt(9)
+        
+        if self.is_answer_key:
+            ans_p = cell_content.add_paragraph()
+            ans_runner = ans_p.add_run(f">> DOĞRU CEVAP: {q.CorrectAnswer or '-'}")
+            ans_runner.font.color.rgb = RGBColor(0xFF, 0x00, 0x00)
+            ans_runner.bold = True
+        else:
+            if q.QuestionType == 'MC':
+                for k, v in q.Options:
+                    p_opt = cell_content.add_paragraph(f"{k}) {v}")
+                    p_opt.paragraph_format.space_after = Pt(2)
+                        
+            elif q.QuestionType == 'TF':
+                cell_content.add_paragraph("( ) Doğru    ( ) Yanlış")
             
-            if self.is_answer_key:
-                ans_p = cell_content.add_paragraph()
-                ans_runner = ans_p.add_run(f">> DOĞRU CEVAP: {q.get('CorrectAnswer', '-')}")
-                ans_runner.font.color.rgb = RGBColor(0xFF, 0x00, 0x00)
-                ans_runner.bold = True
-            else:
-                if q['QuestionType'] == 'MC':
-                    opts = q['Options'] if isinstance(q['Options'], dict) else (json.loads(q['Options']) if isinstance(q['Options'], str) else {})
-                    if opts:
-                        for k, v in sorted(opts.items()):
-                            p_opt = cell_content.add_paragraph(f"{k}) {v}")
-                            p_opt.paragraph_format.space_after = Pt(2)
-                            
-                elif q['QuestionType'] == 'TF':
-                    cell_content.add_paragraph("( ) Doğru    ( ) Yanlış")
-                
-                elif q['QuestionType'] == 'CL': 
-                    cell_content.add_paragraph("") 
-                    for _ in range(self.classical_lines):
-                        p_line = cell_content.add_paragraph("_" * 90)
-                        p_line.paragraph_format.space_after = Pt(0)
+            elif q.QuestionType == 'CL': 
+                cell_content.add_paragraph("") 
+                for _ in range(self.classical_lines):
+                    p_line = cell_content.add_paragraph("_" * 90)
+                    p_line.paragraph_format.space_after = Pt(0)
 
-            cell_content.add_paragraph("")
+        cell_content.add_paragraph("")
 
     def get_docx_bytes(self):
         buffer = BytesIO()
         self.doc.save(buffer)
         return buffer.getvalue()
    
+class ExamDocxTemplateEngine(ExamDocxEngine):
+    """
+    Soru satırlarını düğüm düğüm kurmak yerine önceden üretilmiş satır XML şablonlarını kopyalayıp doldurur.
+    Şablon, soru türü / şık sayısı / cevap anahtarı / klasik satır sayısına göre bir kez ExamDocxEngine ile üretilir;
+    yalnızca değişken metin içeren run'lar yeniden yazıldığından çıktı XML'i ExamDocxEngine ile birebir aynıdır.
+    """
+    _row_templates = {}
+
+    def generate(self, questions):
+        table = self._add_header()
+        tbl = table._tbl
+        for idx, q in enumerate(questions, 1):
+            tbl.append(self._row_from_template(idx, q))
+
+    def _template_key(self, q):
+        if self.is_answer_key:
+            return (True,)
+        if q.QuestionType == 'MC':
+            return (False, 'MC', len(q.Options))
+        return (False, q.QuestionType, self.classical_lines if q.QuestionType == 'CL' else 0)
+
+    def _row_from_template(self, idx, q):
+        key = self._template_key(q)
+        # Önbellekteki satır yalnızca soru metni ve puanla doldurulur (şık sırasından bağımsız); grubun numarası, şık sırası
+        # ve cevap harfi kopya üzerine yazılır. Böylece şıkları karıştırılmış gruplar da aynı parçayı kullanır.
+        cache = get_fragment_cache()
+        fragment_key = (key, q.QuestionText, q.Score)
+        filled = cache.get(cache.docx_rows, fragment_key)
+        if filled is None:
+            template = self._row_templates.get(key)
+            if template is None:
+                scratch = ExamDocxEngine(self.meta, is_answer_key=self.is_answer_key, classical_lines=self.classical_lines)
+                scratch_table = scratch._add_header()
+                scratch._add_question_row(scratch_table, 1, q)
+                template = self._row_templates[key] = scratch_table._tbl.tr_lst[0]
+
+            filled = copy.deepcopy(template)
+            runs = list(filled.iter(qn('w:r')))
+            runs[1].text = f"{q.QuestionText} "
+            runs[2].text = f"({q.Score} Puan)"
+            cache.put(cache.docx_rows, fragment_key, filled)
+
+        tr = copy.deepcopy(filled)
+        runs = list(tr.iter(qn('w:r')))
+        runs[0].text = f"{idx}."
+        if self.is_answer_key:
+            runs[3].text = f">> DOĞRU CEVAP: {q.CorrectAnswer or '-'}"
+        elif q.QuestionType == 'MC':
+            for run, (k, v) in zip(runs[3:], q.Options):
+                run.text = f"{k}) {v}"
+        return tr
+
+def benchmark_docx_engines(runs=5, n_questions=100):
+    """Düğüm düğüm (ExamDocxEngine) ve şablon tabanlı (ExamDocxTemplateEngine) DOCX üretim hızını ve çıktı eşliğini ölçer."""
+    meta = {'title': 'Performans Testi', 'course': 'BENCH'}
+    questions = _benchmark_questions(n_questions)
+    rows = []
+    outputs = {}
+    for label, engine_cls in (("ExamDocxEngine (düğüm düğüm)", ExamDocxEngine),
+                              ("ExamDocxTemplateEngine (şablon kopyalama)", ExamDocxTemplateEngine)):
+        for is_key in (False, True):
+            start = time.perf_counter()
+            for _ in range(runs):
+                engine = engine_cls(meta, is_answer_key=is_key)
+                engine.generate(questions)
+                data = engine.get_docx_bytes()
+            elapsed = time.perf_counter() - start
+            with zipfile.ZipFile(BytesIO(data)) as zf:
+                outputs[(engine_cls, is_key)] = zf.read('word/document.xml')
+            rows.append({"Motor": label, "Belge": "Cevap Anahtarı" if is_key else "Kitapçık",
+                         "Soru": n_questions, "Belge/sn": round(runs / elapsed, 2),
+                         "Ortalama (ms)": round(elapsed * 1000 / runs, 1)})
+    for row in rows:
+        is_key = row["Belge"] == "Cevap Anahtarı"
+        row["XML Aynı"] = outputs[(ExamDocxEngine, is_key)] == outputs[(ExamDocxTemplateEngine, is_key)]
+    return rows
+
 def show_question_edit_form(q_id, q_data_full):
     
     q_data = q_data_full.copy()
@@ -630,6 +1540,30 @@ def show_question_edit_form(q_id, q_data_full):
                  st.session_state.pop('edit_qid', None) 
                  st.rerun()
 
+def normalize_question_text(text):
+    """Büyük/küçük harf, Unicode biçimi ve boşluk farklarını yok sayan karşılaştırma metni üretir."""
+    text = unicodedata.normalize('NFKC', str(text or ''))
+    return " ".join(text.casefold().split())
+
+def question_content_hash(question):
+    """
+    Birebir mükerrer tespiti için sorunun içerik özetini döndürür: soru tipi, normalize metin, sıralı normalize şıklar ve
+    doğru cevap (MC'de cevabın şık metni; şık sırası farklı aynı soru aynı özeti verir). Aynı kalıp metinli ama şıkları ya da
+    cevabı farklı sorular ayrı kabul edilir.
+    """
+    q_type = question.get('QuestionType') or ''
+    options = question.get('Options') if q_type == 'MC' else None
+    if isinstance(options, str):
+        try: options = json.loads(options)
+        except Exception: options = {}
+    options = dict(options or {})
+    options = {str(k).strip().upper(): normalize_question_text(v) for k, v in options.items() if v and str(v).strip()}
+    answer = str(question.get('CorrectAnswer') or '').strip()
+    answer = options.get(answer.upper()) or normalize_question_text(answer)
+    payload = json.dumps([q_type, normalize_question_text(question.get('QuestionText')), sorted(options.values()), answer],
+                         ensure_ascii=False, separators=(',', ':'))
+    return f"{CONTENT_HASH_VERSION}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
 def check_similarity(new_text, existing_questions, threshold=0.8):
     """Yeni metin ile mevcut sorular arasındaki benzerliği ölçer."""
     similar_questions = []
@@ -648,6 +1582,295 @@ def check_similarity(new_text, existing_questions, threshold=0.8):
             })
     return similar_questions
 
+def _minhash_signatures(texts, num_hashes=32, shingle_size=5, seed=42):
+    """Normalize metinlerin 5'li karakter parçalarından (shingle) MinHash imzalarını NumPy ile hesaplar."""
+    masks = np.random.RandomState(seed).randint(1, 2**32 - 1, size=num_hashes, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_hashes), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        shingles = {text[j:j + shingle_size] for j in range(max(1, len(text) - shingle_size + 1))}
+        hashes = np.fromiter((zlib.crc32(sh.encode('utf-8')) for sh in shingles), dtype=np.uint64, count=len(shingles))
+        signatures[i] = (hashes[None, :] ^ masks[:, None]).min(axis=1)
+    return signatures
+
+def run_duplicate_scan_job(job_id, db_file, course_code=None, threshold=0.85, bands=16, max_bucket=500, min_jaccard=0.4):
+    """
+    Arka plan işçisi: bankadaki yakın-mükerrer soruları kümeler.
+    Aday çiftler MinHash/LSH kovalarından üretilir, sadece bu adaylar difflib ile doğrulanır (tüm çiftler karşılaştırılmaz).
+    """
+    conn = sqlite3.connect(db_file, timeout=30.0)
+    conn.row_factory = sqlite3.Row
+
+    def report(progress, **extra):
+        cols = ", ".join(f"{k} = ?" for k in ['Progress', *extra])
+        conn.execute(f"UPDATE duplicate_scan_jobs SET {cols} WHERE JobID = ?", (round(progress, 3), *extra.values(), job_id))
+        conn.commit()
+
+    try:
+        report(0.0, Status='Running')
+        query, params = "SELECT QuestionID, CourseCode, QuestionText FROM questions", []
+        if course_code:
+            query += " WHERE CourseCode = ?"
+            params.append(course_code)
+        rows = conn.execute(query + " ORDER BY QuestionID", params).fetchall()
+        ids = [r['QuestionID'] for r in rows]
+        courses = [r['CourseCode'] for r in rows]
+        texts = [normalize_question_text(r['QuestionText']) for r in rows]
+        report(0.05, TotalQuestions=len(ids))
+
+        # 1. Aday üretimi (LSH bantları); kovalar derse göre ayrılır, farklı derslerin soruları aynı kümeye düşmez
+        signatures = _minhash_signatures(texts)
+        rows_per_band = signatures.shape[1] // bands
+        candidates = set()
+        for b in range(bands):
+            buckets = {}
+            band = signatures[:, b * rows_per_band:(b + 1) * rows_per_band]
+            for idx, key in enumerate(map(bytes, band)):
+                buckets.setdefault((courses[idx], key), []).append(idx)
+            for members in buckets.values():
+                if 1 < len(members) <= max_bucket:
+                    candidates.update((members[i], members[j]) for i in range(len(members)) for j in range(i + 1, len(members)))
+            report(0.05 + 0.35 * (b + 1) / bands)
+
+        # 2. Doğrulama ve kümeleme (union-find)
+        parent = list(range(len(ids)))
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        # MinHash uyuşma oranı (tahmini Jaccard) düşük olan adaylar difflib'e hiç gönderilmez
+        candidates = np.array(sorted(candidates), dtype=np.int64).reshape(-1, 2)
+        if len(candidates):
+            agreement = (signatures[candidates[:, 0]] == signatures[candidates[:, 1]]).mean(axis=1)
+            candidates = candidates[agreement >= min_jaccard]
+        step = max(1, len(candidates) // 50)
+        for n, (i, j) in enumerate(candidates.tolist(), 1):
+            matcher = difflib.SequenceMatcher(None, texts[i], texts[j])
+            if matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold:
+                parent[find(j)] = find(i)
+            if n % step == 0:
+                report(0.4 + 0.55 * n / len(candidates))
+
+        clusters = {}
+        for idx in range(len(ids)):
+            clusters.setdefault(find(idx), []).append(idx)
+        clusters = [sorted(m) for m in clusters.values() if len(m) > 1]
+
+        conn.execute("DELETE FROM duplicate_clusters WHERE JobID = ?", (job_id,))
+        for cluster_no, members in enumerate(clusters, 1):
+            rep = members[0]
+            conn.executemany("INSERT INTO duplicate_clusters (JobID, ClusterNo, QuestionID, Similarity) VALUES (?, ?, ?, ?)",
+                             [(job_id, cluster_no, ids[m], 1.0 if m == rep else round(difflib.SequenceMatcher(None, texts[rep], texts[m]).ratio(), 3)) for m in members])
+        report(1.0, Status='Done', ClusterCount=len(clusters), FinishedAt=datetime.now())
+    except Exception as e:
+        conn.rollback()
+        report(0.0, Status='Failed', Error=str(e), FinishedAt=datetime.now())
+    finally:
+        conn.close()
+
+def fit_irt_mml(person, item, y, n_persons, n_items, model='2PL', a_init=None, b_init=None, fixed=None,
+                max_iter=200, tol=1e-3, quad_points=31, progress=None):
+    """
+    1PL/2PL lojistik modeli seyrek gözlemler (kişi, madde, 0/1) üzerinde marjinal en çok olabilirlik (MML, Bock-Aitkin EM)
+    ile kestirir. Yetenekler tek tek kestirilmez, sabit kareleme noktaları üzerinde integre edilir: E adımında her kişinin
+    noktalar üzerindeki sonsal dağılımı, M adımında her madde için beklenen deneme/doğru sayılarıyla (a, b) Newton adımları
+    hesaplanır; tüm toplamlar np.bincount ile gözlem sayısında doğrusaldır. Sabit madde yoksa yetenek dağılımı N(0,1)
+    alınarak ölçek belirlenir (1PL'de a=1 olduğundan dağılımın yalnızca ortalaması 0'a sabitlenir, yayılımı kestirilir).
+    `fixed` maskesindeki maddeler sabit tutulduğunda (artımlı kalibrasyon) ölçeği onlar belirler ve yetenek dağılımı her
+    turda sonsal dağılımdan güncellenir. Zayıf önseller (a ~ N(1,1), kesişim ~ N(0,2)) tam/sıfır doğrulu maddelerde
+    kestirimin sonsuza kaçmasını önler.
+    Dönüş: (theta (EAP), a, b, iterasyon sayısı)
+    """
+    y = y.astype(np.float64)
+    fixed = np.zeros(n_items, dtype=bool) if fixed is None else fixed
+    free = ~fixed
+    base_nodes = np.linspace(-4.0, 4.0, quad_points)
+    weights = np.exp(-0.5 * base_nodes ** 2)
+    weights /= weights.sum()
+    nodes = base_nodes
+
+    item_p = np.clip(np.bincount(item, y, n_items) / np.maximum(np.bincount(item, minlength=n_items), 1), 0.02, 0.98)
+    b = -np.log(item_p / (1 - item_p)) / 1.7
+    a = np.ones(n_items)
+    if b_init is not None:
+        b = np.where(np.isnan(b_init), b, b_init)
+    if a_init is not None and model == '2PL':
+        a = np.where(np.isnan(a_init), a, a_init)
+
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        # E adımı: kişi başına kareleme noktalarındaki log-olabilirlik ve sonsal ağırlıklar
+        log_post = np.empty((quad_points, n_persons))
+        for q, x in enumerate(nodes):
+            logit = a[item] * (x - b[item])
+            log_post[q] = np.bincount(person, y * logit - np.logaddexp(0.0, logit), n_persons)
+        log_post += np.log(weights)[:, None]
+        post = np.exp(log_post - log_post.max(axis=0))
+        post /= post.sum(axis=0)
+
+        n_q = np.empty((quad_points, n_items))
+        r_q = np.empty((quad_points, n_items))
+        for q in range(quad_points):
+            w_q = post[q][person]
+            n_q[q] = np.bincount(item, w_q, n_items)
+            r_q[q] = np.bincount(item, w_q * y, n_items)
+
+        # M adımı: eğim-kesişim (a, c = -a*b) biçiminde madde başına 2x2 Newton adımları
+        a_old, b_old = a.copy(), b.copy()
+        c = -a * b
+        x = nodes[:, None]
+        for _ in range(2):
+            prob = 1.0 / (1.0 + np.exp(-np.clip(a * x + c, -30, 30)))
+            r, w = r_q - n_q * prob, n_q * prob * (1 - prob)
+            g_c, h_cc = r.sum(axis=0) - c / 4.0, w.sum(axis=0) + 0.25
+            if model == '2PL':
+                g_a, h_aa, h_ac = (r * x).sum(axis=0) - (a - 1.0), (w * x ** 2).sum(axis=0) + 1.0, (w * x).sum(axis=0)
+                det = h_aa * h_cc - h_ac ** 2
+                d_a = np.clip((h_cc * g_a - h_ac * g_c) / det, -0.5, 0.5)
+                d_c = np.clip((h_aa * g_c - h_ac * g_a) / det, -1, 1)
+                a = np.where(free, np.clip(a + d_a, 0.2, 4.0), a)
+            else:
+                d_c = np.clip(g_c / h_cc, -1, 1)
+            c = np.where(free, c + d_c, c)
+        b = np.where(free, -c / a, b)
+
+        marginal = post.mean(axis=1)
+        if fixed.any():
+            weights = np.maximum(marginal, 1e-12)
+        elif model == '1PL':
+            mean = marginal @ nodes
+            b -= mean
+            nodes = np.sqrt(max(marginal @ (nodes - mean) ** 2, 1e-6)) * base_nodes
+
+        change = max(np.abs(a - a_old).max(), np.abs(b - b_old).max())
+        if progress: progress(iterations, change)
+        if change < tol: break
+    return nodes @ post, a, b, iterations
+
+def verify_irt_recovery(seeds=(0, 1, 2), n_persons=3000, n_items=60):
+    """
+    Bilinen parametrelerle (theta ~ N(0,1), a ~ lognormal, b ~ N(0,1)) simüle edilmiş 2PL cevaplarını fit_irt_mml ile
+    kestirir ve parametrelerin ölçekleriyle birlikte geri elde edilip edilmediğini raporlar.
+    """
+    results = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        theta = rng.normal(size=n_persons)
+        a = rng.lognormal(0.2, 0.3, n_items)
+        b = rng.normal(size=n_items)
+        person = np.repeat(np.arange(n_persons), n_items)
+        item = np.tile(np.arange(n_items), n_persons)
+        y = rng.random(len(person)) < 1.0 / (1.0 + np.exp(-a[item] * (theta[person] - b[item])))
+
+        start = time.perf_counter()
+        theta_hat, a_hat, b_hat, iterations = fit_irt_mml(person, item, y, n_persons, n_items, model='2PL')
+        elapsed = time.perf_counter() - start
+        a_rmse = float(np.sqrt(np.mean((a_hat - a) ** 2)))
+        b_rmse = float(np.sqrt(np.mean((b_hat - b) ** 2)))
+        results.append({
+            "Tohum": seed, "İterasyon": iterations, "Süre (sn)": round(elapsed, 2),
+            "Theta SS": round(float(theta_hat.std()), 3),
+            "a Ort. (Kestirim / Gerçek)": f"{a_hat.mean():.2f} / {a.mean():.2f}",
+            "a RMSE": round(a_rmse, 3), "b RMSE": round(b_rmse, 3),
+            "b SS Oranı": round(float(b_hat.std() / b.std()), 3),
+            "Geçti": bool(iterations < 200 and abs(theta_hat.std() - 1) < 0.1 and a_rmse < 0.15 and b_rmse < 0.15
+                          and abs(a_hat.mean() / a.mean() - 1) < 0.1),
+        })
+    return results
+
+def load_irt_observations(conn):
+    """
+    Tüm değerlendirilmiş sınav sonuçlarını seyrek gözlem dizilerine çevirir: her sonuç satırı bir kişi,
+    her soru bankası sorusu (QuestionID) bir maddedir. Klasik ve anahtarı tanınmayan sorular dışarıda kalır.
+    Yalnızca verilen bağlantıyı kullanır (arka plan sürecinde uygulamanın `db` nesnesi yoktur).
+    Dönüş: (person, item, y, result_id, n_persons, item_ids)
+    """
+    store = DatabaseManager(migrate=False)
+    results = conn.execute("SELECT ResultID, ExamID, Responses FROM exam_results ORDER BY ExamID, ResultID").fetchall()
+    persons, items, ys, result_ids, item_index = [], [], [], [], {}
+    offset = 0
+    for exam_id in dict.fromkeys(r['ExamID'] for r in results):
+        exam = conn.execute("SELECT * FROM created_exams WHERE ExamID = ?", (exam_id,)).fetchone()
+        rows = [r for r in results if r['ExamID'] == exam_id]
+        if exam is None: continue
+        questions = [QuestionRecord.from_row(q) for q in store.get_exam_questions(dict(exam), conn)]
+        key, _ = exam_answer_key(questions)
+        cols = np.array([c for c in np.flatnonzero(key > 0) if questions[c].QuestionID is not None], dtype=np.int64)
+        if not len(cols): continue
+        n = len(questions)
+        R = np.frombuffer(''.join(str(r['Responses']).ljust(n)[:n] for r in rows).encode('ascii', 'replace'), dtype=np.uint8).reshape(-1, n)
+        Y = R[:, cols] == key[cols]
+        col_items = np.array([item_index.setdefault(int(questions[c].QuestionID), len(item_index)) for c in cols])
+        persons.append(np.repeat(np.arange(offset, offset + len(rows)), len(cols)))
+        items.append(np.tile(col_items, len(rows)))
+        ys.append(Y.ravel())
+        result_ids.append(np.repeat(np.array([r['ResultID'] for r in rows], dtype=np.int64), len(cols)))
+        offset += len(rows)
+    if not persons:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty.astype(bool), empty, 0, []
+    return (np.concatenate(persons), np.concatenate(items), np.concatenate(ys), np.concatenate(result_ids),
+            offset, list(item_index))
+
+def run_irt_calibration_job(job_id, db_file, model='2PL', full_refit=False):
+    """
+    Arka plan işçisi: soru bankasını tüm değerlendirilmiş cevaplarla 1PL/2PL modeline göre kalibre eder.
+    Artımlı modda yalnızca son kalibrasyondan sonra yeni cevap gelen (veya hiç kalibre edilmemiş) maddeler yeniden
+    kestirilir; diğer maddeler kayıtlı parametreleriyle sabit tutularak yetenek ölçeğini belirler.
+    """
+    conn = sqlite3.connect(db_file, timeout=30.0)
+    conn.row_factory = sqlite3.Row
+
+    def report(progress, **extra):
+        cols = ", ".join(f"{k} = ?" for k in ['Progress', *extra])
+        conn.execute(f"UPDATE irt_calibration_jobs SET {cols} WHERE JobID = ?", (round(progress, 3), *extra.values(), job_id))
+        conn.commit()
+
+    try:
+        report(0.0, Status='Running')
+        person, item, y, result_id, n_persons, item_ids = load_irt_observations(conn)
+        n_items = len(item_ids)
+        report(0.2, ResponseCount=int(len(y)), ItemCount=n_items)
+        if not n_items:
+            report(1.0, Status='Done', FinishedAt=datetime.now())
+            return
+
+        id_sub = stage_id_set(conn, item_ids)
+        stored = {row['QuestionID']: row for row in conn.execute(
+            f"SELECT QuestionID, IrtA, IrtB, IrtResultMark FROM questions WHERE QuestionID IN ({id_sub})").fetchall()}
+        # stage_id_set örtük bir işlem açar; uzun kestirim boyunca okuma kilidi tutulursa eşzamanlı işlerle kilitlenme olur
+        conn.commit()
+        mark = np.zeros(n_items, dtype=np.int64)
+        np.maximum.at(mark, item, result_id)
+        a_init = np.array([stored[q]['IrtA'] if q in stored and stored[q]['IrtA'] is not None else np.nan for q in item_ids], dtype=float)
+        b_init = np.array([stored[q]['IrtB'] if q in stored and stored[q]['IrtB'] is not None else np.nan for q in item_ids], dtype=float)
+        prev_mark = np.array([stored[q]['IrtResultMark'] or 0 if q in stored else 0 for q in item_ids], dtype=np.int64)
+        if model == '1PL':
+            a_init = np.ones(n_items)
+        fixed = np.zeros(n_items, dtype=bool) if full_refit else (~np.isnan(b_init)) & (mark <= prev_mark)
+        if not (~fixed).any():
+            report(1.0, Status='Done', RefitCount=0, FinishedAt=datetime.now())
+            return
+
+        theta, a, b, iterations = fit_irt_mml(
+            person, item, y, n_persons, n_items, model=model, a_init=a_init, b_init=b_init, fixed=fixed,
+            progress=lambda it, change: report(0.2 + 0.7 * min(it / 50, 1.0))
+        )
+        counts = np.bincount(item, minlength=n_items)
+        now = datetime.now()
+        conn.executemany(
+            "UPDATE questions SET IrtA = ?, IrtB = ?, IrtN = ?, IrtResultMark = ?, IrtFitAt = ? WHERE QuestionID = ?",
+            [(round(float(a[i]), 4), round(float(b[i]), 4), int(counts[i]), int(mark[i]), now, item_ids[i])
+             for i in np.flatnonzero(~fixed)]
+        )
+        report(1.0, Status='Done', RefitCount=int((~fixed).sum()), Iterations=iterations, FinishedAt=now)
+    except Exception as e:
+        conn.rollback()
+        report(0.0, Status='Failed', Error=str(e), FinishedAt=datetime.now())
+    finally:
+        conn.close()
+
 # ==============================================================================
 # 4. YARDIMCI SINIFLAR (DBP ÇEKİCİ)
 # ==============================================================================
@@ -669,9 +1892,74 @@ def get_db_connection():
     finally:
         conn.close()
 
+def worker_mp_context():
+    """
+    Arka plan süreçleri için başlatma bağlamı. Streamlit sunucusu çok iş parçacıklı olduğundan 'fork' kullanılmaz;
+    'forkserver' (yoksa 'spawn') ile açılan süreçler uygulama modülünü temiz biçimde yeniden yükler.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+@st.cache_resource(show_spinner=False)
+def get_background_workers():
+    """Süreç genelinde başlatılan arka plan işçileri; biten süreçler sonraki başlatmada toplanır (join)."""
+    return []
+
+def start_background_worker(target, args=()):
+    """
+    Uzun süren işleri Streamlit iş parçacığının dışında, ayrı bir süreçte çalıştırır.
+    Hedef, veritabanı yolunu parametre olarak alan ve kendi bağlantısını açan bağımsız bir işçi olmalıdır
+    (örn. run_duplicate_scan_job, run_irt_calibration_job); uygulamanın global nesnelerine dayanmaz.
+    """
+    workers = get_background_workers()
+    for finished in [w for w in workers if not w.is_alive()]:
+        finished.join()
+        workers.remove(finished)
+    worker = worker_mp_context().Process(target=target, args=args, daemon=True)
+    worker.start()
+    workers.append(worker)
+    return worker
+
+def stage_id_set(conn, ids):
+    """
+    ID listesini bağlantıya özel geçici tabloya yazar ve JOIN/IN için alt sorgu döndürür.
+    Tek bir hazır ifade (executemany) kullanıldığı için SQLITE_MAX_VARIABLE_NUMBER sınırına takılmaz.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS id_set (ID INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.id_set")
+    conn.executemany("INSERT OR IGNORE INTO temp.id_set (ID) VALUES (?)", ((int(i),) for i in ids))
+    return "SELECT ID FROM temp.id_set"
+
+def benchmark_id_set_ops(sizes=(10, 10_000, 500_000)):
+    """Geçici tablo tabanlı toplu işlemleri bellek içi veritabanında farklı boyutlarda ölçer."""
+    results = []
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE TABLE questions (QuestionID INTEGER PRIMARY KEY, UsageCount INTEGER DEFAULT 0)")
+        conn.executemany("INSERT INTO questions (QuestionID) VALUES (?)", ((i,) for i in range(1, max(sizes) + 1)))
+        for size in sizes:
+            ids = list(range(1, size + 1))
+            start = time.perf_counter()
+            sub = stage_id_set(conn, ids)
+            conn.execute(f"UPDATE questions SET UsageCount = UsageCount + 1 WHERE QuestionID IN ({sub})")
+            update_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            sub = stage_id_set(conn, ids)
+            conn.execute(f"DELETE FROM questions WHERE QuestionID IN ({sub})")
+            delete_ms = (time.perf_counter() - start) * 1000
+            conn.executemany("INSERT INTO questions (QuestionID) VALUES (?)", ((i,) for i in ids))
+
+            results.append({"ID Sayısı": size, "Güncelleme (ms)": round(update_ms, 2), "Silme (ms)": round(delete_ms, 2)})
+    finally:
+        conn.close()
+    return results
+
 class DatabaseManager:
-    def __init__(self):
-        self.init_db()
+    def __init__(self, migrate=True):
+        # migrate=False: yalnızca verilen bağlantılarla okuma yapan arka plan işçileri için (init_db çalıştırılmaz)
+        if migrate:
+            self.init_db()
 
     def init_db(self):
         """
@@ -759,6 +2047,17 @@ class DatabaseManager:
             if 'UsageCount' not in q_cols: 
                 try: cursor.execute("ALTER TABLE questions ADD COLUMN UsageCount INTEGER DEFAULT 0")
                 except Exception: pass
+            if 'ContentHash' not in q_cols:
+                try: cursor.execute("ALTER TABLE questions ADD COLUMN ContentHash TEXT")
+                except Exception: pass
+            if 'LastUsedAt' not in q_cols:
+                try: cursor.execute("ALTER TABLE questions ADD COLUMN LastUsedAt TIMESTAMP")
+                except Exception: pass
+            for col, col_type in (('EmpiricalP', 'REAL'), ('Discrimination', 'REAL'), ('ResponseCount', 'INTEGER'), ('AnalyzedAt', 'TIMESTAMP'),
+                                  ('IrtA', 'REAL'), ('IrtB', 'REAL'), ('IrtN', 'INTEGER'), ('IrtResultMark', 'INTEGER'), ('IrtFitAt', 'TIMESTAMP')):
+                if col not in q_cols:
+                    try: cursor.execute(f"ALTER TABLE questions ADD COLUMN {col} {col_type}")
+                    except Exception: pass
             
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS questions (
@@ -775,7 +2074,18 @@ class DatabaseManager:
                     CreatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     LastEditedBy TEXT,
                     LastEditedAt TIMESTAMP,
-                    UsageCount INTEGER DEFAULT 0
+                    UsageCount INTEGER DEFAULT 0,
+                    ContentHash TEXT,
+                    LastUsedAt TIMESTAMP,
+                    EmpiricalP REAL,
+                    Discrimination REAL,
+                    ResponseCount INTEGER,
+                    AnalyzedAt TIMESTAMP,
+                    IrtA REAL,
+                    IrtB REAL,
+                    IrtN INTEGER,
+                    IrtResultMark INTEGER,
+                    IrtFitAt TIMESTAMP
                 )
             """)
             
@@ -789,7 +2099,12 @@ class DatabaseManager:
                     CreatedBy TEXT,
                     CreatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     IsArchived INTEGER DEFAULT 0,
-                    Status TEXT DEFAULT 'Final'
+                    Status TEXT DEFAULT 'Final',
+                    FormGroup TEXT,
+                    FormNo INTEGER,
+                    GroupPermutations TEXT,
+                    ExamSettings TEXT,
+                    BundleHash TEXT
                 )
             """)
             
@@ -802,6 +2117,110 @@ class DatabaseManager:
                     Details TEXT
                 )
             """)
+
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS question_revisions (
+                    RevisionID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    QuestionID INTEGER NOT NULL,
+                    RevisionNo INTEGER NOT NULL,
+                    IsSnapshot INTEGER DEFAULT 0,
+                    Payload TEXT NOT NULL,
+                    EditedBy TEXT,
+                    EditedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (QuestionID, RevisionNo)
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS duplicate_scan_jobs (
+                    JobID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    CourseCode TEXT,             -- NULL: tüm veritabanı
+                    Threshold REAL,
+                    Status TEXT DEFAULT 'Queued',
+                    Progress REAL DEFAULT 0,
+                    TotalQuestions INTEGER DEFAULT 0,
+                    ClusterCount INTEGER DEFAULT 0,
+                    Error TEXT,
+                    CreatedBy TEXT,
+                    CreatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FinishedAt TIMESTAMP
+                )
+            """)
+
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS duplicate_clusters (
+                    JobID INTEGER NOT NULL,
+                    ClusterNo INTEGER NOT NULL,
+                    QuestionID INTEGER NOT NULL,
+                    Similarity REAL,
+                    Merged INTEGER DEFAULT 0,
+                    PRIMARY KEY (JobID, QuestionID)
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS booklet_runs (
+                    RunID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ExamID INTEGER,
+                    Seed TEXT,
+                    StudentCount INTEGER,
+                    StudentLabels TEXT,
+                    Settings TEXT,
+                    CreatedBy TEXT,
+                    CreatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("PRAGMA table_info(booklet_runs)")
+            if 'Settings' not in [info[1] for info in cursor.fetchall()]:
+                try: cursor.execute("ALTER TABLE booklet_runs ADD COLUMN Settings TEXT")
+                except Exception: pass
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS exam_results (
+                    ResultID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ExamID INTEGER NOT NULL,
+                    StudentLabel TEXT NOT NULL,
+                    GroupName TEXT,
+                    Responses TEXT,              -- Orijinal soru sırasında, orijinal şık harfleriyle ('-': boş)
+                    CorrectCount INTEGER,
+                    WrongCount INTEGER,
+                    BlankCount INTEGER,
+                    Score REAL,
+                    GradedBy TEXT,
+                    GradedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (ExamID, StudentLabel)
+                )
+            """)
+
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS item_statistics (
+                    ExamID INTEGER NOT NULL,
+                    QuestionID INTEGER NOT NULL,
+                    P REAL,
+                    Discrimination REAL,
+                    ResponseCount INTEGER,
+                    AnalyzedAt TIMESTAMP,
+                    PRIMARY KEY (ExamID, QuestionID)
+                )
+            """)
+            
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS irt_calibration_jobs (
+                    JobID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    Model TEXT DEFAULT '2PL',
+                    FullRefit INTEGER DEFAULT 0,
+                    Status TEXT DEFAULT 'Queued',
+                    Progress REAL DEFAULT 0,
+                    ResponseCount INTEGER DEFAULT 0,
+                    ItemCount INTEGER DEFAULT 0,
+                    RefitCount INTEGER DEFAULT 0,
+                    Iterations INTEGER DEFAULT 0,
+                    Error TEXT,
+                    CreatedBy TEXT,
+                    CreatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FinishedAt TIMESTAMP
+                )
+            """)
             
             cursor.execute("PRAGMA table_info(created_exams)")
             columns = [info[1] for info in cursor.fetchall()]
@@ -811,9 +2230,34 @@ class DatabaseManager:
             if 'IsArchived' not in columns:
                 try: cursor.execute("ALTER TABLE created_exams ADD COLUMN IsArchived INTEGER DEFAULT 0")
                 except Exception: pass
-            if 'Status' not in columns:
-                try: cursor.execute("ALTER TABLE created_exams ADD COLUMN Status TEXT DEFAULT 'Final'")
+            if 'Status' not in columns:
+                try: cursor.execute("ALTER TABLE created_exams ADD COLUMN Status TEXT DEFAULT 'Final'")
+                except Exception: pass
+            if 'FormGroup' not in columns:
+                try: cursor.execute("ALTER TABLE created_exams ADD COLUMN FormGroup TEXT")
+                except Exception: pass
+            if 'FormNo' not in columns:
+                try: cursor.execute("ALTER TABLE created_exams ADD COLUMN FormNo INTEGER")
+                except Exception: pass
+            if 'GroupPermutations' not in columns:
+                try: cursor.execute("ALTER TABLE created_exams ADD COLUMN GroupPermutations TEXT")
+                except Exception: pass
+            if 'ExamSettings' not in columns:
+                try: cursor.execute("ALTER TABLE created_exams ADD COLUMN ExamSettings TEXT")
                 except Exception: pass
+            if 'BundleHash' not in columns:
+                try: cursor.execute("ALTER TABLE created_exams ADD COLUMN BundleHash TEXT")
+                except Exception: pass
+
+            # İçerik özeti: boş ya da eski tanımla (başka sürüm) hesaplanmış kayıtlar için bir kerelik doldurma ve ders bazlı indeks
+            missing_hash = cursor.execute("""
+                SELECT QuestionID, QuestionType, QuestionText, Options, CorrectAnswer FROM questions
+                WHERE ContentHash IS NULL OR ContentHash NOT LIKE ?
+            """, (f"{CONTENT_HASH_VERSION}:%",)).fetchall()
+            if missing_hash:
+                cursor.executemany("UPDATE questions SET ContentHash = ? WHERE QuestionID = ?",
+                                   [(question_content_hash(dict(row)), row['QuestionID']) for row in missing_hash])
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_questions_course_hash ON questions (CourseCode, ContentHash)")
 
     def log_action(self, username, action, details):
         """
@@ -965,6 +2409,7 @@ class DatabaseManager:
             conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)", 
                          (log_username, 'COURSE_DELETED', log_details))
                          
+        invalidate_question_caches()
         return True
 
     def _validate_mc_question(self, data):
@@ -985,6 +2430,15 @@ class DatabaseManager:
                  raise ValueError(f"Doğru Cevap ('{correct_answer}') şıklar arasında bulunmuyor: {', '.join(valid_keys)}")
         return True
 
+    def find_duplicate_question(self, course_code, question, exclude_id=None, conn=None):
+        """(CourseCode, ContentHash) indeksi üzerinden birebir/normalize mükerrer soruyu (metin, tip, şıklar, cevap) arar; bulursa QuestionID döndürür."""
+        if conn is None:
+            with get_db_connection() as new_conn:
+                return self.find_duplicate_question(course_code, question, exclude_id, new_conn)
+        row = conn.execute("SELECT QuestionID FROM questions WHERE CourseCode = ? AND ContentHash = ? AND QuestionID != ? LIMIT 1",
+                           (course_code, question_content_hash(question), exclude_id if exclude_id is not None else -1)).fetchone()
+        return row[0] if row else None
+
     def add_question(self, data):
         try:
              self._validate_mc_question(data)
@@ -993,18 +2447,26 @@ class DatabaseManager:
              return False
 
         options_json = json.dumps(data.get('Options', {}), ensure_ascii=False) if data.get('QuestionType') == 'MC' else None
+        content_hash = question_content_hash(data)
         
         with get_db_connection() as conn:
-            conn.execute("""
-                INSERT INTO questions (CourseCode, TopicArea, Complexity, QuestionType, Score, QuestionText, Options, CorrectAnswer, CreatedBy)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            dup_id = self.find_duplicate_question(data['CourseCode'], data, conn=conn)
+            if dup_id:
+                st.error(f"Soru Ekleme Hatası: Bu derste birebir aynı soru zaten mevcut (ID: {dup_id}).")
+                return False
+
+            cur = conn.execute("""
+                INSERT INTO questions (CourseCode, TopicArea, Complexity, QuestionType, Score, QuestionText, Options, CorrectAnswer, CreatedBy, ContentHash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (data['CourseCode'], data['TopicArea'], data['Complexity'], data['QuestionType'], data['Score'], 
-                  data['QuestionText'], options_json, data['CorrectAnswer'], data['CreatedBy']))
+                  data['QuestionText'], options_json, data['CorrectAnswer'], data['CreatedBy'], content_hash))
+            self._ensure_revision(conn, cur.lastrowid)
             
             log_details = f"Course: {data['CourseCode']}, Topic: {data['TopicArea']}, Type: {data['QuestionType']}"
             conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)", 
                          (data['CreatedBy'], 'QUESTION_ADDED', log_details))
                          
+        invalidate_question_caches()
         return True
 
     def update_question(self, q_id, data, editor_username):
@@ -1015,30 +2477,259 @@ class DatabaseManager:
              return False
 
         options_json = json.dumps(data.get('Options', {}), ensure_ascii=False) if data.get('QuestionType') == 'MC' else None
+        content_hash = question_content_hash(data)
         
         with get_db_connection() as conn:
+            dup_id = self.find_duplicate_question(data['CourseCode'], data, exclude_id=q_id, conn=conn)
+            if dup_id:
+                st.error(f"Soru Güncelleme Hatası: Bu derste birebir aynı soru zaten mevcut (ID: {dup_id}).")
+                return False
+
+            self._ensure_revision(conn, q_id)
             conn.execute("""
-                UPDATE questions SET CourseCode=?, TopicArea=?, Complexity=?, QuestionType=?, Score=?, QuestionText=?, Options=?, CorrectAnswer=?, LastEditedBy=?, LastEditedAt=?
+                UPDATE questions SET CourseCode=?, TopicArea=?, Complexity=?, QuestionType=?, Score=?, QuestionText=?, Options=?, CorrectAnswer=?, LastEditedBy=?, LastEditedAt=?, ContentHash=?
                 WHERE QuestionID=?
             """, (data['CourseCode'], data['TopicArea'], data['Complexity'], data['QuestionType'], data['Score'], 
-                  data['QuestionText'], options_json, data['CorrectAnswer'], editor_username, datetime.now(), q_id))
+                  data['QuestionText'], options_json, data['CorrectAnswer'], editor_username, datetime.now(), content_hash, q_id))
+            self._record_revision(conn, q_id, editor_username)
             
             log_details = f"QID: {q_id}, Course: {data['CourseCode']}, Topic: {data['TopicArea']}"
             conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)", 
                          (editor_username, 'QUESTION_UPDATED', log_details))
                          
+        invalidate_question_caches()
+        return True
+
+    # --- Revizyon Geçmişi (Delta Depolama) ---
+    @staticmethod
+    def _make_text_delta(old, new):
+        """İki metin arasındaki farkı difflib opcode'ları ile kompakt listeye çevirir ([i1, i2] = eskiden kopyala, str = yeni metin)."""
+        ops = []
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+            if tag == 'equal':
+                ops.append([i1, i2])
+            elif tag in ('replace', 'insert'):
+                ops.append(new[j1:j2])
+        return ops
+
+    @staticmethod
+    def _apply_text_delta(base, ops):
+        return "".join(base[op[0]:op[1]] if isinstance(op, list) else op for op in ops)
+
+    def _current_question_state(self, conn, q_id):
+        row = conn.execute(f"SELECT {', '.join(REVISION_FIELDS)}, CreatedBy FROM questions WHERE QuestionID = ?", (q_id,)).fetchone()
+        if not row: return None, None
+        return {f: row[f] for f in REVISION_FIELDS}, row['CreatedBy']
+
+    def _load_revision_state(self, conn, q_id, revision_no):
+        """En yakın tam kopyadan başlayarak deltaları uygular ve istenen revizyonun içeriğini döndürür."""
+        rows = conn.execute("""
+            SELECT IsSnapshot, Payload FROM question_revisions
+            WHERE QuestionID = ? AND RevisionNo <= ? AND RevisionNo >= (
+                SELECT MAX(RevisionNo) FROM question_revisions WHERE QuestionID = ? AND IsSnapshot = 1 AND RevisionNo <= ?
+            )
+            ORDER BY RevisionNo ASC
+        """, (q_id, revision_no, q_id, revision_no)).fetchall()
+        state = None
+        for row in rows:
+            payload = json.loads(row['Payload'])
+            if row['IsSnapshot']:
+                state = dict(payload['fields'])
+                continue
+            for field, ops in payload.get('deltas', {}).items():
+                state[field] = self._apply_text_delta(state[field], ops)
+            state.update(payload.get('fields', {}))
+        return state
+
+    def _record_revision(self, conn, q_id, editor_username):
+        """Sorunun güncel hâlini yeni revizyon olarak kaydeder; değişiklik yoksa son RevisionID'yi döndürür."""
+        new_state, _ = self._current_question_state(conn, q_id)
+        if new_state is None: return None
+        last = conn.execute("SELECT RevisionID, RevisionNo FROM question_revisions WHERE QuestionID = ? ORDER BY RevisionNo DESC LIMIT 1", (q_id,)).fetchone()
+
+        if not last:
+            revision_no, is_snapshot, payload = 1, 1, {'fields': new_state}
+        else:
+            old_state = self._load_revision_state(conn, q_id, last['RevisionNo'])
+            if old_state == new_state:
+                return last['RevisionID']
+            revision_no = last['RevisionNo'] + 1
+            if last['RevisionNo'] % REVISION_SNAPSHOT_INTERVAL == 0:
+                is_snapshot, payload = 1, {'fields': new_state}
+            else:
+                is_snapshot, payload = 0, {'fields': {}, 'deltas': {}}
+                for f in REVISION_FIELDS:
+                    if old_state[f] == new_state[f]: continue
+                    if f in ('QuestionText', 'Options') and isinstance(old_state[f], str) and isinstance(new_state[f], str):
+                        payload['deltas'][f] = self._make_text_delta(old_state[f], new_state[f])
+                    else:
+                        payload['fields'][f] = new_state[f]
+
+        cur = conn.execute("INSERT INTO question_revisions (QuestionID, RevisionNo, IsSnapshot, Payload, EditedBy) VALUES (?, ?, ?, ?, ?)",
+                           (q_id, revision_no, is_snapshot, json.dumps(payload, ensure_ascii=False, separators=(',', ':')), editor_username))
+        return cur.lastrowid
+
+    def _ensure_revision(self, conn, q_id):
+        """Revizyonu olmayan (eski) sorular için mevcut hâlinden ilk tam kopyayı oluşturur ve son RevisionID'yi döndürür."""
+        last = conn.execute("SELECT RevisionID FROM question_revisions WHERE QuestionID = ? ORDER BY RevisionNo DESC LIMIT 1", (q_id,)).fetchone()
+        if last: return last['RevisionID']
+        _, created_by = self._current_question_state(conn, q_id)
+        return self._record_revision(conn, q_id, created_by)
+
+    def get_question_revisions(self, q_id):
+        """Sorunun revizyon listesini (içerik hariç) yeniden eskiye döndürür."""
+        with get_db_connection() as conn:
+            return [dict(row) for row in conn.execute("""
+                SELECT RevisionID, RevisionNo, IsSnapshot, EditedBy, EditedAt, LENGTH(Payload) AS PayloadSize
+                FROM question_revisions WHERE QuestionID = ? ORDER BY RevisionNo DESC
+            """, (q_id,)).fetchall()]
+
+    def get_revision_content(self, revision_id, conn=None):
+        """Belirli bir revizyonun tam içeriğini (QuestionID ve RevisionNo dahil) döndürür."""
+        if conn is None:
+            with get_db_connection() as new_conn:
+                return self.get_revision_content(revision_id, new_conn)
+        row = conn.execute("SELECT QuestionID, RevisionNo FROM question_revisions WHERE RevisionID = ?", (revision_id,)).fetchone()
+        if not row: return None
+        state = self._load_revision_state(conn, row['QuestionID'], row['RevisionNo'])
+        return {**state, 'QuestionID': row['QuestionID'], 'RevisionID': revision_id, 'RevisionNo': row['RevisionNo']}
+
+    def revert_question(self, q_id, revision_id, editor_username):
+        """Soruyu seçilen revizyona geri döndürür (geri dönüş de yeni bir revizyon olarak kaydedilir)."""
+        content = self.get_revision_content(revision_id)
+        if not content or content['QuestionID'] != q_id:
+            st.error("Revizyon bulunamadı.")
+            return False
+        data = {f: content[f] for f in REVISION_FIELDS}
+        if data['QuestionType'] == 'MC':
+            try: data['Options'] = json.loads(data['Options']) if data['Options'] else {}
+            except: data['Options'] = {}
+        if not self.update_question(q_id, data, editor_username):
+            return False
+        self.log_action(editor_username, 'QUESTION_REVERTED', f"QID: {q_id}, RevisionNo: {content['RevisionNo']}")
         return True
 
     def bulk_delete_questions(self, q_ids):
         if not q_ids: return
         with get_db_connection() as conn:
-            ph = ','.join('?' for _ in q_ids)
-            conn.execute(f"DELETE FROM questions WHERE QuestionID IN ({ph})", q_ids)
-            
+            id_sub = stage_id_set(conn, q_ids)
+            conn.execute(f"DELETE FROM questions WHERE QuestionID IN ({id_sub})")
+
             log_username = st.session_state['user']['Username']
             log_details = f"Count: {len(q_ids)}, IDs: {q_ids[:5]}..."
             conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)", 
                          (log_username, 'QUESTIONS_DELETED', log_details))
+        invalidate_question_caches()
+
+    # --- Mükerrer Soru Taraması ---
+    def start_duplicate_scan(self, course_code, threshold, username):
+        """Tarama işini kuyruğa ekler ve arka plan işçisini başlatır."""
+        with get_db_connection() as conn:
+            job_id = conn.execute("INSERT INTO duplicate_scan_jobs (CourseCode, Threshold, CreatedBy) VALUES (?, ?, ?)",
+                                  (course_code, threshold, username)).lastrowid
+            conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)",
+                         (username, 'DUPLICATE_SCAN_STARTED', f"JobID: {job_id}, Course: {course_code or 'ALL'}, Threshold: {threshold}"))
+        start_background_worker(run_duplicate_scan_job, (job_id, os.path.abspath(DB_FILE), course_code, threshold))
+        return job_id
+
+    # --- IRT Kalibrasyonu ---
+    def start_irt_calibration(self, model, full_refit, username):
+        """Kalibrasyon işini kuyruğa ekler ve arka plan işçisini başlatır."""
+        with get_db_connection() as conn:
+            job_id = conn.execute("INSERT INTO irt_calibration_jobs (Model, FullRefit, CreatedBy) VALUES (?, ?, ?)",
+                                  (model, int(full_refit), username)).lastrowid
+            conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)",
+                         (username, 'IRT_CALIBRATION_STARTED', f"JobID: {job_id}, Model: {model}, FullRefit: {bool(full_refit)}"))
+        start_background_worker(run_irt_calibration_job, (job_id, os.path.abspath(DB_FILE), model, full_refit))
+        return job_id
+
+    def get_latest_irt_job(self):
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT * FROM irt_calibration_jobs ORDER BY JobID DESC LIMIT 1").fetchone()
+            return dict(row) if row else None
+
+    def get_latest_duplicate_job(self):
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT * FROM duplicate_scan_jobs ORDER BY JobID DESC LIMIT 1").fetchone()
+            return dict(row) if row else None
+
+    def get_duplicate_clusters(self, job_id):
+        """Birleştirilmemiş ve hâlâ bankada bulunan küme üyelerini {ClusterNo: [soru, ...]} olarak döndürür."""
+        with get_db_connection() as conn:
+            rows = conn.execute("""
+                SELECT dc.ClusterNo, dc.Similarity, q.QuestionID, q.CourseCode, q.TopicArea, q.QuestionType, q.QuestionText, q.UsageCount
+                FROM duplicate_clusters dc JOIN questions q ON q.QuestionID = dc.QuestionID
+                WHERE dc.JobID = ? AND dc.Merged = 0
+                ORDER BY dc.ClusterNo, q.QuestionID
+            """, (job_id,)).fetchall()
+        clusters = {}
+        for row in rows:
+            clusters.setdefault(row['ClusterNo'], []).append(dict(row))
+        return {no: members for no, members in clusters.items() if len(members) > 1}
+
+    def merge_questions(self, keep_id, duplicate_ids, username):
+        """
+        Mükerrer soruları tek soruda birleştirir: UsageCount toplanır, LastUsedAt en yakın kullanım olur, sınavlardaki
+        referanslar korunan soruya ve onun güncel revizyonuna yönlendirilir, mükerrerler revizyon geçmişleriyle birlikte silinir.
+        Farklı derslerin soruları birleştirilmez; korunan soruyla mükerrerini birlikte içeren sınav varsa birleştirme yapılmaz.
+        """
+        keep_id = int(keep_id)
+        duplicate_ids = [int(i) for i in duplicate_ids if int(i) != keep_id]
+        if not duplicate_ids: return False
+        dup_set = set(duplicate_ids)
+
+        with get_db_connection() as conn:
+            id_sub = stage_id_set(conn, duplicate_ids + [keep_id])
+            courses = {r[0] for r in conn.execute(f"SELECT DISTINCT CourseCode FROM questions WHERE QuestionID IN ({id_sub})").fetchall()}
+            if len(courses) > 1:
+                st.error(f"Birleştirme Hatası: Farklı derslerin soruları birleştirilemez ({', '.join(sorted(map(str, courses)))}).")
+                return False
+
+            updates, conflicts = [], []
+            keep_rev = None
+            for exam in conn.execute("SELECT ExamID, ExamData FROM created_exams").fetchall():
+                try: qs = json.loads(exam['ExamData']) if exam['ExamData'] else []
+                except Exception: continue
+                if not any(q.get('QuestionID') in dup_set for q in qs): continue
+                for q in qs:
+                    if q.get('QuestionID') in dup_set:
+                        q['QuestionID'] = keep_id
+                        # Mükerrerin revizyon geçmişi silineceğinden referans korunan sorunun güncel hâline bağlanır
+                        if 'RevisionID' in q:
+                            keep_rev = keep_rev or self._record_revision(conn, keep_id, username)
+                            q['RevisionID'] = keep_rev
+                if sum(1 for q in qs if q.get('QuestionID') == keep_id) > 1:
+                    conflicts.append(exam['ExamID'])
+                else:
+                    updates.append((json.dumps(qs, ensure_ascii=False), exam['ExamID']))
+            if conflicts:
+                st.error(f"Birleştirme Hatası: Şu sınavlar korunan soruyu ve mükerrerini birlikte içeriyor, birleştirme aynı soruyu iki kez "
+                         f"içeren sınavlar oluştururdu: {', '.join(map(str, conflicts[:20]))}")
+                return False
+
+            id_sub = stage_id_set(conn, duplicate_ids)
+            extra_usage = conn.execute(f"SELECT COALESCE(SUM(UsageCount), 0) FROM questions WHERE QuestionID IN ({id_sub})").fetchone()[0]
+            conn.execute(f"""
+                UPDATE questions SET UsageCount = COALESCE(UsageCount, 0) + ?,
+                    LastUsedAt = (SELECT MAX(LastUsedAt) FROM questions WHERE QuestionID = ? OR QuestionID IN ({id_sub}))
+                WHERE QuestionID = ?
+            """, (extra_usage, keep_id, keep_id))
+
+            conn.executemany("UPDATE created_exams SET ExamData = ? WHERE ExamID = ?", updates)
+            repointed = len(updates)
+
+            conn.execute(f"DELETE FROM questions WHERE QuestionID IN ({id_sub})")
+            conn.execute(f"DELETE FROM question_revisions WHERE QuestionID IN ({id_sub})")
+            conn.execute(f"UPDATE duplicate_clusters SET Merged = 1 WHERE QuestionID IN ({id_sub}) OR QuestionID = ?", (keep_id,))
+            # Mükerrerlerin sınav bazlı madde istatistikleri korunan soruya aktarılır ve birleşik değerler yeniden hesaplanır
+            conn.execute(f"UPDATE OR IGNORE item_statistics SET QuestionID = ? WHERE QuestionID IN ({id_sub})", (keep_id,))
+            conn.execute(f"DELETE FROM item_statistics WHERE QuestionID IN ({id_sub})")
+            self._refresh_item_statistics(conn, [keep_id])
+
+            conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)",
+                         (username, 'QUESTIONS_MERGED', f"Keep: {keep_id}, Merged: {duplicate_ids[:10]}, Usage +{extra_usage}, Exams: {repointed}"))
+        invalidate_question_caches()
+        return True
 
     def get_questions(self, user_context, course_code=None):
         query = "SELECT * FROM questions WHERE 1=1"
@@ -1053,6 +2744,40 @@ class DatabaseManager:
         with get_db_connection() as conn:
             return [dict(row) for row in conn.execute(query, params).fetchall()]
             
+    def get_selection_rows(self, user_context, course_code):
+        """Sınav sihirbazının seçim indeksi için sadece gruplama sütunlarını çeker (soru metni yüklenmez)."""
+        query = "SELECT QuestionID, QuestionType, Complexity, TopicArea, Score, UsageCount, LastUsedAt, EmpiricalP, ResponseCount, IrtA, IrtB FROM questions WHERE CourseCode = ?"
+        params = [course_code]
+        if user_context['Role'] != 'Admin':
+            query += " AND CreatedBy = ?"
+            params.append(user_context['Username'])
+        with get_db_connection() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def get_questions_by_ids(self, q_ids):
+        """Verilen ID'lerdeki soruları, ID listesinin sırasını koruyarak tam içerikle getirir."""
+        if not q_ids: return []
+        with get_db_connection() as conn:
+            id_sub = stage_id_set(conn, q_ids)
+            rows = {row['QuestionID']: dict(row) for row in conn.execute(f"SELECT * FROM questions WHERE QuestionID IN ({id_sub})").fetchall()}
+        return [rows[int(i)] for i in q_ids if int(i) in rows]
+
+    def get_recent_exam_question_ids(self, user_context, course_code, last_n):
+        """Dersin son N final sınavında kullanılan soru ID'lerini döndürür."""
+        query = "SELECT ExamData FROM created_exams WHERE CourseCode = ? AND Status = 'Final'"
+        params = [course_code]
+        if user_context['Role'] != 'Admin':
+            query += " AND CreatedBy = ?"
+            params.append(user_context['Username'])
+        query += " ORDER BY CreatedAt DESC, ExamID DESC LIMIT ?"
+        params.append(last_n)
+        recent_ids = set()
+        with get_db_connection() as conn:
+            for row in conn.execute(query, params).fetchall():
+                try: recent_ids.update(q['QuestionID'] for q in json.loads(row['ExamData'] or '[]') if 'QuestionID' in q)
+                except Exception: continue
+        return recent_ids
+
     def get_single_question(self, q_id):
          with get_db_connection() as conn:
              row = conn.execute("SELECT * FROM questions WHERE QuestionID = ?", (q_id,)).fetchone()
@@ -1062,8 +2787,9 @@ class DatabaseManager:
         """Kullanılan soruların UsageCount sayacını artırır."""
         if not q_ids: return
         with get_db_connection() as conn:
-             ph = ','.join('?' for _ in q_ids)
-             conn.execute(f"UPDATE questions SET UsageCount = UsageCount + 1 WHERE QuestionID IN ({ph})", q_ids)
+             id_sub = stage_id_set(conn, q_ids)
+             conn.execute(f"UPDATE questions SET UsageCount = UsageCount + 1, LastUsedAt = ? WHERE QuestionID IN ({id_sub})", (datetime.now(),))
+        invalidate_question_caches()
 
     def get_stats(self, user_context, course_code=None):
         where_clause = ""
@@ -1108,29 +2834,172 @@ class DatabaseManager:
                 'recent_questions': recent_list
             }
 
-    def save_exam(self, meta, questions, status='Final'):
-        exam_json = json.dumps(questions, ensure_ascii=False)
+    def _compact_exam_questions(self, conn, questions):
+        """
+        İçeriği bir revizyonla birebir aynı olan soruları sadece {QuestionID, RevisionID, Score} referansı olarak saklar.
+        Sınav anındaki içerikten farklı olanlar (örn. eski taslaklar) tam kopya olarak kalır.
+        """
+        compact = []
+        for q in questions:
+            if 'QuestionID' not in q:
+                compact.append(q)
+                continue
+            rev_id = q.get('RevisionID') or self._ensure_revision(conn, q['QuestionID'])
+            state = self.get_revision_content(rev_id, conn) if rev_id else None
+            as_opts = lambda v: json.loads(v) if isinstance(v, str) and v else (v or {})
+            same = state is not None and all(
+                (as_opts(state[f]) == as_opts(q.get(f))) if f == 'Options' else state[f] == q.get(f)
+                for f in REVISION_FIELDS if f != 'Score'
+            )
+            compact.append({'QuestionID': q['QuestionID'], 'RevisionID': rev_id, 'Score': q['Score']} if same else q)
+        return compact
+
+    def get_exam_questions(self, exam_row, conn=None):
+        """ExamData içindeki revizyon referanslarını tam soru içeriğine çevirir."""
+        qs = json.loads(exam_row['ExamData']) if exam_row.get('ExamData') else []
+        if not any('RevisionID' in q and 'QuestionText' not in q for q in qs):
+            return qs
+        if conn is None:
+            with get_db_connection() as new_conn:
+                return self.get_exam_questions(exam_row, new_conn)
+        hydrated = []
+        for q in qs:
+            if 'RevisionID' in q and 'QuestionText' not in q:
+                content = self.get_revision_content(q['RevisionID'], conn) or {}
+                q = {**content, 'QuestionID': q['QuestionID'], 'RevisionID': q['RevisionID'], 'Score': q['Score']}
+            hydrated.append(q)
+        return hydrated
+
+    def save_exam(self, meta, questions, status='Final', form_group=None, form_no=None, group_permutations=None):
+        questions = [q.to_dict() if hasattr(q, 'to_dict') else q for q in questions]
         total_score = meta.get('score', sum(q['Score'] for q in questions if 'Score' in q))
         
         log_details = f"Title: {meta['title']}, Course: {meta['course']}, Score: {total_score}, QCount: {len(questions)}, Status: {status}"
+        if form_group:
+            log_details += f", FormGroup: {form_group}, FormNo: {form_no}"
 
         with get_db_connection() as conn:
+            exam_json = json.dumps(self._compact_exam_questions(conn, questions), ensure_ascii=False)
             
-            conn.execute("""
-                INSERT INTO created_exams (Title, CourseCode, TotalScore, ExamData, CreatedBy, Status)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (meta['title'], meta['course'], total_score, exam_json, meta['creator'], status))
+            cur = conn.execute("""
+                INSERT INTO created_exams (Title, CourseCode, TotalScore, ExamData, CreatedBy, Status, FormGroup, FormNo, GroupPermutations, ExamSettings)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (meta['title'], meta['course'], total_score, exam_json, meta['creator'], status, form_group, form_no,
+                  dump_group_permutations(group_permutations) if group_permutations else None,
+                  json.dumps({k: meta[k] for k in ('groups', *EXAM_LAYOUT_SETTINGS) if k in meta}, ensure_ascii=False)))
+            exam_id = cur.lastrowid
             
             if status == 'Final':
                 q_ids = [q['QuestionID'] for q in questions if 'QuestionID' in q]
                 if q_ids:
-                     ph = ','.join('?' for _ in q_ids)
-                     conn.execute(f"UPDATE questions SET UsageCount = UsageCount + 1 WHERE QuestionID IN ({ph})", q_ids)
+                     id_sub = stage_id_set(conn, q_ids)
+                     conn.execute(f"UPDATE questions SET UsageCount = UsageCount + 1, LastUsedAt = ? WHERE QuestionID IN ({id_sub})", (datetime.now(),))
                  
             conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)", 
                          (meta['creator'], 'EXAM_CREATED', log_details))
 
-            return conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        if status == 'Final':
+            invalidate_question_caches()
+        return exam_id
+
+    def save_parallel_forms(self, meta, forms):
+        """
+        Paralel formları ortak bir FormGroup kimliğiyle bağlantılı Final sınavlar olarak kaydeder. Her form, sınav ayarındaki
+        kitapçık gruplarına göre kendi grup permütasyonlarıyla saklanır (arşivden yeniden basım ve değerlendirme için).
+        """
+        form_group = f"PF-{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.urandom(2).hex()}"
+        exam_ids = []
+        for form_no, questions in enumerate(forms, 1):
+            form_meta = {**meta, 'title': f"{meta['title']} - Form {form_no}"}
+            group_perms = build_group_permutations(questions, exam_group_names(meta))
+            exam_ids.append(self.save_exam(form_meta, questions, 'Final', form_group, form_no, group_permutations=group_perms))
+        return form_group, exam_ids
+
+    def save_booklet_run(self, exam_id, seed, student_labels, username, meta=None):
+        """
+        Bireysel kitapçık üretimini kaydeder: tohum (seed), öğrenci listesi ve sayfa düzeni ayarları (EXAM_LAYOUT_SETTINGS)
+        saklanır, kitapçıklar bundan yeniden türetilir.
+        """
+        numbered = student_labels == [str(i) for i in range(1, len(student_labels) + 1)]
+        settings = {k: meta[k] for k in EXAM_LAYOUT_SETTINGS if k in meta} if meta else {}
+        with get_db_connection() as conn:
+            cur = conn.execute(
+                "INSERT INTO booklet_runs (ExamID, Seed, StudentCount, StudentLabels, Settings, CreatedBy) VALUES (?, ?, ?, ?, ?, ?)",
+                (exam_id, str(seed), len(student_labels), None if numbered else json.dumps(student_labels, ensure_ascii=False),
+                 json.dumps(settings, ensure_ascii=False) if settings else None, username)
+            )
+            conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)",
+                         (username, 'BOOKLETS_CREATED', f"ExamID: {exam_id}, Seed: {seed}, Students: {len(student_labels)}"))
+            return cur.lastrowid
+
+    def get_booklet_runs(self, exam_id):
+        with get_db_connection() as conn:
+            runs = [dict(row) for row in conn.execute("SELECT * FROM booklet_runs WHERE ExamID = ? ORDER BY RunID DESC", (exam_id,)).fetchall()]
+        for run in runs:
+            run['StudentLabels'] = json.loads(run['StudentLabels']) if run['StudentLabels'] else [str(i) for i in range(1, run['StudentCount'] + 1)]
+            run['Settings'] = json.loads(run['Settings']) if run.get('Settings') else {}
+        return runs
+
+    def save_exam_results(self, exam_id, results, username):
+        """Değerlendirme sonuçlarını kaydeder; aynı öğrencinin önceki sonucu yenisiyle değiştirilir."""
+        rows = [(exam_id, r['Öğrenci'], r['Grup'], r['Cevaplar'], r['Doğru'], r['Yanlış'], r['Boş'], r['Puan'], username)
+                for r in results]
+        with get_db_connection() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO exam_results
+                    (ExamID, StudentLabel, GroupName, Responses, CorrectCount, WrongCount, BlankCount, Score, GradedBy)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)",
+                         (username, 'EXAM_GRADED', f"ExamID: {exam_id}, Students: {len(rows)}"))
+
+    def get_exam_results(self, exam_id):
+        with get_db_connection() as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM exam_results WHERE ExamID = ? ORDER BY StudentLabel", (exam_id,)).fetchall()]
+
+    def save_item_statistics(self, exam_id, items, username):
+        """
+        Madde analizi sonuçlarını (p-değeri, ayırt edicilik, cevap sayısı) sınav bazında item_statistics tablosuna yazar
+        (aynı sınavın yeniden analizi öncekinin yerine geçer) ve soru bankasındaki değerleri tüm sınavlardan yeniden birleştirir.
+        """
+        now = datetime.now()
+        rows = [(exam_id, it['QuestionID'], it['p'], it['r_pb'], it['n'], now) for it in items if it.get('QuestionID')]
+        with get_db_connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO item_statistics (ExamID, QuestionID, P, Discrimination, ResponseCount, AnalyzedAt) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._refresh_item_statistics(conn, [r[1] for r in rows])
+            conn.execute("INSERT INTO audit_logs (Username, Action, Details) VALUES (?, ?, ?)",
+                         (username, 'ITEM_ANALYSIS', f"ExamID: {exam_id}, Items: {len(rows)}"))
+        invalidate_question_caches()
+
+    def _refresh_item_statistics(self, conn, q_ids):
+        """
+        Soruların EmpiricalP / Discrimination değerlerini analiz edilen tüm sınavların cevap sayısıyla ağırlıklı ortalaması,
+        ResponseCount değerini toplam cevap sayısı olarak günceller (küçük bir tekrar sınavı büyük sınavın verisini silmez).
+        """
+        id_sub = stage_id_set(conn, q_ids)
+        conn.execute(f"""
+            UPDATE questions SET
+                EmpiricalP = (SELECT SUM(s.P * s.ResponseCount) / SUM(CASE WHEN s.P IS NOT NULL THEN s.ResponseCount END)
+                              FROM item_statistics s WHERE s.QuestionID = questions.QuestionID),
+                Discrimination = (SELECT SUM(s.Discrimination * s.ResponseCount) / SUM(CASE WHEN s.Discrimination IS NOT NULL THEN s.ResponseCount END)
+                                  FROM item_statistics s WHERE s.QuestionID = questions.QuestionID),
+                ResponseCount = (SELECT SUM(s.ResponseCount) FROM item_statistics s WHERE s.QuestionID = questions.QuestionID),
+                AnalyzedAt = (SELECT MAX(s.AnalyzedAt) FROM item_statistics s WHERE s.QuestionID = questions.QuestionID)
+            WHERE QuestionID IN ({id_sub}) AND QuestionID IN (SELECT QuestionID FROM item_statistics)
+        """)
+
+    def set_exam_bundle_hash(self, exam_id, bundle_hash):
+        """Sınavın çıktı setinin önbellek anahtarını kaydeder; arşivden aynı dosyalar yeniden indirilebilir."""
+        with get_db_connection() as conn:
+            conn.execute("UPDATE created_exams SET BundleHash = ? WHERE ExamID = ?", (bundle_hash, exam_id))
+
+    def set_exam_group_permutations(self, exam_id, group_permutations):
+        """Permütasyon kaydı olmayan sınava sonradan türetilen grup permütasyonlarını kaydeder (mevcut kayıt değiştirilmez)."""
+        with get_db_connection() as conn:
+            conn.execute("UPDATE created_exams SET GroupPermutations = ? WHERE ExamID = ? AND GroupPermutations IS NULL",
+                         (dump_group_permutations(group_permutations), exam_id))
 
     def archive_exam(self, exam_id):
         """Sınavı veritabanında silmeden IsArchived=1 olarak işaretler."""
@@ -1218,7 +3087,8 @@ class DatabaseManager:
                 
             return context_text
 
-db = DatabaseManager()
+if __name__ == "__main__":
+    db = DatabaseManager()
 
 class DBPFetcher:
     def __init__(self, db_manager):
@@ -1375,7 +3245,8 @@ class DBPFetcher:
              
         return contributes
         
-dbp_fetcher = DBPFetcher(db)
+if __name__ == "__main__":
+    dbp_fetcher = DBPFetcher(db)
 
 # ==============================================================================
 # 5. SAYFALAR
@@ -1503,6 +3374,26 @@ def dashboard_page():
     else:
         st.info("Zaman analizi için yeterli veri yok.")
 
+    analyzed = [q for q in all_q_stats if q.get('EmpiricalP') is not None]
+    if analyzed:
+        st.divider()
+        st.subheader("🎯 Ampirik Madde İstatistikleri")
+        df_items = pd.DataFrame(analyzed)
+        e1, e2, e3 = st.columns(3)
+        e1.metric("Analiz Edilen Soru", len(df_items))
+        e2.metric("Ort. p-Değeri", f"{df_items['EmpiricalP'].mean():.2f}")
+        e3.metric("Düşük Ayırt Edicilik (r < 0.2)", int((df_items['Discrimination'].fillna(0) < 0.2).sum()))
+        df_items['Tanımlı Zorluk'] = df_items['Complexity'].astype(str)
+        fig_items = px.scatter(
+            df_items, x='EmpiricalP', y='Discrimination', color='Tanımlı Zorluk', hover_data=['QuestionID', 'TopicArea', 'ResponseCount'],
+            labels={'EmpiricalP': 'p-Değeri (Doğru Oranı)', 'Discrimination': 'Ayırt Edicilik (r_pb)'},
+            title="Ampirik Zorluk ve Ayırt Edicilik"
+        )
+        fig_items.add_vline(x=EMPIRICAL_HARD_P, line_dash="dot")
+        fig_items.add_vline(x=EMPIRICAL_EASY_P, line_dash="dot")
+        fig_items.add_hline(y=0.2, line_dash="dot", line_color="red")
+        st.plotly_chart(fig_items, use_container_width=True)
+
     col_dash_1, col_dash_2 = st.columns(2)
     
     with col_dash_1:
@@ -1928,6 +3819,71 @@ def question_bank_page():
         return
 
     all_courses = db.get_courses(user)
+
+    if user['Role'] == 'Admin':
+        with st.expander("🧬 Mükerrer Soru Taraması (Tüm Banka)", expanded=False):
+            st.caption("Geçmiş Excel yüklemeleri ve AI kayıtlarından kalan yakın-mükerrer soruları arka planda kümeler.")
+            c_dup1, c_dup2, c_dup3 = st.columns([2, 2, 1])
+            scan_scope = c_dup1.selectbox("Kapsam", ["Tüm Veritabanı"] + sorted({q['CourseCode'] for q in all_q}), key="dup_scan_scope")
+            scan_threshold = c_dup2.slider("Benzerlik Eşiği", 0.70, 1.00, 0.85, 0.01, key="dup_scan_threshold")
+            latest_job = db.get_latest_duplicate_job()
+            job_running = latest_job is not None and latest_job['Status'] in ('Queued', 'Running')
+
+            if c_dup3.button("▶️ Taramayı Başlat", disabled=job_running, use_container_width=True):
+                db.start_duplicate_scan(None if scan_scope == "Tüm Veritabanı" else scan_scope, scan_threshold, user['Username'])
+                st.rerun()
+
+            if latest_job:
+                scope_txt = latest_job['CourseCode'] or "Tüm Veritabanı"
+                st.progress(float(latest_job['Progress'] or 0), text=f"İş #{latest_job['JobID']} ({scope_txt}) - {latest_job['Status']} | {latest_job['TotalQuestions']} soru")
+                if job_running:
+                    if st.button("🔄 Durumu Yenile", key="dup_refresh"): st.rerun()
+                elif latest_job['Status'] == 'Failed':
+                    st.error(f"Tarama hatası: {latest_job['Error']}")
+                else:
+                    clusters = db.get_duplicate_clusters(latest_job['JobID'])
+                    st.markdown(f"**{len(clusters)}** birleştirilmemiş küme bulundu.")
+                    for cluster_no, members in list(clusters.items())[:30]:
+                        with st.container(border=True):
+                            st.markdown(f"**Küme {cluster_no}** ({len(members)} soru)")
+                            keep_id = st.radio(
+                                "Korunacak Soru", [m['QuestionID'] for m in members], horizontal=True, key=f"dup_keep_{latest_job['JobID']}_{cluster_no}",
+                                format_func=lambda qid, members=members: next(f"ID {m['QuestionID']} (Kullanım: {m['UsageCount']})" for m in members if m['QuestionID'] == qid)
+                            )
+                            for m in members:
+                                st.caption(f"ID {m['QuestionID']} | {m['CourseCode']} / {m['TopicArea']} | Benzerlik: %{int(m['Similarity'] * 100)} — {m['QuestionText'][:120]}")
+                            if st.button("🔗 Kümeyi Birleştir", key=f"dup_merge_{latest_job['JobID']}_{cluster_no}"):
+                                if db.merge_questions(keep_id, [m['QuestionID'] for m in members], user['Username']):
+                                    st.toast(f"Küme {cluster_no} birleştirildi.", icon="🔗")
+                                    time.sleep(1)
+                                    st.rerun()
+
+        with st.expander("📐 IRT Kalibrasyonu (Tüm Banka)", expanded=False):
+            st.caption("Değerlendirilmiş tüm sınav sonuçlarıyla soruların IRT parametrelerini (a: ayırt edicilik, b: güçlük) arka planda kestirir. "
+                       "Artımlı modda yalnızca yeni cevap gelen sorular yeniden kestirilir; diğerleri sabit tutularak ölçek korunur.")
+            c_irt1, c_irt2, c_irt3 = st.columns([2, 2, 1])
+            irt_model = c_irt1.selectbox("Model", ["2PL", "1PL"], key="irt_model", help="1PL (Rasch) yalnızca güçlük, 2PL ayrıca ayırt edicilik kestirir.")
+            irt_full = c_irt2.checkbox("Tüm soruları baştan kalibre et", key="irt_full_refit")
+            latest_irt = db.get_latest_irt_job()
+            irt_running = latest_irt is not None and latest_irt['Status'] in ('Queued', 'Running')
+
+            if c_irt3.button("▶️ Kalibrasyonu Başlat", disabled=irt_running, use_container_width=True, key="btn_irt_start"):
+                db.start_irt_calibration(irt_model, irt_full, user['Username'])
+                st.rerun()
+
+            if latest_irt:
+                st.progress(float(latest_irt['Progress'] or 0),
+                            text=f"İş #{latest_irt['JobID']} ({latest_irt['Model']}{', tam' if latest_irt['FullRefit'] else ', artımlı'}) - {latest_irt['Status']} | "
+                                 f"{latest_irt['ResponseCount']} cevap, {latest_irt['ItemCount']} soru")
+                if irt_running:
+                    if st.button("🔄 Durumu Yenile", key="irt_refresh"): st.rerun()
+                elif latest_irt['Status'] == 'Failed':
+                    st.error(f"Kalibrasyon hatası: {latest_irt['Error']}")
+                else:
+                    if st.session_state.get('irt_seen_job') != latest_irt['JobID']:
+                        st.session_state['irt_seen_job'] = latest_irt['JobID']
+                        invalidate_question_caches()
+                    st.success(f"✅ {latest_irt['RefitCount']} soru yeniden kalibre edildi ({latest_irt['Iterations']} iterasyon).")
     
     df_questions = pd.DataFrame(all_q)
     df_courses = pd.DataFrame(all_courses)
@@ -2061,11 +4017,12 @@ def question_bank_page():
                         with st.expander("🧠 AI Pedagojik Analiz (Bloom)", expanded=False):
                             st.info("Bu özellik, seçili sorunun Bloom Taksonomisi'ne göre seviyesini ölçer ve geliştirme önerisi sunar.")
                             
+                            bloom_fresh = st.checkbox("♻️ Önbelleği atla (yeniden analiz et)", key=f"bloom_fresh_{q_id}")
                             if st.button("Soruyu Analiz Et", key=f"analyze_bloom_{q_id}"):
                                 with st.spinner("Gemini soruyu pedagojik olarak inceliyor..."):
                                     text_to_analyze = full_data['QuestionText'] 
                                     
-                                    analysis_result = AIGenerator.analyze_question_bloom(text_to_analyze)
+                                    analysis_result = AIGenerator.analyze_question_bloom(text_to_analyze, use_cache=not bloom_fresh)
                                     
                                     if isinstance(analysis_result, dict) and "bloom_level" in analysis_result:
                                         st.markdown(f"### 📊 Sonuç: {analysis_result['bloom_level']}")
@@ -2076,6 +4033,32 @@ def question_bank_page():
                                     else:
                                         st.error("AI'dan beklenen formatta yanıt alınamadı.")
 
+                        with st.expander("🕘 Revizyon Geçmişi", expanded=False):
+                            revisions = db.get_question_revisions(q_id)
+                            if not revisions:
+                                st.info("Bu soru için henüz revizyon kaydı yok. İlk düzenlemede mevcut hâli kaydedilecektir.")
+                            else:
+                                df_rev = pd.DataFrame(revisions)
+                                df_rev['IsSnapshot'] = df_rev['IsSnapshot'].map({1: "Tam Kopya", 0: "Fark (Delta)"})
+                                df_rev.rename(columns={'RevisionNo': 'Revizyon', 'IsSnapshot': 'Kayıt Türü', 'EditedBy': 'Düzenleyen', 'EditedAt': 'Tarih', 'PayloadSize': 'Boyut (B)'}, inplace=True)
+                                st.dataframe(df_rev.drop(columns=['RevisionID']), use_container_width=True, hide_index=True)
+
+                                rev_options = {f"Revizyon {r['RevisionNo']} ({r['EditedBy']})": r['RevisionID'] for r in revisions}
+                                sel_rev_label = st.selectbox("İncelenecek Revizyon", list(rev_options.keys()), key=f"rev_select_{q_id}")
+                                rev_content = db.get_revision_content(rev_options[sel_rev_label])
+                                if rev_content:
+                                    st.markdown(f"**Soru:** {rev_content['QuestionText']}")
+                                    st.caption(f"Konu: {rev_content['TopicArea']} | Zorluk: {rev_content['Complexity']} | Puan: {rev_content['Score']} | Cevap: {rev_content['CorrectAnswer']}")
+                                    if rev_content['Options']:
+                                        st.json(json.loads(rev_content['Options']))
+
+                                    if rev_options[sel_rev_label] != revisions[0]['RevisionID']:
+                                        if st.button("↩️ Bu Revizyona Geri Dön", key=f"revert_{q_id}"):
+                                            if db.revert_question(q_id, rev_options[sel_rev_label], user['Username']):
+                                                st.toast("Soru seçilen revizyona geri döndürüldü.", icon="↩️")
+                                                time.sleep(1)
+                                                st.rerun()
+
         elif len(selected_rows) > 1:
             with col_act2:
                 st.info("Tek bir soruyu düzenlemek için lütfen sadece bir satır seçin.")
@@ -2131,10 +4114,13 @@ def add_question_page():
             
             if submitted:
                 if qc and qtext:
-                    existing_qs = db.get_questions(st.session_state['user'], course_code=qc)
-                    similars = check_similarity(qtext, existing_qs)
+                    exact_dup_id = db.find_duplicate_question(qc, {'QuestionType': qtype, 'QuestionText': qtext, 'Options': opts, 'CorrectAnswer': qans})
+                    similars = [] if exact_dup_id else check_similarity(qtext, db.get_questions(st.session_state['user'], course_code=qc))
                     
-                    if similars and not st.session_state.get('force_add_confirm', False):
+                    if exact_dup_id:
+                        st.error(f"⛔ Bu soru bankada birebir mevcut (ID: {exact_dup_id}). Büyük/küçük harf ve boşluk farkları dikkate alınmaz.")
+
+                    elif similars and not st.session_state.get('force_add_confirm', False):
                         st.warning("⚠️ Bu soruya çok benzeyen kayıtlar bulundu:")
                         for s in similars:
                             st.write(f"- (ID: {s['ID']}, Benzerlik: %{s['Ratio']}) {s['Text'][:60]}...")
@@ -2169,8 +4155,9 @@ def add_question_page():
                 df_up = pd.read_excel(up_file)
                 df_up = df_up.fillna('')
                 success_count = 0
+                duplicate_count = 0
                 for index, row in df_up.iterrows():
-                     if db.add_question({
+                     new_q = {
                         'CourseCode': str(row.get('CourseCode')),
                         'TopicArea': str(row.get('TopicArea', 'Genel')),
                         'Complexity': int(row.get('Complexity', 2)), 
@@ -2180,9 +4167,15 @@ def add_question_page():
                         'Options': {},
                         'CorrectAnswer': str(row.get('CorrectAnswer', '')),
                         'CreatedBy': st.session_state['user']['Username']
-                    }):
+                     }
+                     if db.find_duplicate_question(new_q['CourseCode'], new_q):
+                        duplicate_count += 1
+                        continue
+                     if db.add_question(new_q):
                         success_count += 1
                 st.success(f"{success_count} soru eklendi.")
+                if duplicate_count:
+                    st.warning(f"{duplicate_count} satır bankada birebir mevcut olduğu için atlandı.")
             except Exception as e:
                 st.error(f"Hata: {e}")
 
@@ -2196,12 +4189,14 @@ def add_question_page():
 
         c_ai1, c_ai2, c_ai3, c_ai4 = st.columns([1, 1, 1, 1])
         
-        ai_provider = c_ai1.radio("AI Sağlayıcı", ["Google Gemini"], horizontal=True) 
-        provider_code = "google"
+        # Çevrimdışı test sağlayıcısı sahte sorular üretir; yalnızca yöneticilere (test/ölçüm için) gösterilir
+        provider_choices = ["Google Gemini"] + (["Yerel Test (Çevrimdışı)"] if st.session_state['user']['Role'] == 'Admin' else [])
+        ai_provider = c_ai1.radio("AI Sağlayıcı", provider_choices, horizontal=True) 
+        provider_code = "stub" if ai_provider.startswith("Yerel") else "google"
         
         target_course_code = c_ai2.selectbox("Hedef Ders", course_codes, key="ai_target_course")
         
-        num_q = c_ai3.slider("Soru Sayısı", 1, 10, 3)
+        num_q = c_ai3.slider("Soru Sayısı", 1, 100, 3, help=f"{AIGenerator.CHUNK_SIZE} sorudan fazlası konulara bölünmüş parçalar halinde eşzamanlı üretilir.")
         ai_model = c_ai4.selectbox("Model", ["gemini-2.5-flash", "gemini-2.5-pro"], key="ai_model_select").split(" ")[0]
 
         st.write("---")
@@ -2233,6 +4228,14 @@ def add_question_page():
             if pasted_text:
                 user_uploaded_text += "\n" + pasted_text
         
+        c_ai_btn, c_ai_cache = st.columns([1, 2])
+        ai_regenerate = c_ai_btn.checkbox("♻️ Yeniden üret (önbelleği atla)", key="ai_regenerate",
+                                          help="Aynı içerik, model ve soru sayısı için önceki AI cevabı önbellekten gelir; işaretlenirse yeni istek gönderilir.")
+        ai_cache_stats = get_ai_response_cache().stats()
+        c_ai_cache.caption(f"🗄️ AI önbelleği: {ai_cache_stats['entries']} kayıt ({ai_cache_stats['bytes'] / 1024:.0f} KB) | "
+                           f"isabet oranı %{ai_cache_stats['hit_rate'] * 100:.0f} ({ai_cache_stats['hits']} isabet, {ai_cache_stats['misses']} ıskalama, "
+                           f"{ai_cache_stats['bypassed']} atlama)")
+
         if st.button("🚀 Soruları Oluştur", type="primary"):
             final_prompt_text = ""
             
@@ -2247,11 +4250,44 @@ def add_question_page():
             elif len(final_prompt_text) < 20: # En azından biraz metin olmalı
                 st.warning("⚠️ Soru üretmek için yeterli içerik yok. Lütfen 'DBP Kullan'ı seçin veya bir dosya yükleyin.")
             else:
-                with st.spinner(f"{ai_provider} müfredatı ve notları analiz ediyor..."):
-                    qs = AIGenerator.generate_from_text(final_prompt_text, num_q, provider_code, ai_model, target_course=target_course_code)
-                    if qs:
-                        st.session_state['ai_questions'] = qs
-                        st.success(f"✅ {len(qs)} adet soru oluşturuldu.")
+                st.session_state.pop('ai_coverage', None)
+                long_source = AIGenerator.estimate_tokens(final_prompt_text) > AI_CHUNK_TOKENS
+                if num_q <= AIGenerator.CHUNK_SIZE and not long_source:
+                    with st.spinner(f"{ai_provider} müfredatı ve notları analiz ediyor..."):
+                        qs = AIGenerator.generate_from_text(final_prompt_text, num_q, provider_code, ai_model, target_course=target_course_code,
+                                                            use_cache=not ai_regenerate)
+                else:
+                    gen_progress = st.progress(0.0, text=f"{ai_provider} soruları parçalar halinde üretiyor...")
+                    gen_live = st.empty()
+                    live_titles = []
+
+                    def show_chunk(fresh, done, total):
+                        live_titles.extend(q['QuestionText'][:90] for q in fresh)
+                        gen_progress.progress(done / total, text=f"{done}/{total} parça tamamlandı | {len(live_titles)} soru")
+                        gen_live.dataframe(pd.DataFrame({"Soru": live_titles}), hide_index=True, use_container_width=True, height=240)
+
+                    if long_source:
+                        qs, gen_errors, coverage = AIGenerator.generate_map_reduce(final_prompt_text, num_q, provider_code, ai_model,
+                                                                                   target_course=target_course_code, on_chunk=show_chunk, use_cache=not ai_regenerate)
+                        st.session_state['ai_coverage'] = coverage
+                    else:
+                        qs, gen_errors = AIGenerator.generate_concurrent(final_prompt_text, num_q, provider_code, ai_model,
+                                                                         target_course=target_course_code, on_chunk=show_chunk, use_cache=not ai_regenerate)
+                    for err in gen_errors:
+                        st.error(f"AI İşlem Hatası: {err}")
+                    if qs and len(qs) < num_q:
+                        st.warning(f"⚠️ {num_q} soru istendi; tekrar eden veya başarısız parçalar nedeniyle {len(qs)} benzersiz soru üretildi.")
+                if qs:
+                    st.session_state['ai_questions'] = qs
+                    st.success(f"✅ {len(qs)} adet soru oluşturuldu.")
+
+        if st.session_state.get('ai_coverage'):
+            with st.expander("🗺️ Kaynak Kapsamı (Bölüm Başına Üretilen Sorular)", expanded=True):
+                df_coverage = pd.DataFrame(st.session_state['ai_coverage'])
+                covered = int((df_coverage['Seçilen'] > 0).sum())
+                st.caption(f"Kaynak {len(df_coverage)} parçaya bölündü; {covered} parçadan soru seçildi. "
+                           f"Kotalar parçaların tahmini token payına göre dağıtılır.")
+                st.dataframe(df_coverage, hide_index=True, use_container_width=True)
 
         if 'ai_questions' in st.session_state and st.session_state['ai_questions']:
             st.divider()
@@ -2269,6 +4305,11 @@ def add_question_page():
                         st.info(f"Cevap: {q.get('CorrectAnswer')}")
                         st.caption(f"Zorluk: {q.get('Complexity')} | Puan: {q.get('Score')}")
                         st.caption(f"Ders Kodu: {q.get('CourseCode')} | Konu: {q.get('TopicArea')}")
+                        if q.get('SourceSection'):
+                            st.caption(f"Kaynak Bölüm: {q['SourceSection']}")
+                        ai_dup_id = db.find_duplicate_question(q.get('CourseCode'), q)
+                        if ai_dup_id:
+                            st.warning(f"Bankada birebir mevcut (ID: {ai_dup_id})")
                     
                     save_q = q.copy()
                     save_q['Score'] = float(save_q.get('Score', 10))
@@ -2278,49 +4319,981 @@ def add_question_page():
                         if db.add_question(save_q):
                            st.toast(f"Soru {idx+1} eklendi!", icon="✅")
 
-def shuffle_question_options(questions_list):
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_selection_index(username, role, course_code, topics=(), empirical=False):
     """
-    Çoktan Seçmeli soruların şıklarını ve doğru cevap anahtarını tamamen karıştırır.
-    (Anahtarlar ve metinler birlikte karışır)
+    Rastgele seçim için ders havuzunu (QuestionType, Complexity, TopicArea) kovalarına ayırır.
+    Konu filtresi verilirse filtresiz indeksten türetilir; soru yazma işlemlerinde invalidate_question_caches() ile temizlenir.
+    empirical=True ise yeterli cevabı olan sorularda zorluk, madde analizindeki p-değerinden türetilir.
     """
-    shuffled_questions = []
-    
-    standard_keys = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'] 
-    
-    for q_orig in questions_list:
-        q = q_orig.copy() 
-        
-        if q['QuestionType'] == 'MC':
-            raw_opts = q.get('Options')
-            opts = raw_opts if isinstance(raw_opts, dict) else (json.loads(raw_opts) if isinstance(raw_opts, str) else {})
-            
-            valid_opts = {k: v for k, v in opts.items() if v and str(v).strip()}
-            
-            if valid_opts and len(valid_opts) > 1:
-                old_correct_key = q.get('CorrectAnswer', '').strip().upper()
-                correct_text = valid_opts.get(old_correct_key)
-                
-                if correct_text:
-                    values = list(valid_opts.values())
-                    random.shuffle(values)
-                    
-                    used_key_count = len(values)
-                    new_keys = standard_keys[:used_key_count]
-                    
-                    new_opts = dict(zip(new_keys, values))
-                    
-                    new_correct_key = None
-                    for k, v in new_opts.items():
-                        if v == correct_text:
-                            new_correct_key = k
-                            break
-                    
-                    q['Options'] = new_opts
-                    q['CorrectAnswer'] = new_correct_key if new_correct_key else old_correct_key
-                    
-        shuffled_questions.append(q)
-    
-    return shuffled_questions
+    if topics:
+        base = get_selection_index(username, role, course_code, (), empirical)
+        buckets = {key: ids for key, ids in base['buckets'].items() if key[2] in topics}
+        all_topics, scores, usage, last_used, irt_p = base['topics'], base['scores'], base['usage'], base['last_used'], base['irt_p']
+    else:
+        buckets, scores, usage, last_used, irt_p = {}, {}, {}, {}, {}
+        for row in db.get_selection_rows({'Username': username, 'Role': role}, course_code):
+            complexity = row['Complexity']
+            if empirical and row['EmpiricalP'] is not None and (row['ResponseCount'] or 0) >= ITEM_ANALYSIS_MIN_RESPONSES:
+                complexity = empirical_complexity(row['EmpiricalP'])
+            buckets.setdefault((row['QuestionType'], complexity, row['TopicArea']), []).append(row['QuestionID'])
+            scores[row['QuestionID']] = float(row['Score'])
+            usage[row['QuestionID']] = int(row['UsageCount'] or 0)
+            if row['IrtB'] is not None:
+                irt_p[row['QuestionID']] = irt_probability(row['IrtA'] or 1.0, row['IrtB'])
+            try: last_used[row['QuestionID']] = datetime.fromisoformat(str(row['LastUsedAt'])).timestamp() if row['LastUsedAt'] else np.nan
+            except ValueError: last_used[row['QuestionID']] = np.nan
+        all_topics = sorted({key[2] for key in buckets})
+
+    pools = {f"{qt}_{cx}": [] for qt in ("MC", "TF", "CL") for cx in (1, 2, 3)}
+    for (qt, cx, _), ids in buckets.items():
+        pools.setdefault(f"{qt}_{cx}", []).extend(ids)
+
+    # Ağırlıklı örnekleme için kova başına hazır NumPy dizileri
+    arrays = {
+        key: {
+            'ids': np.array(ids, dtype=np.int64),
+            'usage': np.array([usage[i] for i in ids], dtype=np.float64),
+            'last_used': np.array([last_used[i] for i in ids], dtype=np.float64),
+        }
+        for key, ids in pools.items()
+    }
+
+    return {
+        'topics': all_topics,
+        'buckets': buckets,
+        'pools': pools,
+        'counts': {key: len(ids) for key, ids in pools.items()},
+        'total': sum(len(ids) for ids in buckets.values()),
+        'scores': scores,
+        'usage': usage,
+        'last_used': last_used,
+        'irt_p': irt_p,
+        'arrays': arrays,
+    }
+
+def irt_probability(a, b, theta=0.0):
+    """2PL modelinde `theta` yeteneğindeki öğrencinin soruyu doğru cevaplama olasılığı (1PL için a=1)."""
+    return float(1.0 / (1.0 + np.exp(-a * (theta - b))))
+
+def irt_balance_values(index, default=0.5):
+    """Paralel form dengelemesi için soru başına ortalama yetenekteki (theta=0) beklenen doğru olasılığı; kalibre edilmemiş sorular `default` alır."""
+    return {qid: index['irt_p'].get(qid, default) for qid in index['scores']}
+
+def empirical_complexity(p_value):
+    """Madde analizindeki p-değerini (doğru cevaplama oranı) 1-3 zorluk seviyesine çevirir."""
+    if p_value >= EMPIRICAL_EASY_P: return 1
+    if p_value >= EMPIRICAL_HARD_P: return 2
+    return 3
+
+def item_analysis(questions, responses, group_fraction=0.27):
+    """
+    Öğrenci x madde matrisi üzerinde vektörel madde analizi (yanıtlar orijinal soru sırasında, exam_results.Responses).
+    Madde başına p-değeri, düzeltilmiş nokta çift serili korelasyon (madde - kalan puan), üst/alt %27 ayırt edicilik indeksi;
+    ÇS şıkları için çeldirici analizi ve testin KR-20 güvenirliği hesaplanır. Klasik sorular analiz dışıdır.
+    """
+    start = time.perf_counter()
+    n = len(questions)
+    R = np.frombuffer(''.join(str(r).ljust(n)[:n] for r in responses).encode('ascii', 'replace'), dtype=np.uint8).reshape(-1, n)
+    key, _ = exam_answer_key(questions)
+    cols = np.flatnonzero(key > 0)
+    m, k = R.shape[0], len(cols)
+    if m < 2 or k == 0:
+        return {'items': [], 'distractors': [], 'kr20': None, 'students': m, 'elapsed_ms': 0.0}
+
+    X = (R[:, cols] == key[cols]).astype(np.float64)
+    total = X.sum(axis=1)
+    p = X.mean(axis=0)
+
+    rest = total[:, None] - X
+    xc, rc = X - p, rest - rest.mean(axis=0)
+    denom = np.sqrt((xc ** 2).sum(axis=0) * (rc ** 2).sum(axis=0))
+    r_pb = np.divide((xc * rc).sum(axis=0), denom, out=np.full(k, np.nan), where=denom > 0)
+
+    ranked = np.argsort(total, kind='stable')
+    n_group = max(1, int(round(m * group_fraction)))
+    lower, upper = ranked[:n_group], ranked[-n_group:]
+    d_index = X[upper].mean(axis=0) - X[lower].mean(axis=0)
+
+    var_total = total.var()
+    kr20 = float(k / (k - 1) * (1 - (p * (1 - p)).sum() / var_total)) if k > 1 and var_total > 0 else None
+
+    items = []
+    for j, col in enumerate(cols):
+        q = questions[col]
+        items.append({'Sıra': int(col) + 1, 'QuestionID': q.QuestionID, 'Tür': q.QuestionType, 'Zorluk': q.Complexity,
+                      'p': round(float(p[j]), 4), 'r_pb': None if np.isnan(r_pb[j]) else round(float(r_pb[j]), 4),
+                      'D': round(float(d_index[j]), 4), 'n': m})
+
+    # Çeldirici analizi: her harf için seçilme oranı tüm sütunlarda tek seferde hesaplanır
+    mc_cols = [c for c in cols if questions[c].QuestionType == 'MC']
+    distractors = []
+    if mc_cols:
+        R_mc = R[:, mc_cols]
+        for code in [ord(c) for c in STANDARD_OPTION_KEYS] + [BLANK_RESPONSE]:
+            chosen = R_mc == code
+            share, share_up, share_low = chosen.mean(axis=0), chosen[upper].mean(axis=0), chosen[lower].mean(axis=0)
+            for j, col in enumerate(mc_cols):
+                q = questions[col]
+                letter = chr(code)
+                if code != BLANK_RESPONSE and letter not in [k_.upper() for k_ in q.filled_option_keys()]: continue
+                distractors.append({'Sıra': int(col) + 1, 'QuestionID': q.QuestionID,
+                                    'Şık': 'Boş' if code == BLANK_RESPONSE else letter, 'Doğru': bool(code == key[col]),
+                                    'Seçilme %': round(100 * float(share[j]), 1), 'Üst Grup %': round(100 * float(share_up[j]), 1),
+                                    'Alt Grup %': round(100 * float(share_low[j]), 1)})
+        distractors.sort(key=lambda d: (d['Sıra'], d['Şık'] == 'Boş', d['Şık']))
+
+    return {'items': items, 'distractors': distractors, 'kr20': kr20, 'students': m,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+def exposure_weights(usage, last_used, usage_half_life=2.0, recency_days=30.0, now=None):
+    """
+    Maruziyet kontrolü ağırlıkları: her kullanımda ağırlık yarı ömre göre azalır,
+    son kullanımdan bu yana geçen gün arttıkça toparlanır. Hiç kullanılmamış sorular tam ağırlık alır.
+    """
+    now = time.time() if now is None else now
+    usage_factor = np.exp(-np.log(2) * usage / usage_half_life)
+    age_days = np.where(np.isnan(last_used), np.inf, (now - np.nan_to_num(last_used)) / 86400.0)
+    recency_factor = 1.0 - np.exp(-np.maximum(age_days, 0.0) / recency_days)
+    return np.maximum(usage_factor * recency_factor, 1e-6)
+
+def weighted_sample_ids(ids, weights, k, rng=None):
+    """Ağırlıklı, yerine koymadan örnekleme (Efraimidis-Spirakis anahtarları + argpartition, tamamen vektörel)."""
+    rng = rng or np.random.default_rng()
+    if k >= len(ids): return [int(i) for i in rng.permutation(ids)]
+    keys = np.log(rng.random(len(ids))) / weights
+    top = np.argpartition(-keys, k - 1)[:k]
+    return [int(i) for i in ids[top[np.argsort(-keys[top])]]]
+
+def exposure_priority(index, rng=None):
+    """Blueprint çözücüsü için her soruya maruziyet ağırlıklı rastgele öncelik anahtarı üretir."""
+    rng = rng or np.random.default_rng()
+    priority = {}
+    for arr in index['arrays'].values():
+        if len(arr['ids']) == 0: continue
+        keys = np.log(rng.random(len(arr['ids']))) / exposure_weights(arr['usage'], arr['last_used'])
+        priority.update(zip(arr['ids'].tolist(), keys.tolist()))
+    return priority
+
+def assemble_exam_from_blueprint(index, blueprint, seed=None):
+    """
+    Blueprint'e (tip/zorluk adetleri, konu kapsamı, hedef puan, kullanım sınırı, hariç tutulan sorular,
+    opsiyonel maruziyet önceliği) uyan bir soru seçimini açgözlü (greedy) yerleştirme + takas ile onarım yöntemiyle üretir.
+    Dönüş: {'ok', 'ids', 'issues', 'score', 'topic_counts', 'elapsed_ms'}
+    """
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    counts = {k: v for k, v in blueprint.get('counts', {}).items() if v > 0}
+    topic_min = {t: k for t, k in blueprint.get('topic_min', {}).items() if k > 0}
+    target = blueprint.get('target_score')
+    tolerance = blueprint.get('score_tolerance', 0.01)
+    max_usage = blueprint.get('max_usage')
+    excluded = set(blueprint.get('exclude_ids', ()))
+    priority = blueprint.get('priority')
+    scores, usage = index['scores'], index['usage']
+
+    # Uygun adaylar: hücre (tip_zorluk) -> konu -> [id]
+    eligible = {}
+    for (qt, cx, topic), ids in index['buckets'].items():
+        cell = f"{qt}_{cx}"
+        if cell not in counts: continue
+        ok_ids = [i for i in ids if i not in excluded and (max_usage is None or usage[i] <= max_usage)]
+        if ok_ids:
+            rng.shuffle(ok_ids)
+            if priority:
+                ok_ids.sort(key=priority.get)  # pop() en yüksek öncelikli soruyu alır
+            eligible.setdefault(cell, {})[topic] = ok_ids
+
+    def result(ok, ids, issues):
+        return {
+            'ok': ok, 'ids': ids, 'issues': issues,
+            'score': round(sum(scores[i] for i in ids), 2),
+            'topic_counts': {t: sum(1 for i in ids if topic_of[i] == t) for t in {topic_of[i] for i in ids}},
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    topic_of = {i: topic for cell in eligible.values() for topic, ids in cell.items() for i in ids}
+
+    # 1. Olurluk (feasibility) kontrolleri
+    issues = []
+    for cell, need in counts.items():
+        available = sum(len(ids) for ids in eligible.get(cell, {}).values())
+        if available < need:
+            issues.append(f"{cell}: {need} soru isteniyor, kısıtlara uyan {available} soru var.")
+    for topic, need in topic_min.items():
+        reachable = sum(min(counts[cell], len(eligible.get(cell, {}).get(topic, []))) for cell in counts)
+        if reachable < need:
+            issues.append(f"'{topic}' konusu için en az {need} soru isteniyor, seçilen tip/zorluk hücrelerinde en fazla {reachable} yerleştirilebilir.")
+    if sum(topic_min.values()) > sum(counts.values()):
+        issues.append(f"Konu alt sınırlarının toplamı ({sum(topic_min.values())}) toplam soru sayısını ({sum(counts.values())}) aşıyor.")
+    if target is not None and not issues:
+        low = high = 0.0
+        for cell, need in counts.items():
+            cell_scores = sorted(scores[i] for ids in eligible[cell].values() for i in ids)
+            low += sum(cell_scores[:need])
+            high += sum(cell_scores[-need:])
+        if target < low - tolerance or target > high + tolerance:
+            issues.append(f"Hedef puan {target} ulaşılamaz: seçilebilecek soruların puan toplamı {low:.2f} - {high:.2f} aralığında.")
+    if issues:
+        return result(False, [], issues)
+
+    # 2. Açgözlü yerleştirme: önce kıt konuların alt sınırları, sonra hücrelerin kalan kapasitesi
+    remaining = dict(counts)
+    chosen = {cell: [] for cell in counts}
+    used = set()
+
+    def take(cell, topic):
+        pool = eligible[cell][topic]
+        while pool:
+            q = pool.pop()
+            if q not in used:
+                used.add(q)
+                chosen[cell].append(q)
+                remaining[cell] -= 1
+                return True
+        return False
+
+    for topic, need in sorted(topic_min.items(), key=lambda kv: sum(len(eligible.get(c, {}).get(kv[0], [])) for c in counts)):
+        for _ in range(need):
+            cells = [c for c in counts if remaining[c] > 0 and eligible.get(c, {}).get(topic)]
+            if not cells or not take(max(cells, key=lambda c: remaining[c]), topic):
+                break
+    for cell in counts:
+        topics = list(eligible[cell])
+        while remaining[cell] > 0 and topics:
+            if priority:
+                topic = max(topics, key=lambda t: priority[eligible[cell][t][-1]] if eligible[cell][t] else -np.inf)
+            else:
+                topic = rng.choice(topics)
+            if not take(cell, topic):
+                topics.remove(topic)
+
+    def topic_count(t):
+        return sum(1 for ids in chosen.values() for i in ids if topic_of[i] == t)
+
+    # 3. Onarım: eksik kalan konu kapsamı için fazlası olan konudan takas
+    for topic, need in topic_min.items():
+        for cell in counts:
+            while topic_count(topic) < need and eligible[cell].get(topic):
+                surplus = [i for i in chosen[cell] if topic_count(topic_of[i]) > topic_min.get(topic_of[i], 0)]
+                if not surplus: break
+                out = surplus[0]
+                chosen[cell].remove(out)
+                used.discard(out)
+                remaining[cell] += 1
+                if not take(cell, topic):
+                    chosen[cell].append(out); used.add(out); remaining[cell] -= 1
+                    break
+
+    # 4. Onarım: hedef puana yaklaşmak için hücre içi takas (sıralı aday listelerinde ikili arama).
+    #    Konu alt sınırı bozulmayacaksa başka konudan aday alınabilir; tek takas yetmezse iki takas denenir.
+    if target is not None:
+        spare = {(cell, topic): sorted((scores[i], i) for i in pool if i not in used)
+                 for cell, topics in eligible.items() for topic, pool in topics.items()}
+
+        def candidate_pools(cell, q, tcount):
+            if tcount[topic_of[q]] > topic_min.get(topic_of[q], 0):
+                return [(cell, t) for t in eligible[cell]]
+            return [(cell, topic_of[q])]
+
+        def nearest_moves(ideal, tcount, width):
+            """Her seçili soru için ideal puana en yakın adayları (delta, hücre, sıra, havuz, puan) olarak listeler."""
+            moves = []
+            for cell, ids in chosen.items():
+                for pos, q in enumerate(ids):
+                    for key in candidate_pools(cell, q, tcount):
+                        options = spare[key]
+                        at = bisect.bisect_left(options, (ideal(q), -1))
+                        for value in {options[k][0] for k in range(max(0, at - width), min(len(options), at + width))}:
+                            moves.append((value - scores[q], cell, pos, key, value))
+            return moves
+
+        def apply_swap(cell, pos, key, value):
+            out = chosen[cell][pos]
+            options = spare[key]
+            _, cand = options.pop(bisect.bisect_left(options, (value, -1)))
+            bisect.insort(spare[(cell, topic_of[out])], (scores[out], out))
+            chosen[cell][pos] = cand
+
+        for _ in range(4 * sum(counts.values())):
+            diff = sum(scores[i] for ids in chosen.values() for i in ids) - target
+            if abs(diff) <= tolerance: break
+            tcount = {t: topic_count(t) for t in topic_min}
+            tcount.update({topic_of[i]: topic_count(topic_of[i]) for ids in chosen.values() for i in ids})
+
+            moves = nearest_moves(lambda q: scores[q] - diff, tcount, 1)
+            best = min(moves, key=lambda m: abs(diff + m[0]), default=None)
+            if best is not None and abs(diff + best[0]) < abs(diff) - 1e-9:
+                apply_swap(*best[1:])
+                continue
+
+            # İki takas: d1 + d2 ≈ -diff (aynı konumu iki kez kullanmadan)
+            moves = sorted(nearest_moves(lambda q: scores[q] - diff / 2, tcount, 8))
+            deltas = [m[0] for m in moves]
+            pair = None
+            for m1 in moves:
+                at = bisect.bisect_left(deltas, -diff - m1[0] - tolerance)
+                while at < len(moves) and deltas[at] <= -diff - m1[0] + tolerance:
+                    m2 = moves[at]
+                    at += 1
+                    if (m1[1], m1[2]) == (m2[1], m2[2]): continue
+                    if m1[3] == m2[3] and m1[4] == m2[4] and sum(1 for v, _ in spare[m1[3]] if v == m1[4]) < 2: continue
+                    if topic_min and m1[3] != m2[3]:
+                        # Çapraz konu takaslarında iki hamlenin birlikte alt sınırı bozmadığını doğrula
+                        after = dict(tcount)
+                        for m in (m1, m2):
+                            after[topic_of[chosen[m[1]][m[2]]]] -= 1
+                            after[m[3][1]] = after.get(m[3][1], 0) + 1
+                        if any(after.get(t, 0) < k for t, k in topic_min.items()): continue
+                    pair = (m1, m2)
+                    break
+                if pair: break
+            if not pair: break
+            for m in pair:
+                apply_swap(*m[1:])
+
+    ids = [i for cell_ids in chosen.values() for i in cell_ids]
+    rng.shuffle(ids)
+    final_issues = []
+    for topic, need in topic_min.items():
+        if topic_count(topic) < need:
+            final_issues.append(f"'{topic}' konusu kapsamı sağlanamadı ({topic_count(topic)}/{need}); hücre ve konu kısıtları birlikte karşılanamıyor.")
+    total = sum(scores[i] for i in ids)
+    if target is not None and abs(total - target) > tolerance:
+        final_issues.append(f"Hedef puana tam ulaşılamadı: {total:.2f} (hedef {target} ± {tolerance}).")
+    return result(not final_issues, ids, final_issues)
+
+def assemble_parallel_forms(index, counts, n_forms, seed=None, priority=None, exclude_ids=(), max_usage=None, balance=None):
+    """
+    Aynı (tip, zorluk, konu) profiline sahip n_forms adet paralel form üretir.
+    Form 1'in konu dağılımı havuz kapasitesine göre belirlenir ve tüm formlara uygulanır; her kovadan alınan sorular
+    puana (veya `balance` değerine) göre sıralanıp turlar halinde en düşük toplamlı forma dağıtılır.
+    Havuz yetmediğinde sorular döngüsel olarak paylaştırılır, böylece çakışma eşit yayılır.
+    Dönüş: {'ok', 'forms', 'issues', 'profile', 'overlap', 'balance_totals', 'elapsed_ms'}
+    """
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    excluded = set(exclude_ids)
+    usage = index['usage']
+    balance = balance or index['scores']
+    counts = {cell: int(n) for cell, n in counts.items() if n > 0}
+
+    eligible = {}
+    for (qt, cx, topic), ids in index['buckets'].items():
+        cell = f"{qt}_{cx}"
+        if cell not in counts: continue
+        ok_ids = [i for i in ids if i not in excluded and (max_usage is None or usage[i] <= max_usage)]
+        if ok_ids:
+            eligible.setdefault(cell, {})[topic] = ok_ids
+
+    issues = []
+    for cell, need in counts.items():
+        available = sum(len(ids) for ids in eligible.get(cell, {}).values())
+        if available < need:
+            issues.append(f"{cell}: bir form için {need} soru gerekiyor, kısıtlara uyan {available} soru var.")
+    if issues:
+        return {'ok': False, 'forms': [], 'issues': issues, 'profile': {}, 'overlap': 0, 'balance_totals': [],
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    # 1. Ortak profil: çakışmasız kapasitesi en yüksek konudan başlayarak hücre adetlerini konulara böl
+    profile = {}
+    for cell, need in counts.items():
+        avail = {t: len(ids) for t, ids in eligible[cell].items()}
+        topics = list(avail)
+        rng.shuffle(topics)
+        alloc = dict.fromkeys(topics, 0)
+        for _ in range(need):
+            free = [t for t in topics if avail[t] >= (alloc[t] + 1) * n_forms]
+            if free:
+                topic = max(free, key=lambda t: avail[t] - alloc[t] * n_forms)
+            else:
+                topic = max((t for t in topics if avail[t] > alloc[t]), key=lambda t: avail[t] / (alloc[t] + 1))
+            alloc[topic] += 1
+        for topic, k in alloc.items():
+            if k: profile[(cell, topic)] = k
+
+    # 2. Dağıtım: kova başına gereken soruları seç, dengeli turlarla formlara paylaştır
+    forms = [[] for _ in range(n_forms)]
+    totals = [0.0] * n_forms
+    for (cell, topic), k in sorted(profile.items(), key=lambda kv: -kv[1]):
+        pool = list(eligible[cell][topic])
+        rng.shuffle(pool)
+        if priority:
+            pool.sort(key=priority.get, reverse=True)
+        needed = k * n_forms
+        if len(pool) >= needed:
+            picked = sorted(pool[:needed], key=lambda i: balance[i], reverse=True)
+            for r in range(k):
+                chunk = picked[r * n_forms:(r + 1) * n_forms]
+                for q, f in zip(chunk, sorted(range(n_forms), key=lambda f: totals[f])):
+                    forms[f].append(q)
+                    totals[f] += balance[q]
+        else:
+            m = len(pool)
+            for f in range(n_forms):
+                for j in range(k):
+                    q = pool[(f * k + j) % m]
+                    forms[f].append(q)
+                    totals[f] += balance[q]
+
+    for form in forms:
+        rng.shuffle(form)
+    seen = {}
+    for form in forms:
+        for q in form:
+            seen[q] = seen.get(q, 0) + 1
+    return {
+        'ok': True, 'forms': forms, 'issues': [],
+        'profile': {f"{cell} / {topic}": k for (cell, topic), k in sorted(profile.items())},
+        'overlap': sum(1 for c in seen.values() if c > 1),
+        'balance_totals': [round(t, 2) for t in totals],
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
+
+def invalidate_question_caches():
+    """Soru tablosuna yazan işlemlerden sonra önbellekteki seçim indekslerini geçersiz kılar."""
+    get_selection_index.clear()
+
+def derive_booklet_permutation(questions, seed, student):
+    """
+    Öğrenciye (veya gruba) özel soru sırası ve ÇS şık sıralarını `seed:öğrenci` tohumundan deterministik olarak türetir.
+    Dönüş: (order, option_orders) -> order: soru indeksleri,
+    option_orders: {soru indeksi: dolu şıkların alfabetik sırasına göre indeks permütasyonu}
+    """
+    rng = random.Random(f"{seed}:{student}")
+    order = list(range(len(questions)))
+    rng.shuffle(order)
+    option_orders = {}
+    for i in order:
+        q = questions[i]
+        if q.QuestionType != 'MC': continue
+        keys = q.filled_option_keys()
+        if len(keys) > 1 and (q.CorrectAnswer or '').strip().upper() in keys:
+            perm = list(range(len(keys)))
+            rng.shuffle(perm)
+            option_orders[i] = perm
+    return order, option_orders
+
+def permuted_questions(questions, order, option_orders):
+    """Permütasyonu ortak QuestionRecord tablosuna uygular; soruları tek tek üretir (grup/kitapçık başına kopya listesi tutulmaz)."""
+    for i in order:
+        q = questions[i]
+        perm = option_orders.get(i)
+        if perm:
+            filled = [(k, v) for k, v in q.Options if v and str(v).strip()]
+            correct_pos = [k for k, _ in filled].index(q.CorrectAnswer.strip().upper())
+            q = q.with_options(tuple((STANDARD_OPTION_KEYS[n], filled[j][1]) for n, j in enumerate(perm)),
+                               STANDARD_OPTION_KEYS[perm.index(correct_pos)])
+        yield q
+
+def exam_group_names(meta):
+    """Sınav ayarındaki kitapçık seçimini grup adları listesine çevirir."""
+    if meta.get('groups') == "A ve B": return ["A", "B"]
+    if "C" in (meta.get('groups') or ""): return ["A", "B", "C", "D"]
+    return ["A"]
+
+def build_group_permutations(questions, group_names, seed=None):
+    """A grubu orijinal sırayı korur; diğer gruplar sınav tohumundan türetilen permütasyonlardır."""
+    seed = random.randint(100000, 999999) if seed is None else seed
+    perms = {}
+    for grp in group_names:
+        if grp == "A":
+            perms[grp] = (list(range(len(questions))), {})
+        else:
+            perms[grp] = derive_booklet_permutation(questions, seed, f"grup:{grp}")
+    return perms
+
+def dump_group_permutations(perms):
+    return json.dumps({grp: {'order': order, 'options': {str(i): p for i, p in option_orders.items()}}
+                       for grp, (order, option_orders) in perms.items()}, separators=(',', ':'))
+
+def load_group_permutations(raw):
+    """created_exams.GroupPermutations değerini {grup: (order, option_orders)} yapısına çevirir."""
+    if not raw: return {}
+    return {grp: (data['order'], {int(i): p for i, p in data['options'].items()}) for grp, data in json.loads(raw).items()}
+
+BLANK_RESPONSE = ord('-')
+INVALID_RESPONSE = ord('?')
+
+def exam_answer_key(questions):
+    """
+    Orijinal soru sırasındaki cevap anahtarı (harf kodları) ve puan vektörü.
+    ÇS: doğru şık harfi, D/Y: 'D' (Doğru/True) / 'Y' (Yanlış/False); klasik sorular ve anahtarı tanınmayan sorular
+    optik değerlendirme dışıdır (0).
+    """
+    tf_keys = {'D': 'D', 'T': 'D', 'Y': 'Y', 'F': 'Y'}
+    key = np.zeros(len(questions), dtype=np.uint8)
+    points = np.zeros(len(questions), dtype=float)
+    for i, q in enumerate(questions):
+        answer = (q.CorrectAnswer or '').strip()[:1].upper()
+        if q.QuestionType == 'TF': answer = tf_keys.get(answer)
+        elif q.QuestionType != 'MC' or not ('A' <= answer <= 'Z'): answer = None
+        if answer:
+            key[i] = ord(answer)
+            points[i] = float(q.Score or 0)
+    return key, points
+
+def group_response_luts(questions, group_perms):
+    """
+    Her grup için soru başına 256'lık dönüşüm tablosu: kitapçıkta işaretlenen karakter -> orijinal şık harfi.
+    Küçük harfler büyütülür, boşluk/'-'/'.' boş sayılır, D/Y sorularında T/F de kabul edilir;
+    karıştırılmış ÇS sorularında kitapçıkta olmayan harfler geçersiz ('?') işaretlenir.
+    """
+    n = len(questions)
+    base = np.full(256, INVALID_RESPONSE, dtype=np.uint8)
+    for c in range(ord('A'), ord('Z') + 1):
+        base[c] = base[c + 32] = c
+    for c in b' -._':
+        base[c] = BLANK_RESPONSE
+    tf_cols = [i for i, q in enumerate(questions) if q.QuestionType == 'TF']
+    luts = {}
+    for grp, (order, option_orders) in group_perms.items():
+        lut = np.tile(base, (n, 1))
+        for i in tf_cols:
+            lut[i, [ord('T'), ord('t')]] = ord('D')
+            lut[i, [ord('F'), ord('f')]] = ord('Y')
+        for i, perm in option_orders.items():
+            keys = [k.upper() for k in questions[i].filled_option_keys()]
+            for c in range(ord('A'), ord('Z') + 1):
+                lut[i, c] = lut[i, c + 32] = INVALID_RESPONSE
+            for pos, j in enumerate(perm):
+                letter = ord(STANDARD_OPTION_KEYS[pos])
+                lut[i, letter] = lut[i, letter + 32] = ord(keys[j])
+        luts[grp] = lut
+    return luts
+
+def grade_responses(questions, group_perms, students, groups, answers):
+    """
+    Optik okuyucu satırlarını toplu değerlendirir. Her grubun cevap dizisi kayıtlı permütasyonla orijinal soru ve şık
+    sırasına çevrilir; doğru/yanlış/boş sayıları ve puanlar anahtar matrisiyle vektörel karşılaştırmayla hesaplanır.
+    Dönüş: (sonuç satırları, geçersiz grup satırları)
+    """
+    n = len(questions)
+    m = len(students)
+    groups = np.array([str(g).strip().upper() for g in groups], dtype=object)
+    raw = np.frombuffer(''.join(str(a).ljust(n)[:n] for a in answers).encode('ascii', 'replace'),
+                        dtype=np.uint8).reshape(m, n)
+    responses = np.full((m, n), BLANK_RESPONSE, dtype=np.uint8)
+    valid = np.zeros(m, dtype=bool)
+    cols = np.arange(n)[None, :]
+    for grp, lut in group_response_luts(questions, group_perms).items():
+        rows = np.flatnonzero(groups == grp)
+        if not len(rows): continue
+        original = np.empty((len(rows), n), dtype=np.uint8)
+        original[:, group_perms[grp][0]] = raw[rows]
+        responses[rows] = lut[cols, original]
+        valid[rows] = True
+
+    key, points = exam_answer_key(questions)
+    gradable = key > 0
+    blank = (responses == BLANK_RESPONSE) & gradable
+    correct = (responses == key) & gradable
+    wrong = gradable & ~blank & ~correct
+    scores = correct @ points
+    correct_n, wrong_n, blank_n = correct.sum(axis=1), wrong.sum(axis=1), blank.sum(axis=1)
+
+    results, invalid = [], []
+    for r in range(m):
+        if not valid[r]:
+            invalid.append({"Öğrenci": students[r], "Grup": groups[r]})
+            continue
+        results.append({"Öğrenci": students[r], "Grup": groups[r], "Doğru": int(correct_n[r]), "Yanlış": int(wrong_n[r]),
+                        "Boş": int(blank_n[r]), "Puan": round(float(scores[r]), 2),
+                        "Cevaplar": responses[r].tobytes().decode('ascii')})
+    return results, invalid
+
+def exam_output_meta(exam_row, settings=None):
+    """
+    Arşivdeki sınavdan çıktı üretimi için meta sözlüğü: başlık, ders ve sınavın kayıtlı düzen ayarları (ExamSettings).
+    `settings` verilirse (örn. kitapçık üretiminde saklanan ayarlar) sınav ayarlarının üzerine yazılır.
+    """
+    exam_settings = json.loads(exam_row['ExamSettings']) if exam_row.get('ExamSettings') else {}
+    return {'title': exam_row['Title'], 'course': exam_row['CourseCode'], 'classical_lines': 5, **exam_settings, **(settings or {})}
+
+def build_student_booklets(meta, questions, seed, student_labels, progress=None):
+    """
+    Her öğrenci için ayrı PDF kitapçığı üretip doğrudan diskteki bir ZIP dosyasına yazar.
+    Aynı anda bellekte tek kitapçık bulunur; cevap anahtarı tablosu da satır satır geçici CSV dosyasına akıtılır.
+    Dönüş: ZIP dosyasının yolu
+    """
+    questions = [QuestionRecord.from_row(q) for q in questions]
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    fd, zip_path = tempfile.mkstemp(prefix=f"kitapcik_{meta['course']}_", suffix=".zip", dir=EXPORT_DIR)
+    os.close(fd)
+    classical_lines = meta.get('classical_lines', 5)
+    width = len(str(len(student_labels)))
+
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", dir=EXPORT_DIR, delete=False, encoding="utf-8-sig", newline="") as key_file:
+        writer = csv.writer(key_file)
+        writer.writerow(["Öğrenci", "Kitapçık Kodu", "Soru Sırası (Orijinal No)"] + [f"S{i}" for i in range(1, len(questions) + 1)])
+        with get_bundle_build_slots(), zipfile.ZipFile(zip_path, "w") as zf:
+            for n, student in enumerate(student_labels, 1):
+                order, option_orders = derive_booklet_permutation(questions, seed, student)
+                booklet_code = f"{n:0{width}d}"
+                pdf = ExamPDFEngine(meta, group_name=booklet_code, classical_lines=classical_lines)
+                pdf.generate_content(permuted_questions(questions, order, option_orders))
+                safe_student = re.sub(r'[^\w.-]+', '_', student)
+                pdf_name = f"Kitapciklar/{booklet_code}_{safe_student}.pdf"
+                compress_type, level = zip_compression_for(pdf_name)
+                zf.writestr(pdf_name, pdf.get_pdf_bytes(), compress_type=compress_type, compresslevel=level)
+                del pdf
+
+                answers = [(q.CorrectAnswer or '-') if q.QuestionType != 'CL' else 'KLASİK'
+                           for q in permuted_questions(questions, order, option_orders)]
+                writer.writerow([student, booklet_code, "-".join(str(i + 1) for i in order)] + answers)
+                if progress: progress(n, len(student_labels))
+            key_file.flush()
+            key_name = f"CevapAnahtari_Ogrenciler_{meta['course']}.csv"
+            compress_type, level = zip_compression_for(key_name)
+            zf.write(key_file.name, key_name, compress_type=compress_type, compresslevel=level)
+    os.remove(key_file.name)
+    return zip_path
+
+BUNDLE_DOCUMENTS = (
+    ('pdf', False, "SoruKitapcigi"),
+    ('pdf', True, "CevapAnahtari"),
+    ('docx', False, "SoruKitapcigi"),
+    ('docx', True, "CevapAnahtari"),
+)
+_BUNDLE_STATE = {}
+
+def _init_bundle_worker(meta, questions, snapshot=None):
+    """Üretim için ortak soru tablosunu yükler; `snapshot`, tablonun havuz işçileri için yazıldığı dosyadır."""
+    _BUNDLE_STATE['meta'] = meta
+    _BUNDLE_STATE['questions'] = questions
+    _BUNDLE_STATE['snapshot'] = snapshot
+
+def zip_compression_for(name):
+    """
+    Dosya türüne göre ZIP sıkıştırma ayarı (tür, seviye). PDF/DOCX içerikleri zaten büyük ölçüde sıkıştırılmış olduğundan
+    en hızlı deflate seviyesi (~%10 kazanç) kullanılır; resim/ZIP gibi dosyalar olduğu gibi (stored), metinler seviye 6 ile yazılır.
+    """
+    lower = name.lower()
+    if lower.endswith(('.zip', '.png', '.jpg', '.jpeg')): return zipfile.ZIP_STORED, None
+    if lower.endswith(('.pdf', '.docx')): return zipfile.ZIP_DEFLATED, 1
+    return zipfile.ZIP_DEFLATED, 6
+
+@st.cache_resource(show_spinner=False)
+def get_bundle_build_slots():
+    """
+    Süreç genelinde eşzamanlı set/kitapçık üretimini sınırlayan semafor.
+    Her üretim en fazla bir belge kadar bellek kullandığından sınır, bellek bütçesini (MB) tahmini üretim başı kullanıma böler.
+    """
+    return threading.BoundedSemaphore(max(1, BUNDLE_BUILD_MEMORY_BUDGET_MB // BUNDLE_BUILD_ESTIMATED_MB))
+
+def render_bundle_job(grp, order, option_orders, fmt, is_answer_key, prefix, spool_dir):
+    """Tek bir (grup, format) belgesini üretip biriktirme klasörüne yazar. Dönüş: (dosya adı, dosya yolu, süre ms, pid)"""
+    start = time.perf_counter()
+    meta, questions = _BUNDLE_STATE['meta'], _BUNDLE_STATE['questions']
+    classical_lines = meta.get('classical_lines', 5)
+    name = f"{prefix}_{grp}_{meta['course']}.{fmt}"
+    path = os.path.join(spool_dir, name)
+    if fmt == 'pdf':
+        engine = ExamPDFEngine(meta, is_answer_key=is_answer_key, group_name=grp, classical_lines=classical_lines)
+        engine.generate_content(permuted_questions(questions, order, option_orders))
+        with open(path, 'wb') as f:
+            f.write(engine.get_pdf_bytes())
+    else:
+        engine = ExamDocxTemplateEngine(meta, is_answer_key=is_answer_key, group_name=grp, classical_lines=classical_lines)
+        engine.generate(permuted_questions(questions, order, option_orders))
+        engine.doc.save(path)
+    return name, path, (time.perf_counter() - start) * 1000, os.getpid()
+
+@st.cache_resource(show_spinner=False)
+def get_bundle_pool(workers):
+    """
+    Kitapçık üretimi için süreç genelinde kalıcı süreç havuzu; işçiler worker_mp_context ile temiz süreçlerde başlar ve
+    uygulama modülünü bir kez yükler.
+    Havuz üretimler arasında korunduğu için bu açılış maliyeti yalnızca ilk kullanımda ödenir.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=worker_mp_context())
+
+def _pool_render_bundle_job(snapshot, *job):
+    """
+    Kalıcı havuz işçisinde çalışır: tek bir (grup, format) belgesini üretir. İş yalnızca soru sırası/şık permütasyonunu
+    (soru tablosundaki indeksler) taşır; sınav verisi üretim başına bir kez yazılan anlık görüntüden işçi başına bir kez okunur.
+    """
+    if _BUNDLE_STATE.get('snapshot') != snapshot:
+        with open(snapshot, 'rb') as f:
+            _init_bundle_worker(*pickle.load(f), snapshot=snapshot)
+    return render_bundle_job(*job)
+
+def build_exam_bundle(meta, questions, group_perms, out_path, parallel=True, max_workers=None):
+    """
+    Tüm grupların kitapçık ve cevap anahtarı (PDF/DOCX) belgelerini üretip doğrudan diskteki `out_path` ZIP dosyasına yazar.
+    parallel=True ise her (grup, format) işi kalıcı süreç havuzunda (get_bundle_pool) çalışır; işler belgeyi geçici klasöre yazar
+    ve ZIP tamamlananlar sırasıyla dosyadan doldurulur. Havuz hata verirse hata döndürülüp seri üretime düşülür.
+    Dönüş: {'path', 'timings', 'mode', 'elapsed_ms', 'error'}
+    """
+    start = time.perf_counter()
+    check_and_download_font()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    workers_wanted = max_workers or os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory(dir=EXPORT_DIR) as spool_dir:
+        jobs = [(grp, order, option_orders, fmt, is_key, prefix, spool_dir)
+                for grp, (order, option_orders) in group_perms.items() for fmt, is_key, prefix in BUNDLE_DOCUMENTS]
+        workers = min(len(jobs), workers_wanted)
+        timings = []
+
+        def add(result, zf):
+            name, path, elapsed_ms, pid = result
+            size = os.path.getsize(path)
+            compress_type, level = zip_compression_for(name)
+            zf.write(path, name, compress_type=compress_type, compresslevel=level)
+            os.remove(path)
+            timings.append({"Dosya": name, "Süre (ms)": round(elapsed_ms, 1), "Boyut (KB)": round(size / 1024, 1), "İşlem (PID)": pid})
+
+        mode, error = "Seri", None
+        if parallel and workers > 1:
+            try:
+                pool = get_bundle_pool(workers)
+                snapshot = os.path.join(spool_dir, "snapshot.pkl")
+                with open(snapshot, 'wb') as f:
+                    pickle.dump((meta, questions), f, protocol=pickle.HIGHEST_PROTOCOL)
+                with zipfile.ZipFile(out_path, "w") as zf:
+                    for future in as_completed([pool.submit(_pool_render_bundle_job, snapshot, *job) for job in jobs]):
+                        add(future.result(), zf)
+                mode = f"Süreç Havuzu ({workers} işçi)"
+            except Exception as e:
+                traceback.print_exc()
+                if isinstance(e, BrokenProcessPool):
+                    get_bundle_pool.clear()
+                error = f"{type(e).__name__}: {e}"
+                mode = "Seri (süreç havuzu hatası)"
+                timings = []
+
+        if not timings:
+            _init_bundle_worker(meta, questions)
+            with zipfile.ZipFile(out_path, "w") as zf:
+                for job in jobs:
+                    add(render_bundle_job(*job), zf)
+
+    return {'path': out_path, 'timings': timings, 'mode': mode, 'error': error,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+def _benchmark_questions(n_questions):
+    """Performans ölçümleri için sentetik QuestionRecord listesi."""
+    types_cycle = ('MC', 'MC', 'TF', 'CL')
+    return [
+        QuestionRecord(i, None, 'BENCH', 'Konu', 2, types_cycle[i % 4], 1.0,
+                       f"{i}. Performans ölçümü için örnek soru metni; uzunluğu gerçekçi olsun diye birkaç cümle içerir. " * 2,
+                       tuple((k, f"{k} şıkkı için örnek cevap metni") for k in "ABCD") if types_cycle[i % 4] == 'MC' else (),
+                       'A' if types_cycle[i % 4] == 'MC' else 'Doğru')
+        for i in range(1, n_questions + 1)
+    ]
+
+def benchmark_pdf_engine(runs=10, n_questions=50):
+    """PDF motoru kurulumunu (dosyadan add_font / paylaşılan FontRegistry) ve tam PDF üretimini ölçer."""
+    check_and_download_font()
+    if not os.path.exists(FONT_FILENAME):
+        return [{"Ölçüm": "Font dosyası bulunamadı", "Ortalama (ms)": None}]
+    registry = get_font_registry()
+    bold_file = FONT_BOLD_FILENAME if os.path.exists(FONT_BOLD_FILENAME) else FONT_FILENAME
+
+    def avg_ms(fn):
+        start = time.perf_counter()
+        for _ in range(runs): fn()
+        return round((time.perf_counter() - start) * 1000 / runs, 2)
+
+    def legacy_setup():
+        pdf = FPDF()
+        pdf.add_font('DejaVu', '', FONT_FILENAME, uni=True)
+        pdf.add_font('DejaVu', 'B', bold_file, uni=True)
+
+    def registry_setup():
+        pdf = FPDF()
+        registry.register(pdf, 'DejaVu', '', FONT_FILENAME)
+        registry.register(pdf, 'DejaVu', 'B', bold_file)
+
+    meta = {'title': 'Performans Testi', 'course': 'BENCH'}
+    questions = _benchmark_questions(n_questions)
+    perms = build_group_permutations(questions, ["A", "B"], seed=1)
+
+    def full_pdf(grp):
+        pdf = ExamPDFEngine(meta, group_name=grp)
+        pdf.generate_content(permuted_questions(questions, *perms[grp]))
+        return pdf.get_pdf_bytes()
+
+    cold = avg_ms(lambda: (registry.subsets.clear(), registry.widths.clear(), full_pdf("A")))
+    warm = avg_ms(lambda: full_pdf("B"))
+    return [
+        {"Ölçüm": "Motor kurulumu: add_font (her örnekte dosyadan)", "Ortalama (ms)": avg_ms(legacy_setup)},
+        {"Ölçüm": "Motor kurulumu: FontRegistry (paylaşılan metrikler)", "Ortalama (ms)": avg_ms(registry_setup)},
+        {"Ölçüm": f"Tam PDF ({n_questions} soru, alt küme önbelleği soğuk)", "Ortalama (ms)": cold},
+        {"Ölçüm": f"Tam PDF ({n_questions} soru, başka grup, alt küme önbelleği sıcak)", "Ortalama (ms)": warm},
+    ]
+
+def render_merged_groups_pdf(meta, questions, group_perms, is_answer_key=False, engine=None):
+    """
+    Tüm grupları tek bir PDF'te art arda üretir (her grup yeni sayfadan başlar, sayfa numarası grup içinde sayılır).
+    Gruplar aynı motoru kullandığından font programı ve genişlik tablosu dosyaya yalnızca bir kez gömülür.
+    engine verilirse bölüm aynı belgeye eklenir; her bölüm ve grup için yer imi oluşturulur. Dönüş: motor
+    """
+    engine = engine or ExamPDFEngine(meta, group_name=next(iter(group_perms)), classical_lines=meta.get('classical_lines', 5))
+    engine.is_answer_key = is_answer_key
+    engine.add_bookmark("Cevap Anahtarları" if is_answer_key else "Soru Kitapçıkları")
+    for grp, (order, option_orders) in group_perms.items():
+        engine.group_name = grp
+        engine.add_bookmark(f"Grup {grp}", level=1)
+        engine.generate_content(permuted_questions(questions, order, option_orders))
+    return engine
+
+def get_or_build_print_pdf(meta, questions, group_perms):
+    """
+    Baskı için tüm grupların kitapçıklarını ve ardından cevap anahtarlarını tek PDF'te (ortak font, grup yer imleri)
+    üretir ve set önbelleğinde aynı içerik özetiyle saklar. Dönüş: dosya yolu
+    """
+    os.makedirs(BUNDLE_CACHE_DIR, exist_ok=True)
+    pdf_path = os.path.join(BUNDLE_CACHE_DIR, f"{bundle_cache_key(meta, questions, group_perms)}.print.pdf")
+    if os.path.exists(pdf_path):
+        os.utime(pdf_path)
+        return pdf_path
+
+    tmp_path = f"{pdf_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with get_bundle_build_slots():
+        engine = render_merged_groups_pdf(meta, questions, group_perms)
+        render_merged_groups_pdf(meta, questions, group_perms, is_answer_key=True, engine=engine)
+        engine.output(tmp_path, 'F')
+    os.replace(tmp_path, pdf_path)
+    _evict_bundle_cache()
+    return pdf_path
+
+def report_exam_output_sizes(n_questions=50, n_groups=4):
+    """
+    Aynı sınavın (n_questions soru, n_groups grup) farklı çıktı biçimlerindeki toplam boyut ve üretim süresi raporu:
+    sıkıştırmasız / sıkıştırmalı ayrı PDF'ler, ortak fontlu tek PDF, DOCX ve alt kümesiz tam font gömme tahmini.
+    """
+    check_and_download_font()
+    meta = {'title': 'Boyut Raporu', 'course': 'BENCH'}
+    questions = _benchmark_questions(n_questions)
+    perms = build_group_permutations(questions, [chr(65 + i) for i in range(n_groups)], seed=1)
+    rows = []
+
+    def measure(label, produce):
+        start = time.perf_counter()
+        blobs = produce()
+        rows.append({"Biçim": label, "Dosya": len(blobs),
+                     "Toplam Boyut (KB)": round(sum(len(b) for b in blobs) / 1024, 1),
+                     "Süre (ms)": round((time.perf_counter() - start) * 1000, 1)})
+
+    def separate_pdfs(compress):
+        blobs = []
+        for grp, (order, option_orders) in perms.items():
+            engine = ExamPDFEngine(meta, group_name=grp, compress=compress)
+            engine.generate_content(permuted_questions(questions, order, option_orders))
+            blobs.append(engine.get_pdf_bytes())
+        return blobs
+
+    def separate_docx():
+        blobs = []
+        for grp, (order, option_orders) in perms.items():
+            engine = ExamDocxTemplateEngine(meta, group_name=grp)
+            engine.generate(permuted_questions(questions, order, option_orders))
+            buffer = BytesIO()
+            engine.doc.save(buffer)
+            blobs.append(buffer.getvalue())
+        return blobs
+
+    measure("PDF - ayrı gruplar, sıkıştırmasız içerik", lambda: separate_pdfs(False))
+    measure("PDF - ayrı gruplar, sıkıştırmalı içerik + font alt kümesi", lambda: separate_pdfs(True))
+    measure("PDF - tüm gruplar tek dosya (ortak font)", lambda: [render_merged_groups_pdf(meta, questions, perms).get_pdf_bytes()])
+    measure("DOCX - ayrı gruplar", separate_docx)
+
+    font_files = [f for f in (FONT_FILENAME, FONT_BOLD_FILENAME) if os.path.exists(f)]
+    if font_files:
+        full_font_kb = sum(len(zlib.compress(open(f, 'rb').read())) for f in font_files) / 1024
+        rows.append({"Biçim": "Karşılaştırma: alt kümesiz tam font gömme (yalnızca font, dosya başına)", "Dosya": n_groups,
+                     "Toplam Boyut (KB)": round(full_font_kb * n_groups, 1), "Süre (ms)": None})
+    return rows
+
+def benchmark_fragment_cache(n_questions=50, n_groups=4):
+    """
+    Boş parça önbelleğiyle tüm grupların PDF/DOCX kitapçık ve cevap anahtarlarını sırayla üretir.
+    İlk grup tüm parçaları hazırlar; sonraki gruplar yalnızca hazır parçaları sıralar.
+    """
+    meta = {'title': 'Performans Testi', 'course': 'BENCH'}
+    questions = _benchmark_questions(n_questions)
+    perms = build_group_permutations(questions, [chr(65 + i) for i in range(n_groups)], seed=1)
+    cache = get_fragment_cache()
+    cache.clear()
+    rows = []
+    for grp, (order, option_orders) in perms.items():
+        hits, misses = cache.hits, cache.misses
+        start = time.perf_counter()
+        for is_key in (False, True):
+            pdf = ExamPDFEngine(meta, is_answer_key=is_key, group_name=grp)
+            pdf.generate_content(permuted_questions(questions, order, option_orders))
+            pdf.get_pdf_bytes()
+            docx = ExamDocxTemplateEngine(meta, is_answer_key=is_key, group_name=grp)
+            docx.generate(permuted_questions(questions, order, option_orders))
+            docx.get_docx_bytes()
+        rows.append({"Grup": grp, "Belge": 4, "Süre (ms)": round((time.perf_counter() - start) * 1000, 1),
+                     "Parça İsabet": cache.hits - hits, "Parça Iskalama": cache.misses - misses})
+    return rows
+
+def bundle_cache_key(meta, questions, group_perms):
+    """Çıktı setini belirleyen her şeyin (başlık, ders, ayarlar, soru içerikleri, grup permütasyonları) özeti."""
+    payload = json.dumps({
+        'meta': {k: meta.get(k) for k in ('title', 'course', 'classical_lines')},
+        'questions': [[q.QuestionType, q.Score, q.QuestionText, q.Options, q.CorrectAnswer] for q in questions],
+        'groups': dump_group_permutations(group_perms),
+    }, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _evict_bundle_cache(max_bytes=BUNDLE_CACHE_MAX_BYTES):
+    """Önbellek boyutu sınırı aşıldıysa en uzun süredir erişilmeyen setleri (ZIP ve baskı PDF'leri) siler."""
+    entries = []
+    for name in os.listdir(BUNDLE_CACHE_DIR):
+        if name.endswith(('.zip', '.pdf')):
+            path = os.path.join(BUNDLE_CACHE_DIR, name)
+            st_info = os.stat(path)
+            entries.append((st_info.st_mtime, st_info.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes: break
+        for p in (path, path[:-4] + '.json'):
+            if os.path.exists(p): os.remove(p)
+        total -= size
+
+def get_or_build_bundle(meta, questions, group_perms):
+    """
+    Çıktı setini içerik özetiyle diskte önbellekler. Aynı içerik için yeniden üretim yapılmaz;
+    erişilen setin zamanı güncellenir (LRU). Dönüş: {'key', 'path', 'timings', 'mode', 'elapsed_ms', 'cached'}
+    """
+    os.makedirs(BUNDLE_CACHE_DIR, exist_ok=True)
+    key = bundle_cache_key(meta, questions, group_perms)
+    zip_path = os.path.join(BUNDLE_CACHE_DIR, f"{key}.zip")
+    info_path = os.path.join(BUNDLE_CACHE_DIR, f"{key}.json")
+    if os.path.exists(zip_path) and os.path.exists(info_path):
+        os.utime(zip_path)
+        with open(info_path, encoding='utf-8') as f:
+            info = json.load(f)
+        return {**info, 'key': key, 'path': zip_path, 'cached': True}
+
+    tmp_path = f"{zip_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with get_bundle_build_slots():
+        bundle = build_exam_bundle(meta, questions, group_perms, tmp_path)
+    os.replace(tmp_path, zip_path)
+    info = {k: bundle[k] for k in ('timings', 'mode', 'elapsed_ms', 'error')}
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False)
+    _evict_bundle_cache()
+    return {**info, 'key': key, 'path': zip_path, 'cached': False}
+
+def benchmark_bundle_render(n_questions=100, n_groups=4):
+    """Sentetik bir sınav için seri ve süreç havuzlu kitapçık seti üretimini karşılaştırır."""
+    questions = _benchmark_questions(n_questions)
+    meta = {'title': 'Performans Testi', 'course': 'BENCH', 'classical_lines': 5}
+    perms = build_group_permutations(questions, ["A", "B", "C", "D"][:n_groups], seed=1)
+    results = []
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    for parallel in (False, True):
+        with tempfile.NamedTemporaryFile(suffix=".zip", dir=EXPORT_DIR) as out:
+            bundle = build_exam_bundle(meta, questions, perms, out.name, parallel=parallel, max_workers=max(2, os.cpu_count() or 1))
+            results.append({"Yöntem": bundle['mode'], "Belge Sayısı": len(bundle['timings']), "Toplam (ms)": bundle['elapsed_ms'],
+                            "En Uzun İş (ms)": max(t["Süre (ms)"] for t in bundle['timings']), "ZIP (KB)": round(os.path.getsize(out.name) / 1024, 1)})
+    return results
 
 def load_draft_exam(exam_id):
     """Veritabanından taslak sınavı yükler ve session state'i günceller."""
@@ -2340,8 +5313,8 @@ def load_draft_exam(exam_id):
     }
     
     try:
-        qs = json.loads(exam_data_row['ExamData'])
-        temp_scores = {q['QuestionID']: float(q['Score']) for q in qs if 'QuestionID' in q}
+        qs = [QuestionRecord.from_row(q) for q in db.get_exam_questions(exam_data_row)]
+        temp_scores = {q.QuestionID: float(q.Score) for q in qs if q.QuestionID is not None}
     except Exception as e:
         st.error(f"Taslak veri çözümleme hatası: {e}")
         return False
@@ -2411,6 +5384,7 @@ def exam_create_page():
             st.session_state['temp_scores'] = {} 
             st.session_state['selected_questions'] = []
             st.session_state['override_score_check'] = False
+            st.session_state.pop('parallel_forms', None)
             st.rerun()
         elif sel_course == "Veri Yok":
             st.warning("Lütfen soru bankasına soru ekledikten sonra devam edin.")
@@ -2425,8 +5399,8 @@ def exam_create_page():
             
         st.divider()
             
-        pool = db.get_questions(user, meta['course'])
-        if not pool:
+        course_index = get_selection_index(user['Username'], user['Role'], meta['course'])
+        if course_index['total'] == 0:
             st.warning(f"'{meta['course']}' dersi için soru havuzunda hiç soru bulunmamaktadır.")
             return
 
@@ -2436,70 +5410,169 @@ def exam_create_page():
             st.info("Sistemin belirlediğiniz kriterlerdeki havuzlardan rastgele soru seçmesi için adetleri girin.")
             
             st.markdown("#### 1. Konu Alanı Kısıtlaması (Opsiyonel)")
-            topics_in_course = sorted(list(set(q['TopicArea'] for q in pool)))
-            sel_random_topics = st.multiselect("Sadece Şu Konu Alanlarından Seç", topics_in_course, key="rnd_topics")
+            sel_random_topics = st.multiselect("Sadece Şu Konu Alanlarından Seç", course_index['topics'], key="rnd_topics")
+            use_empirical = st.checkbox(
+                "Zorluk için ampirik p-değerini kullan", key="rnd_empirical",
+                help=f"Madde analizi yapılmış ve en az {ITEM_ANALYSIS_MIN_RESPONSES} cevabı olan sorularda zorluk, doğru cevaplama oranından belirlenir "
+                     f"(p ≥ {EMPIRICAL_EASY_P}: Kolay, p < {EMPIRICAL_HARD_P}: Zor)."
+            )
             
-            random_pool = [q for q in pool if (not sel_random_topics or q['TopicArea'] in sel_random_topics)]
+            selection_index = get_selection_index(user['Username'], user['Role'], meta['course'], tuple(sorted(sel_random_topics)), use_empirical)
+            pools = selection_index['pools']
+            counts = selection_index['counts']
 
             st.markdown("#### 2. Soru Tipi ve Zorluk Adet Seçimi")
             
-            pools = {
-                'MC_1': [q for q in random_pool if q['QuestionType'] == 'MC' and q['Complexity'] == 1],
-                'MC_2': [q for q in random_pool if q['QuestionType'] == 'MC' and q['Complexity'] == 2],
-                'MC_3': [q for q in random_pool if q['QuestionType'] == 'MC' and q['Complexity'] == 3],
-                'TF_1': [q for q in random_pool if q['QuestionType'] == 'TF' and q['Complexity'] == 1],
-                'TF_2': [q for q in random_pool if q['QuestionType'] == 'TF' and q['Complexity'] == 2],
-                'TF_3': [q for q in random_pool if q['QuestionType'] == 'TF' and q['Complexity'] == 3],
-                'CL_1': [q for q in random_pool if q['QuestionType'] == 'CL' and q['Complexity'] == 1],
-                'CL_2': [q for q in random_pool if q['QuestionType'] == 'CL' and q['Complexity'] == 2],
-                'CL_3': [q for q in random_pool if q['QuestionType'] == 'CL' and q['Complexity'] == 3],
-            }
-            
             requested_qs = {}
             total_req = 0
             
             st.markdown("##### 🟦 Çoktan Seçmeli (MC)")
             c_mc1, c_mc2, c_mc3 = st.columns(3)
-            req_mc1 = c_mc1.number_input(f"Kolay (Mevcut: {len(pools['MC_1'])})", 0, len(pools['MC_1']), 0, key="req_mc1")
-            req_mc2 = c_mc2.number_input(f"Orta (Mevcut: {len(pools['MC_2'])})", 0, len(pools['MC_2']), 0, key="req_mc2")
-            req_mc3 = c_mc3.number_input(f"Zor (Mevcut: {len(pools['MC_3'])})", 0, len(pools['MC_3']), 0, key="req_mc3")
+            req_mc1 = c_mc1.number_input(f"Kolay (Mevcut: {counts['MC_1']})", 0, counts['MC_1'], 0, key="req_mc1")
+            req_mc2 = c_mc2.number_input(f"Orta (Mevcut: {counts['MC_2']})", 0, counts['MC_2'], 0, key="req_mc2")
+            req_mc3 = c_mc3.number_input(f"Zor (Mevcut: {counts['MC_3']})", 0, counts['MC_3'], 0, key="req_mc3")
             total_req += req_mc1 + req_mc2 + req_mc3
             requested_qs.update({'MC_1': req_mc1, 'MC_2': req_mc2, 'MC_3': req_mc3})
 
             st.markdown("##### 🟩 Doğru/Yanlış (TF)")
             c_tf1, c_tf2, c_tf3 = st.columns(3)
-            req_tf1 = c_tf1.number_input(f"Kolay (Mevcut: {len(pools['TF_1'])})", 0, len(pools['TF_1']), 0, key="req_tf1")
-            req_tf2 = c_tf2.number_input(f"Orta (Mevcut: {len(pools['TF_2'])})", 0, len(pools['TF_2']), 0, key="req_tf2")
-            req_tf3 = c_tf3.number_input(f"Zor (Mevcut: {len(pools['TF_3'])})", 0, len(pools['TF_3']), 0, key="req_tf3")
+            req_tf1 = c_tf1.number_input(f"Kolay (Mevcut: {counts['TF_1']})", 0, counts['TF_1'], 0, key="req_tf1")
+            req_tf2 = c_tf2.number_input(f"Orta (Mevcut: {counts['TF_2']})", 0, counts['TF_2'], 0, key="req_tf2")
+            req_tf3 = c_tf3.number_input(f"Zor (Mevcut: {counts['TF_3']})", 0, counts['TF_3'], 0, key="req_tf3")
             total_req += req_tf1 + req_tf2 + req_tf3
             requested_qs.update({'TF_1': req_tf1, 'TF_2': req_tf2, 'TF_3': req_tf3})
 
             st.markdown("##### 🟨 Klasik (CL)")
             c_cl1, c_cl2, c_cl3 = st.columns(3)
-            req_cl1 = c_cl1.number_input(f"Kolay (Mevcut: {len(pools['CL_1'])})", 0, len(pools['CL_1']), 0, key="req_cl1")
-            req_cl2 = c_cl2.number_input(f"Orta (Mevcut: {len(pools['CL_2'])})", 0, len(pools['CL_2']), 0, key="req_cl2")
-            req_cl3 = c_cl3.number_input(f"Zor (Mevcut: {len(pools['CL_3'])})", 0, len(pools['CL_3']), 0, key="req_cl3")
+            req_cl1 = c_cl1.number_input(f"Kolay (Mevcut: {counts['CL_1']})", 0, counts['CL_1'], 0, key="req_cl1")
+            req_cl2 = c_cl2.number_input(f"Orta (Mevcut: {counts['CL_2']})", 0, counts['CL_2'], 0, key="req_cl2")
+            req_cl3 = c_cl3.number_input(f"Zor (Mevcut: {counts['CL_3']})", 0, counts['CL_3'], 0, key="req_cl3")
             total_req += req_cl1 + req_cl2 + req_cl3
             requested_qs.update({'CL_1': req_cl1, 'CL_2': req_cl2, 'CL_3': req_cl3})
 
             if total_req > 0:
                 score_per_q_rand = meta['score'] / total_req
                 st.caption(f"Toplam İstenen Soru: **{total_req}** Soru (Soru Başı ≈ **{score_per_q_rand:.2f}** Puan)")
+
+            sampling_strategy = st.selectbox(
+                "Seçim Stratejisi", ["🎲 Eşit Olasılıklı", "⚖️ Maruziyet Kontrollü (Az/Uzun Süredir Kullanılmayan Öncelikli)"],
+                key="rnd_strategy",
+                help="Maruziyet kontrolünde sık kullanılan ve yakın zamanda sorulan soruların seçilme olasılığı düşürülür."
+            )
+            exposure_control = sampling_strategy.startswith("⚖️")
+
+            with st.expander("🧩 Gelişmiş Kısıtlar (Blueprint Çözücü)", expanded=False):
+                use_blueprint = st.checkbox("Seçimi kısıt çözücü ile yap", key="bp_enabled")
+                st.caption("Konu kapsamı, hedef puan (soruların kendi puanları), kullanım sınırı ve son sınavlardaki soruların hariç tutulması birlikte sağlanır.")
+
+                df_topic_min = pd.DataFrame({"Konu": selection_index['topics'] if not sel_random_topics else sorted(sel_random_topics), "En Az Soru": 0})
+                edited_topic_min = st.data_editor(
+                    df_topic_min, key="bp_topic_min", hide_index=True, use_container_width=True,
+                    column_config={"Konu": st.column_config.TextColumn(disabled=True), "En Az Soru": st.column_config.NumberColumn(min_value=0, step=1)}
+                )
+                c_bp1, c_bp2, c_bp3, c_bp4 = st.columns(4)
+                bp_use_score = c_bp1.checkbox("Hedef puanı soruların puanıyla tuttur", key="bp_use_score")
+                bp_tolerance = c_bp2.number_input("Puan Toleransı (±)", 0.0, 50.0, 0.0, 0.5, key="bp_tolerance")
+                bp_max_usage = c_bp3.number_input("En Fazla Kullanım (0 = sınırsız)", 0, 1000, 0, key="bp_max_usage")
+                bp_recent = c_bp4.number_input("Son N Sınavdaki Soruları Hariç Tut", 0, 50, 0, key="bp_recent")
             
+            with st.expander("📚 Paralel Form Üretimi (Çoklu Şube)", expanded=False):
+                st.caption("Yukarıdaki tip/zorluk adetleriyle, aynı konu profiline sahip ve mümkün olduğunca farklı sorulardan oluşan birden fazla form üretir. Blueprint çözücü açıksa kullanım sınırı ve son sınav hariç tutma da uygulanır.")
+                c_pf1, c_pf2 = st.columns([1, 2])
+                pf_count = c_pf1.number_input("Form Sayısı", 2, 30, 2, key="pf_count")
+                pf_irt = c_pf1.checkbox("IRT ile dengele", key="pf_irt_balance",
+                                        help="Formlar, ortalama yetenekteki öğrencinin beklenen doğru sayısına (IRT kalibrasyonu) göre dengelenir. Kalibre edilmemiş sorular 0.5 olasılıkla sayılır.")
+                c_pf2.write("")
+                if c_pf2.button("📚 Paralel Formları Üret", use_container_width=True, key="btn_parallel_forms"):
+                    if total_req == 0:
+                        st.warning("En az 1 soru seçmelisiniz.")
+                    else:
+                        st.session_state['parallel_forms'] = assemble_parallel_forms(
+                            selection_index, requested_qs, pf_count,
+                            priority=exposure_priority(selection_index) if exposure_control else None,
+                            exclude_ids=db.get_recent_exam_question_ids(user, meta['course'], bp_recent) if use_blueprint and bp_recent > 0 else (),
+                            max_usage=bp_max_usage if use_blueprint and bp_max_usage > 0 else None,
+                            balance=irt_balance_values(selection_index) if pf_irt else None,
+                        )
+                        st.session_state['parallel_forms']['irt_balance'] = pf_irt
+                        if pf_irt:
+                            uncalibrated = sum(1 for f in st.session_state['parallel_forms']['forms'] for q in f if q not in selection_index['irt_p'])
+                            if uncalibrated:
+                                st.info(f"ℹ️ Formlardaki {uncalibrated} soru henüz IRT ile kalibre edilmemiş; bu sorular 0.5 olasılıkla dengelendi.")
+
+                pf_result = st.session_state.get('parallel_forms')
+                if pf_result:
+                    if not pf_result['ok']:
+                        st.error("❌ Paralel formlar oluşturulamadı:")
+                        for issue in pf_result['issues']:
+                            st.write(f"- {issue}")
+                    else:
+                        n_forms = len(pf_result['forms'])
+                        m_pf1, m_pf2, m_pf3 = st.columns(3)
+                        m_pf1.metric("Form Sayısı", n_forms)
+                        m_pf2.metric("Birden Fazla Formda Geçen Soru", pf_result['overlap'])
+                        balance_label = "Beklenen Doğru Sayısı (θ=0)" if pf_result.get('irt_balance') else "Soruların Özgün Puan Toplamı"
+                        m_pf3.metric("Beklenen Doğru Farkı (maks-min)" if pf_result.get('irt_balance') else "Özgün Puan Farkı (maks-min)",
+                                     round(max(pf_result['balance_totals']) - min(pf_result['balance_totals']), 2))
+                        st.dataframe(pd.DataFrame({
+                            "Form": [f"Form {i}" for i in range(1, n_forms + 1)],
+                            "Soru Sayısı": [len(f) for f in pf_result['forms']],
+                            balance_label: pf_result['balance_totals'],
+                        }), hide_index=True, use_container_width=True)
+                        st.caption("Form başına konu profili: " + ", ".join(f"{k}: {v}" for k, v in pf_result['profile'].items()))
+
+                        if st.button(f"💾 {n_forms} Formu Bağlantılı Sınavlar Olarak Kaydet", type="primary", use_container_width=True, key="btn_save_parallel_forms"):
+                            all_qs = {q['QuestionID']: QuestionRecord.from_row(q) for q in db.get_questions_by_ids(list({i for f in pf_result['forms'] for i in f}))}
+                            forms_qs = []
+                            for form_ids in pf_result['forms']:
+                                per_q = round(meta['score'] / len(form_ids), 2)
+                                forms_qs.append([all_qs[i] if use_blueprint and bp_use_score else all_qs[i].with_score(per_q) for i in form_ids])
+                            form_group, exam_ids = db.save_parallel_forms(meta, forms_qs)
+                            st.session_state.pop('parallel_forms', None)
+                            st.success(f"✅ {len(exam_ids)} form '{form_group}' grubu altında kaydedildi. Sınav Arşivi'nden görüntüleyebilirsiniz.")
+
             if st.button("🎲 Rastgele Oluştur & Devam Et", type="primary", use_container_width=True, key="btn_random_create"):
+                selected_ids = []
                 if total_req == 0:
                     st.warning("En az 1 soru seçmelisiniz.")
                 else:
-                    selected_qs = []
-                    for key, count in requested_qs.items():
-                        if count > 0:
-                            selected_qs.extend(random.sample(pools[key], count))
-                    
-                    random.shuffle(selected_qs) 
+                    if use_blueprint:
+                        blueprint = {
+                            'counts': requested_qs,
+                            'topic_min': dict(zip(edited_topic_min['Konu'], edited_topic_min['En Az Soru'].fillna(0).astype(int))),
+                            'target_score': float(meta['score']) if bp_use_score else None,
+                            'score_tolerance': max(bp_tolerance, 0.01),
+                            'max_usage': bp_max_usage if bp_max_usage > 0 else None,
+                            'exclude_ids': db.get_recent_exam_question_ids(user, meta['course'], bp_recent) if bp_recent > 0 else set(),
+                            'priority': exposure_priority(selection_index) if exposure_control else None,
+                        }
+                        solution = assemble_exam_from_blueprint(selection_index, blueprint)
+                        if not solution['ok']:
+                            st.error("❌ Blueprint kısıtları karşılanamıyor:")
+                            for issue in solution['issues']:
+                                st.write(f"- {issue}")
+                        else:
+                            selected_ids = solution['ids']
+                            st.toast(f"Çözüm {solution['elapsed_ms']} ms içinde bulundu (Toplam puan: {solution['score']}).", icon="🧩")
+                    else:
+                        for key, count in requested_qs.items():
+                            if count > 0:
+                                if exposure_control:
+                                    arr = selection_index['arrays'][key]
+                                    selected_ids.extend(weighted_sample_ids(arr['ids'], exposure_weights(arr['usage'], arr['last_used']), count))
+                                else:
+                                    selected_ids.extend(random.sample(pools[key], count))
+                        random.shuffle(selected_ids) 
+
+                if selected_ids:
+                    selected_qs = [QuestionRecord.from_row(q) for q in db.get_questions_by_ids(selected_ids)]
                     st.session_state['selected_questions'] = selected_qs
                     
                     default_score = meta['score'] / len(selected_qs) if len(selected_qs) > 0 else 0
-                    st.session_state['temp_scores'] = {q['QuestionID']: round(default_score, 2) for q in selected_qs}
+                    if use_blueprint and bp_use_score:
+                        st.session_state['temp_scores'] = {q['QuestionID']: float(q['Score']) for q in selected_qs}
+                    else:
+                        st.session_state['temp_scores'] = {q['QuestionID']: round(default_score, 2) for q in selected_qs}
                     st.session_state['override_score_check'] = False 
 
                     st.session_state['exam_stage'] = 'preview'
@@ -2508,19 +5581,22 @@ def exam_create_page():
         with tab_manual:
             st.info("Aşağıdaki listeden sınavda sormak istediğiniz soruları işaretleyin. Puanlar bir sonraki adımda ayarlanabilir.")
             
+            pool = db.get_questions(user, meta['course'])
             df = pd.DataFrame(pool)
             df.insert(0, "Seç", False)
             
             edited_df = st.data_editor(
-                df[['Seç', 'QuestionID', 'QuestionType', 'Complexity', 'Score', 'QuestionText', 'TopicArea', 'UsageCount']],
+                df[['Seç', 'QuestionID', 'QuestionType', 'Complexity', 'EmpiricalP', 'Discrimination', 'Score', 'QuestionText', 'TopicArea', 'UsageCount']],
                 column_config={
                     "Seç": st.column_config.CheckboxColumn(required=True),
                     "QuestionText": st.column_config.TextColumn("Soru", width="large"),
                     "Complexity": st.column_config.NumberColumn("Zorluk"),
+                    "EmpiricalP": st.column_config.NumberColumn("p (Ampirik)", format="%.2f"),
+                    "Discrimination": st.column_config.NumberColumn("Ayırt Edicilik", format="%.2f"),
                     "Score": st.column_config.NumberColumn("Puan (Varsayılan)"),
                     "UsageCount": st.column_config.NumberColumn("Kullanım Sayısı"),
                 },
-                disabled=["QuestionID", "QuestionType", "Complexity", "Score", "QuestionText", "TopicArea", "UsageCount"],
+                disabled=["QuestionID", "QuestionType", "Complexity", "EmpiricalP", "Discrimination", "Score", "QuestionText", "TopicArea", "UsageCount"],
                 hide_index=True,
                 use_container_width=True,
                 height=500
@@ -2538,7 +5614,7 @@ def exam_create_page():
                     st.warning("Lütfen listeden en az bir soru işaretleyin.")
                 else:
                     selected_ids = manual_selections['QuestionID'].tolist()
-                    final_selection = [q for q in pool if q['QuestionID'] in selected_ids]
+                    final_selection = [QuestionRecord.from_row(q) for q in pool if q['QuestionID'] in selected_ids]
                     
                     st.session_state['selected_questions'] = final_selection
 
@@ -2574,14 +5650,9 @@ def exam_create_page():
         # -------------------------------------------------------------
         
         if c_save_draft.button("💾 Taslak Olarak Kaydet", key="save_as_draft", use_container_width=True):
-            final_qs = []
-            for q in qs:
-                q_id = q['QuestionID']
-                q_copy = q.copy()
-                q_copy['Score'] = st.session_state['temp_scores'].get(q_id, q['Score']) 
-                final_qs.append(q_copy)
+            final_qs = [q.with_score(st.session_state['temp_scores'].get(q.QuestionID, q.Score)) for q in qs]
             
-            meta['score'] = sum(q['Score'] for q in final_qs)
+            meta['score'] = sum(q.Score for q in final_qs)
 
             db.save_exam(meta, final_qs, status='Draft')
             st.toast("Sınav taslak olarak kaydedildi.", icon="💾")
@@ -2649,90 +5720,113 @@ def exam_create_page():
                  st.rerun() 
             
             else:
-                final_qs = []
-                for q in qs:
-                    q_id = q['QuestionID']
-                    q_copy = q.copy()
-                    q_copy['Score'] = st.session_state['temp_scores'].get(q_id, q_copy['Score']) 
-                    final_qs.append(q_copy)
+                final_qs = [q.with_score(st.session_state['temp_scores'].get(q.QuestionID, q.Score)) for q in qs]
                 
                 meta['score'] = round(new_total_score, 2)
                 
-                db.save_exam(meta, final_qs, status='Final')
+                group_perms = build_group_permutations(final_qs, exam_group_names(meta))
+                st.session_state['final_exam_id'] = db.save_exam(meta, final_qs, status='Final', group_permutations=group_perms)
                 st.session_state['final_qs'] = final_qs 
+                st.session_state['group_permutations'] = group_perms
                 st.session_state['exam_stage'] = 'finish'
                 st.session_state['override_score_check'] = False 
                 st.rerun()
             
         with st.expander("### 👁️ Sınav Kağıdı Önizlemesi (A Kitapçığı)", expanded=False):
                
-            preview_qs = []
-            current_scores = {int(row['Soru ID']): float(row['Manuel Puan']) for _, row in edited_scores_df.iterrows()}
-            
-            for q in qs:
-                q_copy = q.copy()
-                q_copy['Score'] = current_scores.get(q_copy['QuestionID'], q_copy['Score'])
-                preview_qs.append(q_copy)
+            current_scores = dict(zip(edited_scores_df['Soru ID'].astype(int), edited_scores_df['Manuel Puan'].astype(float)))
             
             preview_container = st.container(border=True, height=500)
             with preview_container:
                 st.markdown(f"#### {meta['title']} ({meta['course']}) - A Kitapçığı")
                 st.markdown("---")
-                for idx, q in enumerate(preview_qs, 1):
-                    st.markdown(f"**{idx}.** {q['QuestionText']} **({q['Score']} Puan)**")
-                    if q['QuestionType'] == 'MC':
-                        opts = q['Options'] if isinstance(q['Options'], dict) else (json.loads(q['Options']) if isinstance(q['Options'], str) else {})
-                        if opts:
-                             for k, v in sorted(opts.items()): st.write(f"{k}) {v}")
+                for idx, q in enumerate(qs, 1):
+                    st.markdown(f"**{idx}.** {q.QuestionText} **({current_scores.get(q.QuestionID, q.Score)} Puan)**")
+                    if q.QuestionType == 'MC':
+                        for k, v in q.Options: st.write(f"{k}) {v}")
                     st.markdown("---")
 
     elif st.session_state['exam_stage'] == 'finish':
         st.success("✅ Sınav Başarıyla Hazırlandı!")
         meta = st.session_state['exam_meta']
         base_questions = st.session_state['final_qs'] 
-        
-        group_list = ["A"]
-        if meta['groups'] == "A ve B": group_list = ["A", "B"]
-        elif "C" in meta['groups']: group_list = ["A", "B", "C", "D"]
-        
-        classical_lines = meta.get('classical_lines', 5)
-
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zf:
-            for grp in group_list:
-                if grp == "A":
-                    current_qs = [q.copy() for q in base_questions]
-                else: 
-                    current_qs_shuffled = [q.copy() for q in base_questions]
-                    random.shuffle(current_qs_shuffled)
-                    current_qs = shuffle_question_options(current_qs_shuffled) 
-                    
-                pdf = ExamPDFEngine(meta, group_name=grp, classical_lines=classical_lines)
-                pdf.generate_content(current_qs)
-                zf.writestr(f"SoruKitapcigi_{grp}_{meta['course']}.pdf", pdf.get_pdf_bytes())
-                
-                pdfk = ExamPDFEngine(meta, is_answer_key=True, group_name=grp, classical_lines=classical_lines)
-                pdfk.generate_content(current_qs)
-                zf.writestr(f"CevapAnahtari_{grp}_{meta['course']}.pdf", pdfk.get_pdf_bytes())
+        group_perms = st.session_state.get('group_permutations') or build_group_permutations(base_questions, exam_group_names(meta))
+        missing_fonts = check_and_download_font()
+        if FONT_FILENAME in missing_fonts:
+            st.warning("⚠️ Font dosyası indirilemedi; PDF'ler Türkçe karakter desteği olmayan Arial ile basılacak.")
+        elif FONT_BOLD_FILENAME in missing_fonts:
+            st.warning("⚠️ Kalın font dosyası indirilemedi; kalın yazılar normal yazı tipiyle basılacak.")
+
+        bundle = st.session_state.get('exam_bundle')
+        if not bundle or not os.path.exists(bundle['path']):
+            with st.spinner("Kitapçık seti hazırlanıyor..."):
+                bundle = st.session_state['exam_bundle'] = get_or_build_bundle(meta, base_questions, group_perms)
+            if st.session_state.get('final_exam_id'):
+                db.set_exam_bundle_hash(st.session_state['final_exam_id'], bundle['key'])
+        with open(bundle['path'], 'rb') as bundle_file:
+            st.download_button(
+                "📦 Tüm Sınav Setini İndir (ZIP)",
+                data=bundle_file,
+                file_name=f"{meta['course']}_sinav_seti_{datetime.now().strftime('%Y%m%d')}.zip",
+                mime="application/zip",
+                type="primary",
+                use_container_width=True
+            )
+
+        if st.button("🖨️ Baskı için Tek PDF Hazırla (Tüm Gruplar + Cevap Anahtarları)", use_container_width=True, key="btn_print_pdf"):
+            with st.spinner("Baskı PDF'i hazırlanıyor..."):
+                st.session_state['print_pdf'] = get_or_build_print_pdf(meta, base_questions, group_perms)
+        print_pdf = st.session_state.get('print_pdf')
+        if print_pdf and os.path.exists(print_pdf):
+            with open(print_pdf, 'rb') as print_file:
+                st.download_button(
+                    "📥 Baskı PDF'ini İndir", data=print_file,
+                    file_name=f"{meta['course']}_baski_{datetime.now().strftime('%Y%m%d')}.pdf",
+                    mime="application/pdf", use_container_width=True, key="dl_print_pdf"
+                )
+
+        if bundle.get('error') and not bundle['cached']:
+            st.warning(f"⚠️ Paralel üretim başarısız oldu, belgeler seri üretildi: {bundle['error']}")
+        with st.expander(f"⏱️ Çıktı Süreleri ({bundle['mode']}, toplam {bundle['elapsed_ms']} ms{', önbellekten' if bundle['cached'] else ''})", expanded=False):
+            st.dataframe(pd.DataFrame(bundle['timings']), use_container_width=True, hide_index=True)
+
+        with st.expander("👥 Öğrenciye Özel Kitapçıklar", expanded=False):
+            st.caption("Her öğrenci için soru ve şık sırası tohumdan (seed) türetilen ayrı bir kitapçık üretilir. Veritabanında sadece tohum ve öğrenci listesi saklanır; aynı tohumla kitapçıklar birebir yeniden üretilebilir.")
+            c_bk1, c_bk2 = st.columns(2)
+            bk_count = c_bk1.number_input("Öğrenci Sayısı (liste boşsa)", 1, 2000, 30, key="bk_count")
+            bk_seed = c_bk2.text_input("Tohum (Seed)", value=st.session_state.setdefault('booklet_seed', str(random.randint(100000, 999999))), key="bk_seed")
+            bk_roster = st.text_area("Öğrenci Listesi (her satıra bir numara veya ad, opsiyonel)", key="bk_roster", height=100)
+            
+            if st.button("👥 Kitapçıkları Üret", use_container_width=True, key="btn_build_booklets"):
+                labels = [line.strip() for line in bk_roster.splitlines() if line.strip()] or [str(i) for i in range(1, bk_count + 1)]
+                if len(set(labels)) != len(labels):
+                    st.error("Öğrenci listesinde tekrar eden kayıtlar var.")
+                else:
+                    progress_bar = st.progress(0, text="Kitapçıklar hazırlanıyor...")
+                    old_zip = st.session_state.pop('booklet_zip', None)
+                    if old_zip and os.path.exists(old_zip): os.remove(old_zip)
+                    st.session_state['booklet_zip'] = build_student_booklets(
+                        meta, base_questions, bk_seed, labels,
+                        progress=lambda n, total: progress_bar.progress(n / total, text=f"Kitapçık {n}/{total}")
+                    )
+                    if st.session_state.get('final_exam_id'):
+                        db.save_booklet_run(st.session_state['final_exam_id'], bk_seed, labels, st.session_state['user']['Username'], meta)
+                    progress_bar.empty()
+                    st.success(f"✅ {len(labels)} kitapçık üretildi.")
+
+            booklet_zip = st.session_state.get('booklet_zip')
+            if booklet_zip and os.path.exists(booklet_zip):
+                with open(booklet_zip, "rb") as f:
+                    st.download_button(
+                        "📥 Öğrenci Kitapçıklarını İndir (ZIP)", data=f,
+                        file_name=f"{meta['course']}_ogrenci_kitapciklari_{datetime.now().strftime('%Y%m%d')}.zip",
+                        mime="application/zip", use_container_width=True, key="dl_booklets"
+                    )
 
-                docx = ExamDocxEngine(meta, group_name=grp, classical_lines=classical_lines)
-                docx.generate(current_qs)
-                zf.writestr(f"SoruKitapcigi_{grp}_{meta['course']}.docx", docx.get_docx_bytes())
-                
-                docxk = ExamDocxEngine(meta, is_answer_key=True, group_name=grp, classical_lines=classical_lines)
-                docxk.generate(current_qs)
-                zf.writestr(f"CevapAnahtari_{grp}_{meta['course']}.docx", docxk.get_docx_bytes())
-
-        st.download_button(
-            "📦 Tüm Sınav Setini İndir (ZIP)",
-            data=zip_buffer.getvalue(),
-            file_name=f"{meta['course']}_sinav_seti_{datetime.now().strftime('%Y%m%d')}.zip",
-            mime="application/zip",
-            type="primary",
-            use_container_width=True
-        )
         if st.button("➕ Yeni Sınav Oluştur", use_container_width=True):
-            keys_to_delete = ['exam_stage', 'selected_questions', 'exam_meta', 'final_qs', 'temp_scores', 'override_score_check']
+            keys_to_delete = ['exam_stage', 'selected_questions', 'exam_meta', 'final_qs', 'temp_scores', 'override_score_check', 'parallel_forms', 'final_exam_id', 'booklet_zip', 'booklet_seed', 'group_permutations', 'exam_bundle', 'print_pdf']
+            booklet_zip = st.session_state.get('booklet_zip')
+            if booklet_zip and os.path.exists(booklet_zip): os.remove(booklet_zip)
             for key in keys_to_delete:
                 if key in st.session_state: del st.session_state[key]
             st.rerun()
@@ -2828,6 +5922,44 @@ def admin_page():
             st.markdown("---")
         else:
             st.error("Veritabanı dosyası bulunamadı.")
+
+        with st.expander("⏱️ Performans Testleri", expanded=False):
+            st.caption("Ölçümler bellek içi geçici veritabanı üzerinde yapılır, gerçek verilere dokunmaz.")
+            if st.button("Toplu ID İşlemlerini Ölç (10 / 10k / 500k)", key="bench_id_set"):
+                with st.spinner("Ölçülüyor..."):
+                    st.dataframe(pd.DataFrame(benchmark_id_set_ops()), use_container_width=True, hide_index=True)
+            if st.button("Kitapçık Seti Üretimi: Seri / Süreç Havuzu (100 Soru, 4 Grup)", key="bench_bundle"):
+                with st.spinner("Ölçülüyor..."):
+                    st.dataframe(pd.DataFrame(benchmark_bundle_render()), use_container_width=True, hide_index=True)
+            if st.button("PDF Motoru: Font Kaydı ve Alt Küme Önbelleği", key="bench_pdf_fonts"):
+                with st.spinner("Ölçülüyor..."):
+                    st.dataframe(pd.DataFrame(benchmark_pdf_engine()), use_container_width=True, hide_index=True)
+            if st.button("Çıktı Boyut/Süre Raporu (50 Soru, 4 Grup)", key="bench_output_sizes"):
+                with st.spinner("Ölçülüyor..."):
+                    st.dataframe(pd.DataFrame(report_exam_output_sizes()), use_container_width=True, hide_index=True)
+            if st.button("DOCX Üretimi: Düğüm Düğüm / Şablon (100 Soru)", key="bench_docx"):
+                with st.spinner("Ölçülüyor..."):
+                    st.dataframe(pd.DataFrame(benchmark_docx_engines()), use_container_width=True, hide_index=True)
+            if st.button("Parça Önbelleği: Grup Başına Üretim (50 Soru, 4 Grup)", key="bench_fragments"):
+                with st.spinner("Ölçülüyor..."):
+                    st.dataframe(pd.DataFrame(benchmark_fragment_cache()), use_container_width=True, hide_index=True)
+            if st.button("IRT Kalibrasyonu: Simüle Veriden Parametre Geri Kazanımı (3000 Öğrenci, 60 Soru)", key="bench_irt_recovery"):
+                with st.spinner("Ölçülüyor..."):
+                    st.dataframe(pd.DataFrame(verify_irt_recovery()), use_container_width=True, hide_index=True)
+
+        with st.expander("🗄️ AI Cevap Önbelleği", expanded=False):
+            ai_cache = get_ai_response_cache()
+            ai_stats = ai_cache.stats()
+            m_ai1, m_ai2, m_ai3, m_ai4 = st.columns(4)
+            m_ai1.metric("Kayıt", ai_stats['entries'])
+            m_ai2.metric("Boyut (KB)", round(ai_stats['bytes'] / 1024, 1))
+            m_ai3.metric("İsabet Oranı", f"%{ai_stats['hit_rate'] * 100:.0f}")
+            m_ai4.metric("İsabet / Iskalama / Atlama", f"{ai_stats['hits']} / {ai_stats['misses']} / {ai_stats['bypassed']}")
+            st.caption(f"Kayıtlar {AI_CACHE_TTL_SECONDS // 86400} gün geçerlidir; toplam boyut {AI_CACHE_MAX_BYTES // (1024 * 1024)} MB'ı aşınca en eski erişilenler silinir.")
+            if st.button("🗑️ Önbelleği Temizle", key="btn_clear_ai_cache"):
+                ai_cache.clear()
+                st.toast("AI cevap önbelleği temizlendi.", icon="🗑️")
+                st.rerun()
             
     with tab4:
         st.subheader("Sistem Aksiyon Logları")
@@ -2855,13 +5987,17 @@ def history_page():
             
             with col_main:
                 expander_title = f"📄 {ex['Title']} ({ex['CourseCode']}) | Oluşturulma: {datetime.strptime(ex['CreatedAt'].split('.')[0], '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y %H:%M')}"
+                if ex.get('FormGroup'):
+                    expander_title = f"🔗 {expander_title}"
                 
                 with st.expander(expander_title):
                     st.markdown(f"**Durum:** {ex['Status']} | **Toplam Puan:** {ex['TotalScore']}")
                     st.markdown(f"**Oluşturan:** {ex['CreatedBy']}")
+                    if ex.get('FormGroup'):
+                        st.markdown(f"**Paralel Form:** {ex['FormNo']} | **Form Grubu:** `{ex['FormGroup']}`")
                     
                     try:
-                        q_data = json.loads(ex['ExamData'])
+                        q_data = db.get_exam_questions(ex)
                         st.info(f"Bu sınavda toplam **{len(q_data)}** soru bulunmaktadır.")
                         
                         if st.checkbox("Soruları Listele", key=f"view_q_{ex['ExamID']}"):
@@ -2871,6 +6007,44 @@ def history_page():
                                 st.markdown(f"**{i}. ({q['Score']} P)** **{q['QuestionType']}**: {q['QuestionText'][:100]}...")
                                 st.caption(f"Cevap: {q['CorrectAnswer']} | Seçenekler: {opt_str}")
 
+                        group_perms = load_group_permutations(ex.get('GroupPermutations'))
+                        bundle_flag = f"show_bundle_{ex['ExamID']}"
+                        if st.button("📦 Kitapçık Setini Hazırla", key=f"prep_bundle_{ex['ExamID']}"):
+                            st.session_state[bundle_flag] = True
+                        if st.session_state.get(bundle_flag):
+                            exam_meta = exam_output_meta(ex)
+                            q_records = [QuestionRecord.from_row(q) for q in q_data]
+                            if not group_perms:
+                                # Permütasyonu kaydedilmemiş sınavlar: gruplar sınav ayarındaki kitapçık seçiminden (ExamID tohumuyla
+                                # tekrarlanabilir biçimde) türetilir ve değerlendirme aynı kitapçıkları kullansın diye kaydedilir
+                                group_perms = build_group_permutations(q_records, exam_group_names(exam_meta), seed=ex['ExamID'])
+                                db.set_exam_group_permutations(ex['ExamID'], group_perms)
+                            with st.spinner("Kitapçık seti hazırlanıyor..."):
+                                bundle = get_or_build_bundle(exam_meta, q_records, group_perms)
+                            if bundle['key'] != ex.get('BundleHash'):
+                                db.set_exam_bundle_hash(ex['ExamID'], bundle['key'])
+                            with open(bundle['path'], 'rb') as f:
+                                st.download_button(
+                                    f"📥 Kitapçık Setini İndir (ZIP){' - önbellekten' if bundle['cached'] else ''}", data=f,
+                                    file_name=f"{ex['CourseCode']}_sinav_seti_{ex['ExamID']}.zip", mime="application/zip",
+                                    key=f"dl_bundle_{ex['ExamID']}"
+                                )
+
+                        booklet_runs = db.get_booklet_runs(ex['ExamID'])
+                        if booklet_runs:
+                            st.markdown("**👥 Öğrenciye Özel Kitapçık Üretimleri**")
+                            for run in booklet_runs:
+                                c_run1, c_run2 = st.columns([3, 1])
+                                c_run1.caption(f"Tohum: {run['Seed']} | Öğrenci: {run['StudentCount']} | Oluşturan: {run['CreatedBy']} | {run['CreatedAt']}")
+                                if c_run2.button("🔁 Yeniden Üret", key=f"regen_booklets_{run['RunID']}", use_container_width=True):
+                                    run_meta = exam_output_meta(ex, run['Settings'])
+                                    with st.spinner("Kitapçıklar yeniden üretiliyor..."):
+                                        zip_path = build_student_booklets(run_meta, q_data, run['Seed'], run['StudentLabels'])
+                                    with open(zip_path, "rb") as f:
+                                        st.download_button("📥 Kitapçıkları İndir (ZIP)", data=f, file_name=os.path.basename(zip_path),
+                                                           mime="application/zip", key=f"dl_regen_{run['RunID']}")
+                                    os.remove(zip_path)
+
                     except Exception as e:
                         st.error(f"Veri yükleme hatası: {e}")
 
@@ -2915,6 +6089,129 @@ def history_page():
              with col_arc_action:
                  st.info("Arşivlendi")
 
+def grading_page():
+    user = st.session_state['user']
+    st.title("📝 Değerlendirme")
+    
+    exams = db.get_exams(user, status='Final')
+    if not exams:
+        st.info("Değerlendirilecek aktif (Final) bir sınav yok.")
+        return
+    exam_labels = {ex['ExamID']: f"{ex['Title']} ({ex['CourseCode']}) - #{ex['ExamID']}" for ex in exams}
+    exam_id = st.selectbox("Sınav", list(exam_labels), format_func=exam_labels.get, key="grade_exam")
+    ex = next(e for e in exams if e['ExamID'] == exam_id)
+    
+    questions = [QuestionRecord.from_row(q) for q in db.get_exam_questions(ex)]
+    group_perms = load_group_permutations(ex.get('GroupPermutations'))
+    if not group_perms:
+        group_perms = build_group_permutations(questions, ["A"])
+        st.warning("Bu sınav için kitapçık permütasyonu kaydı yok; yalnızca A grubu (orijinal sıra) değerlendirilebilir.")
+    key, points = exam_answer_key(questions)
+    
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Soru Sayısı", len(questions))
+    c2.metric("Optik Değerlendirilen", int((key > 0).sum()))
+    c3.metric("Gruplar", ", ".join(group_perms))
+    if (key == 0).any():
+        st.caption("Klasik sorular ve cevabı tanımlı olmayan sorular optik puanlamaya katılmaz.")
+    
+    st.caption("CSV dosyasında her satır bir öğrencidir: öğrenci numarası/adı, kitapçık grubu ve kitapçıktaki sırayla cevap dizisi "
+               "(ör. `ABD-CEDY`). Boş cevap için '-' veya boşluk, Doğru/Yanlış soruları için D/Y (veya T/F) kullanılır.")
+    up_file = st.file_uploader("Optik Okuyucu Çıktısı (CSV)", type=["csv", "txt"], key="grade_upload")
+    if up_file:
+        try:
+            df_sheet = pd.read_csv(up_file, sep=None, engine='python', dtype=str, keep_default_na=False)
+        except Exception as e:
+            st.error(f"Dosya okunamadı: {e}")
+            return
+        cols = list(df_sheet.columns)
+
+        def guess(names, fallback):
+            for col in cols:
+                if col.strip().lower() in names: return cols.index(col)
+            return min(fallback, len(cols) - 1)
+
+        g1, g2, g3 = st.columns(3)
+        student_col = g1.selectbox("Öğrenci Sütunu", cols, index=guess({'öğrenci', 'ogrenci', 'numara', 'no', 'student'}, 0), key="grade_col_student")
+        group_col = g2.selectbox("Grup Sütunu", cols, index=guess({'grup', 'kitapçık', 'kitapcik', 'group', 'booklet'}, 1), key="grade_col_group")
+        answer_col = g3.selectbox("Cevap Sütunu", cols, index=guess({'cevaplar', 'cevap', 'answers', 'yanıtlar'}, 2), key="grade_col_answers")
+        
+        if st.button("✅ Değerlendir", type="primary", use_container_width=True, key="btn_grade"):
+            start = time.perf_counter()
+            results, invalid = grade_responses(questions, group_perms, df_sheet[student_col].str.strip().tolist(),
+                                               df_sheet[group_col].tolist(), df_sheet[answer_col].tolist())
+            elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+            labels = [r['Öğrenci'] for r in results]
+            if len(set(labels)) != len(labels):
+                st.error("Dosyada tekrar eden öğrenci kayıtları var.")
+            else:
+                if results:
+                    db.save_exam_results(exam_id, results, user['Username'])
+                st.success(f"✅ {len(results)} öğrenci {elapsed_ms} ms içinde değerlendirildi ve kaydedildi.")
+                if invalid:
+                    st.warning(f"{len(invalid)} satırın grubu bu sınavda yok ({', '.join(group_perms)}); bu satırlar atlandı.")
+                    st.dataframe(pd.DataFrame(invalid), use_container_width=True, hide_index=True)
+
+    saved = db.get_exam_results(exam_id)
+    if saved:
+        st.markdown("---")
+        st.subheader("Sonuçlar")
+        df_res = pd.DataFrame(saved).rename(columns={
+            'StudentLabel': 'Öğrenci', 'GroupName': 'Grup', 'CorrectCount': 'Doğru', 'WrongCount': 'Yanlış',
+            'BlankCount': 'Boş', 'Score': 'Puan', 'Responses': 'Cevaplar', 'GradedAt': 'Değerlendirme Zamanı'})
+        df_res = df_res[['Öğrenci', 'Grup', 'Doğru', 'Yanlış', 'Boş', 'Puan', 'Cevaplar', 'Değerlendirme Zamanı']]
+        
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Öğrenci", len(df_res))
+        m2.metric("Ortalama", f"{df_res['Puan'].mean():.2f}")
+        m3.metric("En Yüksek", f"{df_res['Puan'].max():.2f}")
+        m4.metric("En Düşük", f"{df_res['Puan'].min():.2f}")
+        st.dataframe(df_res, use_container_width=True, hide_index=True)
+        
+        excel_data = BytesIO()
+        with pd.ExcelWriter(excel_data, engine='xlsxwriter') as writer:
+            df_res.to_excel(writer, index=False, sheet_name='Sonuçlar')
+        d1, d2 = st.columns(2)
+        d1.download_button(
+            "📥 Excel Olarak İndir", data=excel_data.getvalue(),
+            file_name=f"sonuclar_{ex['CourseCode']}_{exam_id}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True
+        )
+        d2.download_button(
+            "📥 CSV Olarak İndir", data=df_res.to_csv(index=False).encode('utf-8-sig'),
+            file_name=f"sonuclar_{ex['CourseCode']}_{exam_id}.csv", mime="text/csv", use_container_width=True
+        )
+
+        st.markdown("---")
+        st.subheader("📊 Madde Analizi")
+        st.caption("p: doğru cevaplama oranı, r_pb: madde ile kalan puan arasındaki nokta çift serili korelasyon, "
+                   "D: üst ve alt %27'lik grupların doğru oranları farkı. Sonuçlar sınav bazında saklanır; soru bankasındaki değerler "
+                   "analiz edilen tüm sınavların cevap sayısıyla ağırlıklı ortalamasıdır.")
+        if st.button("📊 Madde Analizini Hesapla ve Kaydet", use_container_width=True, key="btn_item_analysis"):
+            analysis = item_analysis(questions, df_res['Cevaplar'].tolist())
+            if analysis['items']:
+                db.save_item_statistics(exam_id, analysis['items'], user['Username'])
+            st.session_state['item_analysis'] = {'exam_id': exam_id, **analysis}
+        
+        analysis = st.session_state.get('item_analysis')
+        if analysis and analysis['exam_id'] == exam_id:
+            if not analysis['items']:
+                st.warning("Madde analizi için en az 2 öğrenci ve optik değerlendirilen soru gereklidir.")
+            else:
+                a1, a2, a3 = st.columns(3)
+                a1.metric("KR-20 Güvenirlik", f"{analysis['kr20']:.3f}" if analysis['kr20'] is not None else "-")
+                a2.metric("Öğrenci", analysis['students'])
+                a3.metric("Hesaplama", f"{analysis['elapsed_ms']} ms")
+                df_items = pd.DataFrame(analysis['items'])
+                df_items['Değerlendirme'] = [
+                    "Gözden geçirilmeli" if r is None or r < 0.2 else "Kabul edilebilir" if r < 0.3 else "İyi"
+                    for r in df_items['r_pb']
+                ]
+                st.dataframe(df_items, use_container_width=True, hide_index=True)
+                if analysis['distractors']:
+                    with st.expander("🎯 Çeldirici Analizi (ÇS Şıkları)", expanded=False):
+                        st.dataframe(pd.DataFrame(analysis['distractors']), use_container_width=True, hide_index=True)
+
 # --------------------------------------------------------------------
 # PAGE ROUTER
 # --------------------------------------------------------------------
@@ -2931,6 +6228,8 @@ def route_page(selected):
         exam_create_page()
     elif selected == "Arşiv":
         history_page()
+    elif selected == "Değerlendirme":
+        grading_page()
     elif selected == "Yönetim":
         admin_page()
 
@@ -3491,6 +6790,7 @@ def main():
         "Soru Bankası": "collection",
         "Sınav Oluştur": "file-earmark-text",
         "Arşiv": "archive",
+        "Değerlendirme": "check2-square",
         "Yönetim": "gear"
     }
     icons = [menu_icons[o] for o in allowed_options]
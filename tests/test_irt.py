@@ -0,0 +1,31 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+
+_spec = importlib.util.spec_from_file_location("app", Path(__file__).resolve().parents[1] / "1.py")
+app = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(app)
+
+
+def test_mml_recovers_simulated_2pl_parameters():
+    for row in app.verify_irt_recovery(seeds=(0, 1)):
+        assert row["Geçti"], row
+
+
+def test_mml_anchored_refit_keeps_fixed_scale():
+    rng = np.random.default_rng(3)
+    n_persons, n_items = 2000, 40
+    a = rng.lognormal(0.2, 0.3, n_items)
+    b = rng.normal(size=n_items)
+    theta = rng.normal(0.5, 1.2, size=n_persons)
+    person = np.repeat(np.arange(n_persons), n_items)
+    item = np.tile(np.arange(n_items), n_persons)
+    y = rng.random(len(person)) < 1.0 / (1.0 + np.exp(-a[item] * (theta[person] - b[item])))
+
+    fixed = np.arange(n_items) < 30
+    _, a_hat, b_hat, _ = app.fit_irt_mml(person, item, y, n_persons, n_items, model='2PL',
+                                          a_init=np.where(fixed, a, np.nan), b_init=np.where(fixed, b, np.nan), fixed=fixed)
+    assert np.array_equal(a_hat[fixed], a[fixed]) and np.array_equal(b_hat[fixed], b[fixed])
+    assert np.sqrt(np.mean((b_hat[~fixed] - b[~fixed]) ** 2)) < 0.15
+    assert np.sqrt(np.mean((a_hat[~fixed] - a[~fixed]) ** 2)) < 0.2